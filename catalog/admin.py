@@ -3,6 +3,7 @@ from django.contrib.auth.models import User
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 
 from . import models
+from .pagination import EstimatedCountPaginator
 
 
 
@@ -33,6 +34,9 @@ class AuthorAdmin(admin.ModelAdmin):
 	inlines = [BookInline]
 	list_display = ('first_name', 'last_name', 'date_of_birth', 'date_of_death')
 	search_fields = ('first_name', 'last_name')
+	# no exact COUNT(*) of the whole table per page view
+	paginator = EstimatedCountPaginator
+	show_full_result_count = False
 	fields = ('first_name', 'last_name', ('date_of_birth', 'date_of_death'))
 
 
@@ -40,7 +44,11 @@ class AuthorAdmin(admin.ModelAdmin):
 class BookInstanceAdmin(admin.ModelAdmin):
 	list_display = ('book', 'id', 'status', 'borrower', 'due_back')
 	list_filter = ('status', 'due_back')
-	search_fields = ('book',)
+	list_select_related = ('book', 'borrower')
+	# prefix lookups can use the title and username indexes
+	search_fields = ('^book__title', '^borrower__username')
+	paginator = EstimatedCountPaginator
+	show_full_result_count = False
 	fieldsets = (
 		(None, {
 			'fields' : ('id', 'book', 'imprint')
@@ -62,7 +70,11 @@ class BookAdmin(admin.ModelAdmin):
 	inlines = [BookInstanceInline]
 	list_display = ('title', 'author', 'display_genre', 'display_language')
 	list_filter = ('genre', 'language')
-	search_fields = ('title', 'genre', 'author')
+	list_select_related = ('author',)
+	# prefix lookups can use the title and author name indexes
+	search_fields = ('^title', '^author__first_name', '^author__last_name', '=genre__name')
+	paginator = EstimatedCountPaginator
+	show_full_result_count = False
 	fieldsets = (
 		(None, {
 			'fields' : ('title', 'summary', ('author', 'isbn'))	
@@ -71,4 +83,29 @@ class BookAdmin(admin.ModelAdmin):
 			'fields' : ('genre', 'language'),
 			'classes' : ('collapse',)
 		}),
-	)
\ No newline at end of file
+	)
+
+	def get_queryset(self, request):
+		# display_genre/display_language read the prefetched rows, two queries per page
+		return super().get_queryset(request).prefetch_related('genre', 'language')
+
+@admin.register(models.OutgoingEmail)
+class OutgoingEmailAdmin(admin.ModelAdmin):
+	list_display = ('subject', 'to', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+	list_filter = ('status',)
+	search_fields = ('to',)
+
+@admin.register(models.OverdueNotice)
+class OverdueNoticeAdmin(admin.ModelAdmin):
+	list_display = ('copy', 'borrower', 'due_back', 'days_overdue', 'fine', 'emailed', 'created_at')
+	list_filter = ('emailed',)
+	list_select_related = ('copy__book', 'borrower')
+	search_fields = ('borrower__username',)
+
+@admin.register(models.Hold)
+class HoldAdmin(admin.ModelAdmin):
+	list_display = ('book', 'member', 'status', 'created_at', 'ready_at')
+	list_filter = ('status',)
+	list_select_related = ('book', 'member')
+	search_fields = ('member__username', 'book__title')
+	raw_id_fields = ('book', 'member', 'copy')
@@ -0,0 +1,291 @@
+"""
+Read-only JSON API over the catalog: books, authors, genres, languages and
+the copies of a book.
+
+- ``?fields=a,b`` selects the fields returned (only those columns are read);
+- ``?embed=author,genre`` inlines related objects instead of their ids, each
+  relation loaded with one prefetch query for the whole page;
+- list endpoints page with keyset cursors (``?after=``/``?before=`` taken
+  from the ``next``/``previous`` urls, ``?limit=`` rows per page), so no
+  COUNT(*) and no OFFSET;
+- responses carry a weak ``ETag`` and ``Last-Modified`` of a stamp read
+  with one query before the payload (see ``catalog.conditional``): the
+  ``updated_at`` of the rows returned and of the related rows they show.
+  Clients revalidate with ``If-None-Match`` or ``If-Modified-Since`` and get
+  a bodyless 304, without the queries of the payload, when nothing changed.
+"""
+import json
+from functools import wraps
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import OuterRef, Prefetch
+from django.http import Http404, HttpResponse, JsonResponse, QueryDict
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+
+from . import models
+from .conditional import count, latest, validators
+from .pagination import KeysetPaginator, InvalidCursor
+
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+
+class ApiError(Exception):
+	""" A bad request, reported to the client as a 400 """
+
+
+class Resource:
+	""" How one model is exposed: its fields, relations to other resources, list ordering and filters """
+
+	def __init__(self, model, fields, ordering, relations=None, filters=None):
+		self.model = model
+		self.fields = fields
+		self.ordering = ordering
+		self.relations = relations or {}
+		self.filters = filters or {}
+
+	def selected_fields(self, request):
+		if not request.GET.get('fields'):
+			return list(self.fields)
+		fields = [name.strip() for name in request.GET['fields'].split(",") if name.strip()]
+		unknown = [name for name in fields if name not in self.fields]
+		if unknown:
+			raise ApiError(f"Unknown field(s): {', '.join(unknown)}. Available: {', '.join(self.fields)}.")
+		return fields
+
+	def embedded(self, request, fields):
+		embed = {name.strip() for name in request.GET.get('embed', "").split(",") if name.strip()}
+		unknown = embed - set(self.relations)
+		if unknown:
+			raise ApiError(f"Cannot embed: {', '.join(sorted(unknown))}.")
+		return embed & set(fields)
+
+	def is_many(self, name):
+		return self.model._meta.get_field(name).many_to_many
+
+	def queryset(self, fields, embed):
+		columns = {'pk'} | {name for name in fields if name != 'id' and not (name in self.relations and self.is_many(name))}
+		# list cursors are made of the ordering columns
+		columns |= {field for field in self.ordering if field != 'pk'}
+		queryset = self.model.objects.only(*columns)
+		for name in fields:
+			if name not in self.relations:
+				continue
+			target = self.relations[name]
+			if name in embed:
+				queryset = queryset.prefetch_related(Prefetch(name, queryset=target.model.objects.only(*target.columns())))
+			elif self.is_many(name):
+				queryset = queryset.prefetch_related(Prefetch(name, queryset=target.model.objects.only('pk')))
+		return queryset
+
+	def columns(self):
+		return ['pk'] + [name for name in self.fields if name != 'id' and name not in self.relations]
+
+	def filter(self, queryset, request):
+		for param, lookup in self.filters.items():
+			value = request.GET.get(param)
+			if value is None:
+				continue
+			try:
+				queryset = queryset.filter(**{lookup : int(value)})
+			except ValueError:
+				raise ApiError(f"{param} must be an id.")
+		return queryset
+
+	def serialize(self, obj, fields, embed=()):
+		data = {}
+		for name in fields:
+			if name == 'id':
+				data[name] = obj.pk
+			elif name not in self.relations:
+				data[name] = getattr(obj, name)
+			elif self.is_many(name):
+				related = getattr(obj, name).all()
+				target = self.relations[name]
+				data[name] = [target.serialize(item, target.plain_fields()) if name in embed else item.pk for item in related]
+			elif name in embed:
+				target = self.relations[name]
+				related = getattr(obj, name)
+				data[name] = target.serialize(related, target.plain_fields()) if related else None
+			else:
+				data[name] = getattr(obj, self.model._meta.get_field(name).attname)
+		return data
+
+	def plain_fields(self):
+		return [name for name in self.fields if name not in self.relations]
+
+	def stamp_rows(self, queryset, fields):
+		""" values_list of what the serialization of each row with ``fields`` depends on """
+		columns = ['pk', 'updated_at']
+		annotations = {}
+		for name in fields:
+			if name not in self.relations:
+				continue
+			field = self.model._meta.get_field(name)
+			if field.many_to_many:
+				related = self.relations[name].model.objects.filter(**{field.related_query_name() : OuterRef('pk')})
+				annotations[f'{name}_updated_at'] = latest(related)
+				annotations[f'{name}_count'] = count(related)
+			else:
+				# the id is cleared without touching updated_at when the related row is deleted
+				columns += [field.attname, f'{name}__updated_at']
+		return queryset.prefetch_related(None).annotate(**annotations).values_list(*columns, *annotations)
+
+
+GENRES = Resource(models.Genre, ('id', 'name'), ('name', 'pk'))
+LANGUAGES = Resource(models.Language, ('id', 'name'), ('name', 'pk'))
+AUTHORS = Resource(models.Author, ('id', 'first_name', 'last_name', 'date_of_birth', 'date_of_death'),
+				   ('last_name', 'first_name', 'pk'))
+BOOKS = Resource(
+	models.Book,
+	('id', 'title', 'summary', 'isbn', 'author', 'genre', 'language', 'copies_total', 'copies_available', 'copies_on_loan'),
+	('title', 'pk'),
+	relations = {'author' : AUTHORS, 'genre' : GENRES, 'language' : LANGUAGES},
+	filters = {'author' : 'author_id', 'genre' : 'genre', 'language' : 'language'},
+)
+COPIES = Resource(models.BookInstance, ('id', 'imprint', 'status', 'due_back'), ('pk',))
+
+RESOURCES = {
+	'books' : BOOKS,
+	'authors' : AUTHORS,
+	'genres' : GENRES,
+	'languages' : LANGUAGES,
+}
+
+
+###########
+# Helpers #
+###########
+
+def api_view(view):
+	""" GET/HEAD only, errors reported as JSON """
+	@wraps(view)
+	@require_safe
+	def wrapper(request, *args, **kwargs):
+		try:
+			return view(request, *args, **kwargs)
+		except ApiError as error:
+			return JsonResponse({'error' : str(error)}, status=400)
+		except Http404:
+			return JsonResponse({'error' : "Not found."}, status=404)
+	return wrapper
+
+
+def json_response(payload):
+	body = json.dumps(payload, cls=DjangoJSONEncoder, separators=(',', ':'))
+	return HttpResponse(body, content_type='application/json')
+
+
+def conditional_json(request, get_stamp, get_payload):
+	""" ``get_payload()`` as JSON, or a 304 if the client's copy of what ``get_stamp()`` stamps is current """
+	stamp = get_stamp()
+	if stamp is None:
+		# missing object: the payload raises the 404
+		return json_response(get_payload())
+	etag, last_modified = validators(request, stamp)
+	response = (get_conditional_response(request, etag=etag, last_modified=last_modified)
+				or json_response(get_payload()))
+	response['ETag'] = etag
+	if last_modified:
+		response['Last-Modified'] = http_date(last_modified)
+	# clients may keep the data but must revalidate it
+	patch_cache_control(response, no_cache=True)
+	return response
+
+
+def get_resource(kind):
+	try:
+		return RESOURCES[kind]
+	except KeyError:
+		raise Http404(kind)
+
+
+def page_url(request, cursor_param, cursor):
+	query = QueryDict(mutable=True)
+	query.update({key : value for key, value in request.GET.items() if key not in ('after', 'before')})
+	query[cursor_param] = cursor
+	return request.build_absolute_uri(f"{request.path}?{query.urlencode()}")
+
+
+def page_limit(request):
+	try:
+		limit = int(request.GET.get('limit', DEFAULT_LIMIT))
+	except ValueError:
+		raise ApiError("limit must be a number.")
+	if not 1 <= limit <= MAX_LIMIT:
+		raise ApiError(f"limit must be between 1 and {MAX_LIMIT}.")
+	return limit
+
+
+def page_stamp(request, resource, queryset, fields):
+	""" The stamp rows of the page of ``queryset`` (and the row after it, which decides ``next``) """
+	keyset = KeysetPaginator(resource.stamp_rows(queryset, fields), resource.ordering, page_limit(request))
+	try:
+		return {'rows' : list(keyset.page_queryset(request.GET.get('after'), request.GET.get('before')))}
+	except InvalidCursor:
+		raise ApiError("Invalid cursor.")
+
+
+def page_payload(request, resource, queryset, fields, embed):
+	keyset = KeysetPaginator(queryset, resource.ordering, page_limit(request))
+	try:
+		page = keyset.page(after=request.GET.get('after'), before=request.GET.get('before'))
+	except InvalidCursor:
+		raise ApiError("Invalid cursor.")
+	return {
+		'results' : [resource.serialize(obj, fields, embed) for obj in page],
+		'next' : page_url(request, 'after', page.next_cursor) if page.has_next() else None,
+		'previous' : page_url(request, 'before', page.previous_cursor) if page.has_previous() else None,
+	}
+
+
+#########
+# Views #
+#########
+
+@api_view
+def resource_list(request, kind):
+	resource = get_resource(kind)
+	fields = resource.selected_fields(request)
+	embed = resource.embedded(request, fields)
+	queryset = resource.filter(resource.queryset(fields, embed), request)
+	return conditional_json(request, lambda: page_stamp(request, resource, queryset, fields),
+							lambda: page_payload(request, resource, queryset, fields, embed))
+
+
+@api_view
+def resource_detail(request, kind, pk):
+	resource = get_resource(kind)
+	fields = resource.selected_fields(request)
+	embed = resource.embedded(request, fields)
+	queryset = resource.queryset(fields, embed).filter(pk=pk)
+	return conditional_json(request, lambda: resource.stamp_rows(queryset, fields).first(),
+							lambda: resource.serialize(get_object_or_404(queryset), fields, embed))
+
+
+@api_view
+def book_copies(request, pk):
+	""" Availability of a book: its copy counters and a page of its copies """
+	fields = COPIES.selected_fields(request)
+	copies = COPIES.queryset(fields, ()).filter(book_id=pk)
+
+	def get_stamp():
+		# the counters are updated with the book's updated_at
+		book_copies = models.BookInstance.objects.filter(book=OuterRef('pk'))
+		return models.Book.objects.filter(pk=pk).values(
+					'updated_at',
+					copies_updated_at = latest(book_copies),
+					copy_count = count(book_copies),
+				).first()
+
+	def get_payload():
+		book = get_object_or_404(models.Book.objects.only(*models.Book.COPY_COUNTERS), pk=pk)
+		payload = {'book' : book.pk, **{counter : getattr(book, counter) for counter in models.Book.COPY_COUNTERS}}
+		payload.update(page_payload(request, COPIES, copies, fields, ()))
+		return payload
+
+	return conditional_json(request, get_stamp, get_payload)
@@ -0,0 +1,140 @@
+"""
+Async versions of the read-heavy catalog pages, routed instead of the sync
+ones when ``CATALOG_ASYNC_VIEWS`` is set (locallibrary/asgi.py sets it).
+
+They reuse the views of ``catalog.views`` with an async ``dispatch``. The
+ORM of Django 3.2 is sync only, so queries, cache calls and rendering run
+in worker threads (``catalog.threads``) and the parts of a page that do not
+depend on each other are awaited together:
+
+- ``index``: the stats row and the visit counter;
+- list pages: the paginator count and the rows of the page stamp;
+- ``BookDetailView``: the cached fragment, the reviews and the member's hold;
+- ``genre_details``: on a fragment miss, the genre and its page of books.
+
+A request waiting on a slow client holds no thread, only the event loop
+(compare with ``manage.py benchmark_servers``).
+"""
+import asyncio
+from functools import wraps
+
+from django.core.paginator import InvalidPage
+from django.shortcuts import get_object_or_404, render
+
+from . import models, views, visits
+from .cache import cached_fragment, cached_fragment_async
+from .conditional import conditional_page, respond_async
+from .pagination import InvalidCursor, paginate_request
+from .stats import get_catalog_stats
+from .threads import run
+
+
+class AsyncViewMixin:
+	""" Async ``dispatch`` for the ConditionalPageMixin views, GET and HEAD are served by ``get_async`` """
+
+	@classmethod
+	def as_view(cls, **initkwargs):
+		view = super().as_view(**initkwargs)
+
+		# Django 3.2 only awaits views that are coroutine functions
+		@wraps(view)
+		async def async_view(request, *args, **kwargs):
+			return await view(request, *args, **kwargs)
+		return async_view
+
+	async def dispatch(self, request, *args, **kwargs):
+		if request.method not in ('GET', 'HEAD'):
+			return await run(super().dispatch, request, *args, **kwargs)
+		return await respond_async(request, self.get_stamp_async, self.get_async)
+
+	async def get_stamp_async(self):
+		return await run(self.get_stamp)
+
+	async def get_async(self):
+		# TemplateResponses are rendered here, not on Django's single sync thread
+		return await run(lambda: self.get(self.request, *self.args, **self.kwargs).render())
+
+
+class AsyncListMixin(AsyncViewMixin):
+	""" AsyncViewMixin for the ConditionalListMixin list views """
+
+	async def get_stamp_async(self):
+		try:
+			paginator, number, rows = await run(self.stamp_rows)
+		except (InvalidCursor, InvalidPage):
+			return None
+		if paginator is None:
+			return self.stamp(None, None, await run(list, rows))
+		# the count is kept by the paginator for the page itself
+		_, rows = await asyncio.gather(run(getattr, paginator, 'count'), run(list, rows))
+		return self.stamp(paginator, number, rows)
+
+
+#############
+# Home page #
+#############
+
+def record_visit():
+	visits.record_visit()
+	return visits.pending_visits()
+
+
+async def index(request):
+	""" Home page, see ``catalog.views.index`` """
+	stats, pending = await asyncio.gather(run(get_catalog_stats), run(record_visit))
+	num_visits = visits.visitor_count(request)
+	response = await run(render, request, "index.html", views.index_context(stats, num_visits, pending))
+	visits.remember_visitor_count(response, num_visits + 1)
+	return response
+
+
+#########################
+# List and detail pages #
+#########################
+
+class BookListView(AsyncListMixin, views.BookListView):
+	pass
+
+
+class AuthorListView(AsyncListMixin, views.AuthorListView):
+	pass
+
+
+class BookDetailView(AsyncViewMixin, views.BookDetailView):
+
+	async def get_async(self):
+		request = self.request
+		pk = self.kwargs['pk']
+		parts = [
+			run(cached_fragment, 'book-detail', request, [('book', pk)], self.build_fragment),
+			run(list, self.get_reviews(pk)),
+		]
+		# request.user was loaded by respond_async
+		if request.user.is_authenticated:
+			parts.append(run(self.get_hold, pk))
+		fragment, reviews, *hold = await asyncio.gather(*parts)
+
+		context = {
+			'book_pk' : pk,
+			'fragment' : fragment,
+			'reviews' : reviews,
+		}
+		if hold:
+			context['hold'] = hold[0]
+		return await run(render, request, self.template_name, context=context)
+
+
+@conditional_page(views.genre_stamp)
+async def genre_details(request, pk):
+	""" Genre page, see ``catalog.views.genre_details`` """
+	async def build_fragment():
+		genre, (page, is_paginated) = await asyncio.gather(
+			run(get_object_or_404, models.Genre, id=pk),
+			run(paginate_request, request, views.genre_books(pk), ('title', 'pk'), views.GENRE_BOOKS_PER_PAGE),
+		)
+		return await run(views.genre_fragment, request, genre, page, is_paginated)
+
+	context = {
+		'fragment' : await cached_fragment_async('genre-detail', request, [('genre', pk)], build_fragment),
+	}
+	return await run(render, request, "genre_detail.html", context=context)
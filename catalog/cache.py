@@ -0,0 +1,118 @@
+"""
+Versioned fragment cache for the book, author and genre detail pages.
+
+Every cacheable object has a version token stored in the cache under
+``catalog:version:<kind>:<pk>``. A fragment key contains the version tokens
+of every object the fragment depends on, so invalidating an object is just
+deleting its version key (see ``bump``): the next read draws a fresh random
+token and all fragments built with the old one are never looked up again
+(they expire on their own timeout). ``catalog.signals`` bumps versions from
+``post_save``/``post_delete``/``m2m_changed``; code that writes with
+queryset ``update()``/``bulk_create`` bumps them itself.
+
+Fragments only contain markup that is the same for every visitor. User
+specific parts of a page (reviews, staff buttons) are rendered around them.
+They are built from the primary database: a lagging read replica would
+cache the old rows under the new version.
+"""
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import routers
+from .threads import run
+
+
+FRAGMENT_TIMEOUT = getattr(settings, 'CATALOG_FRAGMENT_CACHE_TIMEOUT', 60 * 60)
+
+# An expired version only turns its fragments into misses, so this just has
+# to outlive them
+VERSION_TIMEOUT = FRAGMENT_TIMEOUT * 2
+
+FRAGMENT_NAMES = ('book-detail', 'author-detail', 'genre-detail')
+
+
+def version_key(kind, pk):
+	return f"catalog:version:{kind}:{pk}"
+
+
+def get_versions(dependencies):
+	""" Version tokens of (kind, pk) pairs in one cache round trip """
+	keys = [version_key(kind, pk) for kind, pk in dependencies]
+	versions = cache.get_many(keys)
+	for key in keys:
+		if key not in versions:
+			cache.add(key, uuid.uuid4().hex, VERSION_TIMEOUT)
+			versions[key] = cache.get(key)
+	return [versions[key] for key in keys]
+
+
+def bump(kind, *pks):
+	""" Invalidate every fragment depending on the given objects """
+	cache.delete_many([version_key(kind, pk) for pk in pks if pk is not None])
+
+
+def fragment_key(name, request, dependencies):
+	# the query string selects the page of paginated fragments
+	query = hashlib.md5(request.GET.urlencode().encode()).hexdigest()
+	versions = ".".join(get_versions(dependencies))
+	return f"catalog:fragment:{name}:{query}:{versions}"
+
+
+def count(name, outcome):
+	key = f"catalog:fragment-stats:{name}:{outcome}"
+	try:
+		cache.incr(key)
+	except ValueError:
+		cache.set(key, 1, None)
+
+
+def lookup_fragment(name, request, dependencies):
+	""" (key, cached fragment or None), counting the hit or miss """
+	key = fragment_key(name, request, dependencies)
+	fragment = cache.get(key)
+	count(name, "misses" if fragment is None else "hits")
+	return key, fragment
+
+
+def cached_fragment(name, request, dependencies, build):
+	"""
+	Return the fragment ``name`` for ``request``, calling ``build()`` on a miss.
+
+	``build`` returns any picklable value (typically a dict of rendered html
+	and the few fields the surrounding page needs).
+	"""
+	key, fragment = lookup_fragment(name, request, dependencies)
+	if fragment is None:
+		routers.pin_to_primary()
+		fragment = build()
+		cache.set(key, fragment, FRAGMENT_TIMEOUT)
+	return fragment
+
+
+async def cached_fragment_async(name, request, dependencies, build):
+	""" ``cached_fragment`` for async views, ``build()`` is awaited """
+	key, fragment = await run(lookup_fragment, name, request, dependencies)
+	if fragment is None:
+		routers.pin_to_primary()
+		fragment = await build()
+		await run(cache.set, key, fragment, FRAGMENT_TIMEOUT)
+	return fragment
+
+
+def fragment_stats():
+	""" Hit/miss counters (and hit ratio) per fragment name """
+	keys = [f"catalog:fragment-stats:{name}:{outcome}" for name in FRAGMENT_NAMES for outcome in ("hits", "misses")]
+	counters = cache.get_many(keys)
+	stats = {}
+	for name in FRAGMENT_NAMES:
+		hits = counters.get(f"catalog:fragment-stats:{name}:hits", 0)
+		misses = counters.get(f"catalog:fragment-stats:{name}:misses", 0)
+		stats[name] = {
+			'hits' : hits,
+			'misses' : misses,
+			'hit_ratio' : round(hits / (hits + misses), 3) if hits + misses else None,
+		}
+	return stats
@@ -0,0 +1,243 @@
+"""
+HTTP validators and cache headers for the public catalog pages.
+
+A page's *stamp* is a small value that changes whenever what the page shows
+changes: the ``updated_at`` of the objects on it (set by ``save()``, by the
+queryset updates of loans, holds and copy counters, and on books whose
+genres or languages change) and row counts, which catch deletions. The
+stamp is read with one query before the view runs (list pages also need
+their paginator count, cached for long lists). The weak ETag hashes it
+with the url and Last-Modified is its latest timestamp, so a revisit with
+matching validators gets a 304 without the page's queries or rendering.
+A deletion leaves no ``updated_at`` behind: the counts in the stamp change
+the ETag, and the time of the last deletion of a catalog row
+(``record_deletion``, from ``catalog.signals``) is part of Last-Modified
+so clients revalidating with ``If-Modified-Since`` only see it too.
+
+Only anonymous GET/HEAD requests are handled this way: their pages are the
+same for every visitor, so they are also publicly cacheable for
+``CATALOG_PUBLIC_PAGE_MAX_AGE`` seconds, with ``Vary: Cookie`` keeping the
+pages of logged in members apart. Pages for members are marked private.
+Requests with pending messages are served normally (messages show once).
+The async views of ``catalog.async_views`` go through ``respond_async``.
+
+Stamps are read from the primary database and the request stays pinned to
+it (see ``catalog.routers``), so validators are never those of a lagging
+replica and the page served with them is read from the same data.
+"""
+import asyncio
+import datetime
+import hashlib
+from calendar import timegm
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.core.paginator import InvalidPage, PageNotAnInteger
+from django.db.models import F, Func, IntegerField, Subquery
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils import timezone
+from django.utils.http import http_date
+
+from . import routers
+from .pagination import InvalidCursor
+from .threads import run
+
+
+PUBLIC = 'public'
+PRIVATE = 'private'
+
+DELETION_KEY = 'catalog:conditional:last-deletion'
+
+
+def latest(queryset, field='updated_at'):
+	""" Scalar subquery: the latest ``field`` among the rows of ``queryset`` """
+	return Subquery(queryset.order_by().values(latest=Func(F(field), function='MAX')).values('latest'))
+
+
+def count(queryset):
+	""" Scalar subquery: the number of rows of ``queryset`` """
+	counted = queryset.order_by().values(count=Func(F('pk'), function='COUNT', output_field=IntegerField()))
+	return Subquery(counted.values('count'), output_field=IntegerField())
+
+
+def stamp_values(stamp):
+	if isinstance(stamp, dict):
+		stamp = list(stamp.values())
+	if isinstance(stamp, (list, tuple)):
+		for value in stamp:
+			yield from stamp_values(value)
+	else:
+		yield stamp
+
+
+def record_deletion():
+	""" Move the Last-Modified of every page forward, for rows that were deleted """
+	cache.set(DELETION_KEY, timezone.now(), None)
+
+
+def last_deletion():
+	deleted = cache.get(DELETION_KEY)
+	if deleted is None:
+		# unknown (the cache was cleared): as if just now
+		cache.add(DELETION_KEY, timezone.now(), None)
+		deleted = cache.get(DELETION_KEY)
+	return deleted
+
+
+def validators(request, stamp):
+	""" (weak ETag, Last-Modified as a timestamp) of a page stamp """
+	etag = 'W/"%s"' % hashlib.md5(repr((request.get_full_path(), stamp)).encode()).hexdigest()
+	timestamps = [value for value in stamp_values(stamp) if isinstance(value, datetime.datetime)]
+	return etag, timegm(max(timestamps + [last_deletion()]).utctimetuple())
+
+
+def cache_policy(request):
+	""" PUBLIC (stamped), PRIVATE or None (no cache headers) for a request """
+	if request.method not in ('GET', 'HEAD'):
+		return None
+	if request.user.is_authenticated:
+		return PRIVATE
+	if get_messages(request):
+		return None
+	return PUBLIC
+
+
+def uncached(response, policy):
+	if policy == PRIVATE:
+		patch_cache_control(response, private=True)
+	return response
+
+
+def stamped(response, etag, last_modified):
+	if response.status_code in (200, 304):
+		response['ETag'] = etag
+		if last_modified:
+			response['Last-Modified'] = http_date(last_modified)
+		patch_cache_control(response, public=True, max_age=getattr(settings, 'CATALOG_PUBLIC_PAGE_MAX_AGE', 60))
+	patch_vary_headers(response, ('Cookie',))
+	return response
+
+
+def respond(request, get_stamp, view):
+	""" Run ``view()`` unless the client's copy of the page stamped ``get_stamp()`` is current """
+	policy = cache_policy(request)
+	if policy != PUBLIC:
+		return uncached(view(), policy)
+
+	routers.pin_to_primary()
+	stamp = get_stamp()
+	if stamp is None:
+		# missing object or bad page: the view answers
+		return view()
+	etag, last_modified = validators(request, stamp)
+	response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+	return stamped(response or view(), etag, last_modified)
+
+
+async def respond_async(request, get_stamp, view):
+	""" ``respond`` for async views: ``get_stamp()`` and ``view()`` are awaited """
+	policy = await run(cache_policy, request)
+	if policy != PUBLIC:
+		return uncached(await view(), policy)
+
+	routers.pin_to_primary()
+	stamp = await get_stamp()
+	if stamp is None:
+		return await view()
+	etag, last_modified = await run(validators, request, stamp)
+	response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+	return stamped(response or await view(), etag, last_modified)
+
+
+def conditional_page(get_stamp):
+	"""
+	Decorator for function views (sync or async), ``get_stamp(request,
+	*args, **kwargs)`` returns the page stamp or None
+	"""
+	def decorator(view):
+		if asyncio.iscoroutinefunction(view):
+			@wraps(view)
+			async def async_wrapper(request, *args, **kwargs):
+				return await respond_async(request, lambda: run(get_stamp, request, *args, **kwargs),
+										   lambda: view(request, *args, **kwargs))
+			return async_wrapper
+
+		@wraps(view)
+		def wrapper(request, *args, **kwargs):
+			return respond(request, lambda: get_stamp(request, *args, **kwargs), lambda: view(request, *args, **kwargs))
+		return wrapper
+	return decorator
+
+
+class ConditionalPageMixin:
+	""" View mixin answering 304 for pages whose ``get_stamp()`` did not change """
+
+	def get_stamp(self):
+		return None
+
+	def dispatch(self, request, *args, **kwargs):
+		return respond(request, self.get_stamp, lambda: super(ConditionalPageMixin, self).dispatch(request, *args, **kwargs))
+
+
+class ConditionalListMixin(ConditionalPageMixin):
+	"""
+	ListView pages stamped with ``stamp_fields`` of the rows on the page (in
+	order) and, for numbered pages, the paginator count. Rows are read with
+	``values_list`` so only those columns are fetched; the paginator is kept
+	for the view so the count is not run twice.
+	"""
+	stamp_fields = ('pk', 'updated_at')
+	stamped_paginator = None
+
+	def stamp_rows(self):
+		"""
+		(paginator, page number, queryset of the page's ``stamp_fields``),
+		paginator and number are None for keyset pages. The number is only
+		checked against the count by ``stamp``.
+		"""
+		queryset = self.get_queryset()
+		page_size = self.get_paginate_by(queryset)
+		after = self.request.GET.get('after')
+		before = self.request.GET.get('before')
+
+		if hasattr(self, 'get_keyset_paginator'):
+			keyset = self.get_keyset_paginator(queryset, page_size)
+			if after or before:
+				return (None, None, keyset.page_queryset(after, before).values_list(*self.stamp_fields))
+			queryset = keyset.queryset
+
+		paginator = self.stamped_paginator = self.get_paginator(queryset, page_size)
+		page = self.request.GET.get('page') or 1
+		if page == 'last':
+			number = paginator.num_pages
+		else:
+			try:
+				number = int(page)
+			except ValueError:
+				raise PageNotAnInteger("That page number is not an integer")
+		start = (max(number, 1) - 1) * page_size
+		return (paginator, number, paginator.object_list[start:start + page_size].values_list(*self.stamp_fields))
+
+	def stamp(self, paginator, number, rows):
+		""" The stamp of the page rows read from ``stamp_rows``, None for a page out of range """
+		if paginator is None:
+			return {'rows' : rows}
+		try:
+			paginator.validate_number(number)
+		except InvalidPage:
+			return None
+		return {'count' : paginator.count, 'rows' : rows}
+
+	def get_stamp(self):
+		try:
+			paginator, number, rows = self.stamp_rows()
+		except (InvalidCursor, InvalidPage):
+			return None
+		return self.stamp(paginator, number, list(rows))
+
+	def get_paginator(self, queryset, per_page, *args, **kwargs):
+		if self.stamped_paginator is not None and self.stamped_paginator.per_page == per_page:
+			return self.stamped_paginator
+		return super().get_paginator(queryset, per_page, *args, **kwargs)
@@ -0,0 +1,97 @@
+"""
+Denormalized copy counters on ``Book``.
+
+``copies_total``, ``copies_available`` and ``copies_on_loan`` are adjusted
+with F() expressions whenever a copy is created, deleted, changes status or
+moves to another book: from model signals for ``save()``/``delete()``
+(forms, admin), and explicitly by code writing copies with queryset
+``update()``/``bulk_create`` (``catalog.loans``, the importer). The
+``repair_copy_counts`` command recomputes them from scratch.
+"""
+from collections import Counter
+
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Book, BookInstance
+
+
+STATUS_COUNTERS = {
+	'a' : 'copies_available',
+	'o' : 'copies_on_loan',
+}
+
+
+def copy_counters(status):
+	""" Counter fields a copy in ``status`` contributes to """
+	counters = ['copies_total']
+	if status in STATUS_COUNTERS:
+		counters.append(STATUS_COUNTERS[status])
+	return counters
+
+
+def adjust_copy_counts(book_id, **deltas):
+	""" Apply counter deltas to one book in one UPDATE """
+	deltas = {field: delta for field, delta in deltas.items() if delta}
+	if book_id is None or not deltas:
+		return
+	Book.objects.filter(pk=book_id).update(
+		updated_at=timezone.now(), **{field: F(field) + delta for field, delta in deltas.items()}
+	)
+
+
+def copy_moved(old_book_id, old_status, new_book_id, new_status):
+	"""
+	Adjust the counters for a copy going from (old_book_id, old_status) to
+	(new_book_id, new_status). Pass None as old book for a new copy and as new
+	book for a deleted one.
+	"""
+	changes = Counter()
+	if old_book_id is not None:
+		for field in copy_counters(old_status):
+			changes[(old_book_id, field)] -= 1
+	if new_book_id is not None:
+		for field in copy_counters(new_status):
+			changes[(new_book_id, field)] += 1
+
+	for book_id in {book_id for book_id, _ in changes}:
+		adjust_copy_counts(book_id, **{field: delta for (changed, field), delta in changes.items() if changed == book_id})
+
+
+def counts_for(copies):
+	""" Counter values of unsaved ``copies`` per book id, for bulk inserts """
+	counts = {}
+	for copy in copies:
+		book_counts = counts.setdefault(copy.book_id, Counter())
+		for field in copy_counters(copy.status):
+			book_counts[field] += 1
+	return counts
+
+
+def live_count(status=None):
+	copies = BookInstance.objects.filter(book=OuterRef('pk'))
+	if status:
+		copies = copies.filter(status__exact=status)
+	count = copies.order_by().values('book').annotate(count=Count('pk')).values('count')
+	return Coalesce(Subquery(count, output_field=IntegerField()), Value(0))
+
+
+def recount_copies(books=None):
+	"""
+	Recompute the counters of ``books`` (default all) with one UPDATE from
+	correlated subqueries, returns how many books had drifted.
+	"""
+	books = Book.objects.all() if books is None else books
+	live = {
+		'copies_total' : live_count(),
+		'copies_available' : live_count('a'),
+		'copies_on_loan' : live_count('o'),
+	}
+	drifted = books.alias(**{f"live_{field}" : value for field, value in live.items()}).filter(
+		~Q(copies_total=F('live_copies_total'))
+		| ~Q(copies_available=F('live_copies_available'))
+		| ~Q(copies_on_loan=F('live_copies_on_loan'))
+	).count()
+	books.update(**live)
+	return drifted
@@ -26,6 +26,24 @@ class RenewBookForm(forms.Form):
 		return date
 
 
+class LoanFilterForm(forms.Form):
+	overdue = forms.BooleanField(required=False, label="Overdue only")
+	borrower = forms.CharField(required=False, max_length=150,
+								widget=forms.TextInput(attrs={"placeholder":"username"}))
+	due_after = forms.DateField(required=False, widget=DateInput(), label="Due from")
+	due_before = forms.DateField(required=False, widget=DateInput(), label="Due until")
+
+	def clean(self):
+		cleaned_data = super().clean()
+		due_after = cleaned_data.get('due_after')
+		due_before = cleaned_data.get('due_before')
+
+		if due_after and due_before and due_after > due_before:
+			raise ValidationError(_("Invalid dates - 'Due from' is after 'Due until'."))
+
+		return cleaned_data
+
+
 class SignupForm(UserCreationForm):
 	class Meta:
 		model = User
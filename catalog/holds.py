@@ -0,0 +1,144 @@
+"""
+Hold (reservation) queue on books.
+
+Members queue on a ``Book``. When a copy comes back (``loans.return_copy``)
+or the member it was reserved for cancels, the copy is allocated to the
+oldest waiting hold and moved to the Reserved status until that member
+collects it (``loans.collect_hold``). A hold placed while copies are on the
+shelf gets one of them at once.
+
+Like the loans, allocation uses conditional UPDATEs instead of row locks:
+the oldest waiting hold is read from the (book, status, created_at, id)
+index, one seek whatever the length of the queue, and claimed with an
+UPDATE that re-checks it is still waiting. When a concurrent allocation
+claimed it first the UPDATE matches nothing and the next hold is tried, so
+no hold ever gets two copies and no copy two holds.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import BookInstance, Hold
+from .copies import copy_moved
+from .outbox import queue_mail
+from .stats import adjust_catalog_stats
+from . import cache
+
+
+ACTIVE = ('w', 'r')
+
+NOTICE_FROM_EMAIL = "lib_admin@mojo.com"
+
+
+def place_hold(book_id, member):
+	""" Queue ``member`` for the book, None if they already hold it """
+	if Hold.objects.filter(book_id=book_id, member=member, status__in=ACTIVE).exists():
+		return None
+	try:
+		with transaction.atomic():
+			hold = Hold.objects.create(book_id=book_id, member=member)
+	except IntegrityError:
+		# a concurrent request queued them first (catalog_hold_active_once)
+		return None
+	reserve_shelved_copies(book_id)
+	# the book page shows the queue length
+	cache.bump('book', book_id)
+	hold.refresh_from_db()
+	return hold
+
+
+def reserve_shelved_copies(book_id):
+	""" Allocate the book's available copies to its waiting holds, no copy comes back for those """
+	while Hold.objects.filter(book_id=book_id, status__exact='w').exists():
+		copy_id = BookInstance.objects.filter(book_id=book_id, status__exact='a').values_list('pk', flat=True).first()
+		if copy_id is None:
+			return
+		# a copy taken meanwhile is simply not allocated, the next one is tried
+		allocate_copy(copy_id, book_id, from_status='a')
+
+
+def queue_position(hold):
+	""" 1-based place of a waiting hold in its book's queue """
+	ahead = Hold.objects.filter(book_id=hold.book_id, status__exact='w').filter(
+		Q(created_at__lt=hold.created_at) | Q(created_at=hold.created_at, pk__lt=hold.pk)
+	)
+	return ahead.count() + 1
+
+
+def claim_next_hold(book_id, copy_id):
+	""" Reserve ``copy_id`` for the oldest waiting hold on the book, returns the hold id or None """
+	waiting = Hold.objects.filter(book_id=book_id, status__exact='w')
+	while True:
+		hold_id = waiting.order_by('created_at', 'pk').values_list('pk', flat=True).first()
+		if hold_id is None:
+			return None
+		if waiting.filter(pk=hold_id).update(status='r', copy_id=copy_id, ready_at=timezone.now()):
+			return hold_id
+
+
+def notify_ready(hold_id):
+	hold = Hold.objects.select_related('book', 'member').get(pk=hold_id)
+	if hold.member.email:
+		queue_mail(
+			subject = f"Your hold on {hold.book.title} is ready",
+			message = f"Hello {hold.member.username}, a copy of {hold.book.title} is reserved for you. "
+					  f"Collect it from your holds page.",
+			from_email = NOTICE_FROM_EMAIL,
+			recipient_list = [hold.member.email],
+		)
+
+
+def copy_status_changed(book_id, old_status, new_status):
+	""" Counters and cache for a copy status change made with update() """
+	copy_moved(book_id, old_status, book_id, new_status)
+	adjust_catalog_stats(num_instances_available=int(new_status == 'a') - int(old_status == 'a'))
+	cache.bump('book', book_id)
+
+
+def allocate_copy(copy_id, book_id, from_status):
+	"""
+	Give a copy that just became free (currently in ``from_status``) to the
+	next waiting hold, moving it to Reserved. Returns the hold id, or None
+	when nobody is waiting or the copy changed meanwhile.
+	"""
+	hold_id = claim_next_hold(book_id, copy_id)
+	if hold_id is None:
+		return None
+
+	reserved = BookInstance.objects.filter(
+					pk=copy_id, status__exact=from_status
+				).update(
+					status='r', borrower=None, due_back=None, updated_at=timezone.now()
+				)
+	if not reserved:
+		# the copy went elsewhere, the hold keeps its place in the queue
+		Hold.objects.filter(pk=hold_id, status__exact='r', copy_id=copy_id).update(status='w', copy=None, ready_at=None)
+		return None
+
+	copy_status_changed(book_id, from_status, 'r')
+	notify_ready(hold_id)
+	return hold_id
+
+
+def release_copy(copy_id, book_id):
+	""" A reserved copy is no longer wanted: pass it down the queue or shelve it """
+	if allocate_copy(copy_id, book_id, from_status='r'):
+		return
+	if BookInstance.objects.filter(pk=copy_id, status__exact='r').update(status='a', updated_at=timezone.now()):
+		copy_status_changed(book_id, 'r', 'a')
+
+
+def cancel_hold(hold_id, member):
+	""" Leave the queue, releasing the reserved copy if any. False if not active """
+	while True:
+		hold = Hold.objects.filter(pk=hold_id, member=member, status__in=ACTIVE).first()
+		if hold is None:
+			return False
+		# re-read if a copy was allocated to the hold meanwhile
+		if Hold.objects.filter(pk=hold.pk, status__exact=hold.status).update(status='c', copy=None):
+			break
+	if hold.status == 'r' and hold.copy_id:
+		release_copy(hold.copy_id, hold.book_id)
+	else:
+		cache.bump('book', hold.book_id)
+	return True
@@ -0,0 +1,262 @@
+"""
+Streaming bulk import of books, authors, genres, languages and copies.
+
+Records come from CSV (header row) or JSON Lines and are processed in
+fixed-size batches, so memory use does not grow with the input. Columns:
+
+    title, summary, isbn       required (isbn is the deduplication key)
+    author                     "First Last", or author_first_name / author_last_name
+    genres, languages          names separated by ";" (lists in JSON Lines)
+    copies                     number of copies to create (default 1, at most MAX_COPIES)
+    imprint, status            for the copies: available (a, the default) or maintenance (m)
+
+Records that are not objects, rows without a title or ISBN, with a column
+of the wrong type, with an unreadable or too large number of copies or with
+another copy status are counted as invalid and skipped. Copies on loan or
+reserved are never imported: they need a borrower or a hold.
+
+Authors, genres and languages are matched by name against the database the
+first time they are seen and kept in lookup caches afterwards. Books whose
+ISBN already exists (in the database or earlier in the input) are skipped.
+
+Everything is inserted with ``bulk_create``, so model signals do not run;
+the home page counters, search index and detail page fragment versions are
+updated per batch instead.
+"""
+import csv
+import json
+import time
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Q
+
+from . import models
+from .search import index_books
+from .stats import adjust_catalog_stats, summary_has_featured_word
+from .utils import batched
+from . import cache
+
+
+LIST_SEPARATOR = ";"
+
+MAX_COPIES = 100
+
+COPY_STATUSES = ('a', 'm')
+
+TEXT_COLUMNS = ('title', 'summary', 'isbn', 'author', 'author_first_name', 'author_last_name', 'imprint', 'status')
+LIST_COLUMNS = ('genres', 'languages')
+
+
+def read_csv(stream):
+	yield from csv.DictReader(stream)
+
+
+def read_jsonl(stream):
+	for line in stream:
+		line = line.strip()
+		if line:
+			yield json.loads(line)
+
+
+READERS = {
+	'csv' : read_csv,
+	'jsonl' : read_jsonl,
+}
+
+
+def split_list(value):
+	if isinstance(value, (list, tuple)):
+		return [str(item).strip() for item in value if str(item).strip()]
+	return [item.strip() for item in (value or "").split(LIST_SEPARATOR) if item.strip()]
+
+
+def well_formed(record):
+	""" A record is a mapping of text columns, lists may also be given as lists """
+	if not isinstance(record, dict):
+		return False
+	if any(not isinstance(record.get(column), (str, type(None))) for column in TEXT_COLUMNS):
+		return False
+	return all(isinstance(record.get(column), (str, list, tuple, type(None))) for column in LIST_COLUMNS)
+
+
+def author_name(record):
+	if record.get('author_first_name') or record.get('author_last_name'):
+		return ((record.get('author_first_name') or "").strip(), (record.get('author_last_name') or "").strip())
+	name = (record.get('author') or "").strip()
+	if not name:
+		return None
+	first, _, last = name.rpartition(" ")
+	return (first, last) if first else (last, "")
+
+
+class CatalogImporter:
+	""" Imports records batch by batch, keeping natural key -> pk caches between batches """
+
+	def __init__(self, batch_size=500, default_status='a', log=None):
+		self.batch_size = batch_size
+		self.default_status = default_status
+		self.log = log or (lambda message: None)
+		self.authors = {}
+		self.genres = {}
+		self.languages = {}
+		self.seen_isbns = set()
+		self.totals = Counter()
+
+	def run(self, records):
+		start = time.perf_counter()
+		for batch in batched(records, self.batch_size):
+			self.import_batch(batch)
+			elapsed = time.perf_counter() - start
+			rate = self.totals['rows'] / elapsed if elapsed else 0
+			self.log(f"{self.totals['rows']} rows read, {self.totals['books']} books created ({rate:.0f} rows/s)")
+		return self.totals
+
+	###########
+	# Lookups #
+	###########
+
+	def resolve_names(self, model, cache, names):
+		""" Fill ``cache`` (name -> pk) for ``names`` creating missing rows, returns how many were created """
+		missing = {name for name in names if name not in cache}
+		if not missing:
+			return 0
+		for pk, name in model.objects.filter(name__in=missing).values_list('pk', 'name'):
+			cache[name] = pk
+		new = [model(name=name) for name in missing if name not in cache]
+		if new:
+			model.objects.bulk_create(new)
+			for pk, name in model.objects.filter(name__in=[obj.name for obj in new]).values_list('pk', 'name'):
+				cache[name] = pk
+			self.totals[f"{model._meta.model_name}s"] += len(new)
+		return len(new)
+
+	def resolve_authors(self, names):
+		""" Fill the (first name, last name) -> pk cache, returns how many authors were created """
+		missing = {name for name in names if name not in self.authors}
+		if not missing:
+			return 0
+		lookup = Q()
+		for first, last in missing:
+			lookup |= Q(first_name=first, last_name=last)
+		for pk, first, last in models.Author.objects.filter(lookup).values_list('pk', 'first_name', 'last_name'):
+			self.authors.setdefault((first, last), pk)
+		new = [name for name in missing if name not in self.authors]
+		if new:
+			models.Author.objects.bulk_create(models.Author(first_name=first, last_name=last) for first, last in new)
+			lookup = Q()
+			for first, last in new:
+				lookup |= Q(first_name=first, last_name=last)
+			for pk, first, last in models.Author.objects.filter(lookup).values_list('pk', 'first_name', 'last_name'):
+				self.authors.setdefault((first, last), pk)
+			self.totals['authors'] += len(new)
+		return len(new)
+
+	##########
+	# Writes #
+	##########
+
+	def clean_batch(self, batch):
+		""" Drop invalid and duplicate records, returns them keyed by ISBN """
+		records = {}
+		for record in batch:
+			self.totals['rows'] += 1
+			if not well_formed(record):
+				self.totals['invalid'] += 1
+				continue
+			isbn = (record.get('isbn') or "").strip()
+			title = (record.get('title') or "").strip()
+			if (not isbn or not title or len(isbn) > 13
+					or self.copy_count(record) is None or self.copy_status(record) is None):
+				self.totals['invalid'] += 1
+				continue
+			if isbn in self.seen_isbns or isbn in records:
+				self.totals['duplicates'] += 1
+				continue
+			records[isbn] = record
+
+		existing = set(models.Book.objects.filter(isbn__in=list(records)).values_list('isbn', flat=True))
+		self.totals['duplicates'] += len(existing)
+		self.seen_isbns.update(records)
+		return {isbn: record for isbn, record in records.items() if isbn not in existing}
+
+	def copy_count(self, record):
+		""" Number of copies of the record, None when not a number from 0 to MAX_COPIES """
+		try:
+			count = int(record.get('copies') or 1)
+		except (TypeError, ValueError):
+			return None
+		return count if 0 <= count <= MAX_COPIES else None
+
+	def copy_status(self, record):
+		""" Status of the copies of the record, None when not one of COPY_STATUSES """
+		status = (record.get('status') or self.default_status).strip()
+		return status if status in COPY_STATUSES else None
+
+	@transaction.atomic
+	def import_batch(self, batch):
+		records = self.clean_batch(batch)
+		if not records:
+			return
+
+		new_authors = self.resolve_authors(filter(None, (author_name(record) for record in records.values())))
+		new_genres = self.resolve_names(models.Genre, self.genres,
+						   {name for record in records.values() for name in split_list(record.get('genres'))})
+		self.resolve_names(models.Language, self.languages,
+						   {name for record in records.values() for name in split_list(record.get('languages'))})
+
+		statuses = {
+			isbn : [self.copy_status(record)] * self.copy_count(record)
+			for isbn, record in records.items()
+		}
+		models.Book.objects.bulk_create(
+			models.Book(
+				title = record['title'].strip(),
+				summary = (record.get('summary') or "").strip(),
+				isbn = isbn,
+				author_id = self.authors.get(author_name(record)),
+				# copies are bulk inserted below, without signals
+				copies_total = len(statuses[isbn]),
+				copies_available = statuses[isbn].count('a'),
+				copies_on_loan = statuses[isbn].count('o'),
+			)
+			for isbn, record in records.items()
+		)
+		# MySQL does not return primary keys from bulk inserts, read them back by ISBN
+		books = list(models.Book.objects.filter(isbn__in=list(records)).select_related('author'))
+		book_ids = {book.isbn: book.pk for book in books}
+
+		BookGenre = models.Book.genre.through
+		BookLanguage = models.Book.language.through
+		BookGenre.objects.bulk_create(
+			BookGenre(book_id=book_ids[isbn], genre_id=self.genres[name])
+			for isbn, record in records.items() for name in set(split_list(record.get('genres')))
+		)
+		BookLanguage.objects.bulk_create(
+			BookLanguage(book_id=book_ids[isbn], language_id=self.languages[name])
+			for isbn, record in records.items() for name in set(split_list(record.get('languages')))
+		)
+
+		copies = [
+			models.BookInstance(
+				book_id = book_ids[isbn],
+				imprint = (record.get('imprint') or "").strip(),
+				status = status,
+			)
+			for isbn, record in records.items() for status in statuses[isbn]
+		]
+		models.BookInstance.objects.bulk_create(copies)
+
+		index_books(books)
+		adjust_catalog_stats(
+			num_books = len(books),
+			num_word_books = sum(summary_has_featured_word(book.summary) for book in books),
+			num_instances = len(copies),
+			num_instances_available = sum(copy.status == 'a' for copy in copies),
+			num_authors = new_authors,
+			num_genres = new_genres,
+		)
+		cache.bump('author', *{book.author_id for book in books})
+		cache.bump('genre', *{self.genres[name] for record in records.values() for name in split_list(record.get('genres'))})
+		self.totals['books'] += len(books)
+		self.totals['copies'] += len(copies)
@@ -0,0 +1,265 @@
+"""
+Sampled per-view instrumentation of the catalog views.
+
+``InstrumentationMiddleware`` (catalog.middleware) records a fraction
+(``CATALOG_INSTRUMENTATION_SAMPLE_RATE``) of the requests. For a sampled
+request every query on every database connection goes through an
+``execute_wrapper`` that counts and times it, and the outermost template
+renders are timed by the ``TimedDjangoTemplates`` backend (TEMPLATES). Requests that are not sampled only cost one random draw.
+The async views run their queries in worker threads (``catalog.threads``),
+which join the recording of their request with ``watching``.
+
+A sampled request to a ``catalog.views`` (``catalog.async_views``,
+``catalog.api``) endpoint produces:
+
+- one structured (JSON) log line on the ``catalog.instrumentation`` logger,
+  at WARNING when the same SQL ran at least
+  ``CATALOG_INSTRUMENTATION_REPEAT_WARNING`` times (the N+1 pattern);
+- counters per url name added up in the cache, read back by ``view_stats``
+  for the staff stats endpoint.
+
+Duplicates are counted two ways: ``duplicate_queries`` are exact repeats
+(same SQL and parameters, the result could have been reused) and
+``similar_queries`` repeats of the same SQL with other parameters (a query
+per row). Template time includes the queries the templates run lazily.
+Streaming responses are recorded without a size, and the queries run while
+streaming are not seen.
+"""
+import json
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.template.backends.django import DjangoTemplates
+
+
+logger = logging.getLogger(__name__)
+
+VIEW_MODULES = ('catalog.views', 'catalog.async_views', 'catalog.api')
+
+METRICS = ('requests', 'queries', 'duplicate_queries', 'similar_queries', 'db_us', 'template_us', 'bytes')
+
+_recording = ContextVar('catalog_instrumentation', default=None)
+
+
+def sample_rate():
+	return getattr(settings, 'CATALOG_INSTRUMENTATION_SAMPLE_RATE', 0.01)
+
+
+def repeat_warning():
+	return getattr(settings, 'CATALOG_INSTRUMENTATION_REPEAT_WARNING', 5)
+
+
+def should_sample():
+	rate = sample_rate()
+	return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
+class Recording:
+	""" Queries and template time of one request (also the execute wrapper) """
+
+	def __init__(self):
+		# queries of an async view come from several threads
+		self.lock = threading.Lock()
+		self.queries = 0
+		self.db_time = 0.0
+		self.template_time = 0.0
+		self.rendering = False
+		self.statements = Counter()
+		self.shapes = Counter()
+
+	def __call__(self, execute, sql, params, many, context):
+		start = time.perf_counter()
+		try:
+			return execute(sql, params, many, context)
+		finally:
+			elapsed = time.perf_counter() - start
+			with self.lock:
+				self.db_time += elapsed
+				self.queries += 1
+				self.statements[(sql, repr(params))] += 1
+				self.shapes[sql] += 1
+
+	@property
+	def duplicate_queries(self):
+		return sum(n - 1 for n in self.statements.values())
+
+	@property
+	def similar_queries(self):
+		return sum(n - 1 for n in self.shapes.values()) - self.duplicate_queries
+
+	def most_repeated(self):
+		""" (sql, times) of the most repeated statement, None if nothing ran twice """
+		if not self.shapes:
+			return None
+		sql, times = self.shapes.most_common(1)[0]
+		return (sql, times) if times > 1 else None
+
+
+@contextmanager
+def recording():
+	""" Record the queries and template renders of the enclosed code """
+	current = Recording()
+	token = _recording.set(current)
+	try:
+		with watching():
+			yield current
+	finally:
+		_recording.reset(token)
+
+
+@contextmanager
+def watching():
+	""" Add the queries of this thread's connections to the active recording, if any """
+	current = _recording.get()
+	with ExitStack() as stack:
+		if current is not None:
+			for alias in connections:
+				connection = connections[alias]
+				# already wrapped by an enclosing block of the same thread
+				if current not in connection.execute_wrappers:
+					stack.enter_context(connection.execute_wrapper(current))
+		yield current
+
+
+##################
+# Template timer #
+##################
+
+class TimedTemplate:
+	""" A template of ``TimedDjangoTemplates``: its renders are timed while a recording is active """
+
+	def __init__(self, template):
+		self.template = template
+
+	def __getattr__(self, name):
+		return getattr(self.template, name)
+
+	def render(self, context=None, request=None):
+		current = _recording.get()
+		# templates rendered while another one renders are already timed
+		if current is None or current.rendering:
+			return self.template.render(context, request)
+		current.rendering = True
+		start = time.perf_counter()
+		try:
+			return self.template.render(context, request)
+		finally:
+			current.template_time += time.perf_counter() - start
+			current.rendering = False
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+	""" The Django template backend, with the renders of its templates timed """
+
+	def from_string(self, template_code):
+		return TimedTemplate(super().from_string(template_code))
+
+	def get_template(self, template_name):
+		return TimedTemplate(super().get_template(template_name))
+
+
+#############
+# Reporting #
+#############
+
+def view_name(request):
+	""" Url name of the catalog view that handled the request, None for other views """
+	match = getattr(request, 'resolver_match', None)
+	if match is None or match.func.__module__ not in VIEW_MODULES:
+		return None
+	return match.url_name
+
+
+def counter_key(view, metric):
+	return f"catalog:instrumentation:{view}:{metric}"
+
+
+def add(key, value):
+	try:
+		cache.incr(key, value)
+	except ValueError:
+		cache.add(key, 0, None)
+		cache.incr(key, value)
+
+
+def record(request, current, response, elapsed):
+	""" Log and add up a finished sampled request """
+	view = view_name(request)
+	if view is None:
+		return None
+
+	size = None if response.streaming else len(response.content)
+	line = {
+		'view' : view,
+		'method' : request.method,
+		'status' : response.status_code,
+		'ms' : round(elapsed * 1000, 2),
+		'queries' : current.queries,
+		'db_ms' : round(current.db_time * 1000, 2),
+		'template_ms' : round(current.template_time * 1000, 2),
+		'bytes' : size,
+		'duplicate_queries' : current.duplicate_queries,
+		'similar_queries' : current.similar_queries,
+	}
+	repeated = current.most_repeated()
+	if repeated:
+		line['most_repeated'] = {'sql' : repeated[0], 'times' : repeated[1]}
+	level = logging.WARNING if repeated and repeated[1] >= repeat_warning() else logging.INFO
+	logger.log(level, json.dumps(line))
+
+	counters = {
+		'requests' : 1,
+		'queries' : current.queries,
+		'duplicate_queries' : current.duplicate_queries,
+		'similar_queries' : current.similar_queries,
+		'db_us' : int(current.db_time * 1e6),
+		'template_us' : int(current.template_time * 1e6),
+		'bytes' : size or 0,
+	}
+	for metric, value in counters.items():
+		add(counter_key(view, metric), value)
+	if repeated:
+		cache.set(counter_key(view, 'most_repeated'), line['most_repeated'], None)
+	return line
+
+
+def catalog_view_names():
+	from .urls import urlpatterns
+	return [pattern.name for pattern in urlpatterns if pattern.name]
+
+
+def view_stats():
+	""" Averages per sampled request for every catalog view sampled so far """
+	views = catalog_view_names()
+	keys = [counter_key(view, metric) for view in views for metric in METRICS + ('most_repeated',)]
+	counters = cache.get_many(keys)
+	stats = {}
+	for view in views:
+		requests = counters.get(counter_key(view, 'requests'), 0)
+		if not requests:
+			continue
+		total = lambda metric: counters.get(counter_key(view, metric), 0)
+		stats[view] = {
+			'sampled_requests' : requests,
+			'avg_queries' : round(total('queries') / requests, 2),
+			'avg_duplicate_queries' : round(total('duplicate_queries') / requests, 2),
+			'avg_similar_queries' : round(total('similar_queries') / requests, 2),
+			'avg_db_ms' : round(total('db_us') / requests / 1000, 2),
+			'avg_template_ms' : round(total('template_us') / requests / 1000, 2),
+			'avg_bytes' : round(total('bytes') / requests),
+			'most_repeated' : counters.get(counter_key(view, 'most_repeated')),
+		}
+	return {'sample_rate' : sample_rate(), 'views' : stats}
+
+
+def reset_stats():
+	cache.delete_many([counter_key(view, metric) for view in catalog_view_names()
+					   for metric in METRICS + ('most_repeated',)])
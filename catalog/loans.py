@@ -0,0 +1,107 @@
+"""
+Borrow, return and renew operations on book copies.
+
+Each operation is a single conditional UPDATE touching only the loan
+columns: the WHERE clause carries the precondition (copy available, copy on
+loan to this member, ...) so concurrent requests cannot both succeed and no
+row lock is held between reading and writing. The functions return whether
+the update applied; callers report a conflict when it did not.
+
+Queryset updates bypass model signals, so the home page counters, the
+book's copy counters and the book detail fragment version are updated here.
+A returned copy goes to the next member waiting for the book, if any (see
+``catalog.holds``).
+"""
+import datetime
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import BookInstance, Hold
+from .holds import allocate_copy
+from .stats import adjust_catalog_stats
+from .copies import adjust_copy_counts
+from . import cache
+
+
+LOAN_PERIOD = datetime.timedelta(weeks=3)
+
+
+def default_due_date():
+	return datetime.date.today() + LOAN_PERIOD
+
+
+def copy_book_id(copy_id, book_id=None):
+	""" The copy's book (callers pass ``book_id`` when known to save a query) """
+	if book_id is None:
+		book_id = BookInstance.objects.filter(pk=copy_id).values_list('book_id', flat=True).first()
+	return book_id
+
+
+def copy_changed(copy_id, book_id=None):
+	""" Invalidate the detail page of the copy's book """
+	cache.bump('book', copy_book_id(copy_id, book_id))
+
+
+def borrow_copy(copy_id, user, due_back=None, book_id=None):
+	""" Lend an available copy to ``user``, False if it is no longer available """
+	updated = BookInstance.objects.filter(
+					pk=copy_id, status__exact='a'
+				).update(
+					status='o', borrower=user, due_back=due_back or default_due_date(), updated_at=timezone.now()
+				)
+	if updated:
+		book_id = copy_book_id(copy_id, book_id)
+		adjust_catalog_stats(num_instances_available=-1)
+		adjust_copy_counts(book_id, copies_available=-1, copies_on_loan=1)
+		copy_changed(copy_id, book_id)
+	return bool(updated)
+
+
+def return_copy(copy_id, user, book_id=None):
+	"""
+	Take back a copy ``user`` has on loan and is not overdue. The copy is
+	reserved for the oldest waiting hold on its book, or goes to maintenance
+	before being shelved again. False if the precondition failed.
+	"""
+	not_overdue = Q(due_back__isnull=True) | Q(due_back__gte=datetime.date.today())
+	updated = BookInstance.objects.filter(
+					not_overdue, pk=copy_id, status__exact='o', borrower=user
+				).update(
+					status='m', borrower=None, due_back=None, updated_at=timezone.now()
+				)
+	if updated:
+		book_id = copy_book_id(copy_id, book_id)
+		adjust_copy_counts(book_id, copies_on_loan=-1)
+		copy_changed(copy_id, book_id)
+		allocate_copy(copy_id, book_id, from_status='m')
+	return bool(updated)
+
+
+def renew_copy(copy_id, due_back, book_id=None):
+	""" Move the due date of a copy on loan, False if it is not on loan """
+	updated = BookInstance.objects.filter(
+					pk=copy_id, status__exact='o'
+				).update(
+					due_back=due_back, updated_at=timezone.now()
+				)
+	if updated:
+		copy_changed(copy_id, book_id)
+	return bool(updated)
+
+
+def collect_hold(hold_id, user, due_back=None):
+	""" Lend the copy reserved for ``user``'s ready hold, False if it is not ready """
+	hold = Hold.objects.filter(pk=hold_id, member=user, status__exact='r').values('copy_id', 'book_id').first()
+	if hold is None or hold['copy_id'] is None:
+		return False
+	updated = BookInstance.objects.filter(
+					pk=hold['copy_id'], status__exact='r'
+				).update(
+					status='o', borrower=user, due_back=due_back or default_due_date(), updated_at=timezone.now()
+				)
+	if updated:
+		Hold.objects.filter(pk=hold_id, status__exact='r').update(status='f')
+		adjust_copy_counts(hold['book_id'], copies_on_loan=1)
+		copy_changed(hold['copy_id'], hold['book_id'])
+	return bool(updated)
@@ -0,0 +1,64 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+
+SESSION_ENGINES = {
+	'db' : 'django.contrib.sessions.backends.db',
+	'cached_db' : 'django.contrib.sessions.backends.cached_db',
+	'cache' : 'django.contrib.sessions.backends.cache',
+	'signed_cookies' : 'django.contrib.sessions.backends.signed_cookies',
+}
+
+BENCHMARK_USERNAME = "benchmark-home-page"
+
+
+class Command(BaseCommand):
+	help = ("Measure home page throughput and queries per request with each session "
+			"backend, for an anonymous visitor and a logged in member.")
+
+	def add_arguments(self, parser):
+		parser.add_argument('--requests', type=int, default=200,
+							help="Requests per backend and visitor type.")
+		parser.add_argument('--backends', nargs='+', choices=sorted(SESSION_ENGINES),
+							default=['db', 'cached_db', 'cache', 'signed_cookies'])
+
+	def handle(self, *args, **options):
+		self.requests = options['requests']
+		member, _ = User.objects.get_or_create(username=BENCHMARK_USERNAME)
+		try:
+			self.stdout.write(f"{'backend':<16}{'visitor':<10}{'req/s':>10}{'queries/req':>13}{'session q/req':>15}")
+			for backend in options['backends']:
+				# the session middleware loads its store when the client's handler is built
+				with override_settings(SESSION_ENGINE=SESSION_ENGINES[backend], ALLOWED_HOSTS=['testserver']):
+					for visitor in ('anonymous', 'member'):
+						client = Client()
+						if visitor == 'member':
+							client.force_login(member)
+						rate, queries, session_queries = self.measure(client)
+						self.stdout.write(f"{backend:<16}{visitor:<10}{rate:>10.1f}{queries:>13.2f}{session_queries:>15.2f}")
+		finally:
+			member.delete()
+
+	def measure(self, client):
+		url = reverse('index')
+		# warm up (session creation, stats row, template loading)
+		client.get(url)
+
+		start = time.perf_counter()
+		for _ in range(self.requests):
+			client.get(url)
+		elapsed = time.perf_counter() - start
+
+		# counted separately so the query log does not slow the timed run
+		sample = min(self.requests, 20)
+		with CaptureQueriesContext(connection) as captured:
+			for _ in range(sample):
+				client.get(url)
+		session_queries = [q for q in captured.captured_queries if 'django_session' in q['sql']]
+		return (self.requests / elapsed, len(captured.captured_queries) / sample, len(session_queries) / sample)
@@ -0,0 +1,261 @@
+import collections
+import datetime
+import json
+import math
+import random
+import statistics
+import subprocess
+import threading
+import time
+
+from django.contrib.auth.models import Permission, User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from catalog import models, instrumentation
+from catalog.holds import copy_status_changed
+from catalog.loans import default_due_date
+from catalog.seed import seed_library
+
+
+ENDPOINTS = ('index', 'books', 'book-detail', 'authors', 'genres', 'my-borrowed', 'all-borrowed', 'borrow-return')
+
+BENCHMARK_MEMBER = "benchmark-http-member"
+BENCHMARK_LIBRARIAN = "benchmark-http-librarian"
+
+
+def percentile(ordered, fraction):
+	""" Nearest-rank percentile of an ordered list """
+	return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def summarize(samples, elapsed):
+	timings = sorted(seconds for seconds, _, _ in samples)
+	return {
+		'requests' : len(samples),
+		'errors' : sum(1 for _, _, status in samples if status >= 400),
+		'throughput_rps' : round(len(samples) / elapsed, 1) if elapsed else None,
+		'mean_ms' : round(statistics.mean(timings) * 1000, 2),
+		'p50_ms' : round(percentile(timings, 0.50) * 1000, 2),
+		'p95_ms' : round(percentile(timings, 0.95) * 1000, 2),
+		'p99_ms' : round(percentile(timings, 0.99) * 1000, 2),
+		'queries_per_request' : round(statistics.mean(queries for _, queries, _ in samples), 2),
+	}
+
+
+def git_commit():
+	try:
+		return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+							  text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+class Command(BaseCommand):
+	help = ("Drive the main catalog pages and the borrow/return flow through the Django "
+			"test client, optionally with concurrent clients and after seeding a synthetic "
+			"library, and print latency percentiles, throughput and queries per request "
+			"as JSON (progress goes to stderr). Compare two runs with --baseline.")
+
+	def add_arguments(self, parser):
+		parser.add_argument('--seed-books', type=int, default=0,
+							help="Seed this many synthetic books (3 copies each) before measuring.")
+		parser.add_argument('--requests', type=int, default=100,
+							help="Timed requests per endpoint (borrow/return cycles for the flow).")
+		parser.add_argument('--concurrency', type=int, default=1,
+							help="Client threads per endpoint. Needs a database that allows "
+								 "concurrent connections (not an in-memory SQLite).")
+		parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS, default=list(ENDPOINTS))
+		parser.add_argument('--seed', type=int, default=None,
+							help="Random seed for the synthetic data and the pages requested.")
+		parser.add_argument('--label', default=None,
+							help="Name of the run in the report (defaults to the git commit).")
+		parser.add_argument('--output', default=None, help="Also write the JSON report to this file.")
+		parser.add_argument('--baseline', default=None,
+							help="JSON report of an earlier run to compare against.")
+
+	def handle(self, *args, **options):
+		if options['requests'] < 1 or options['concurrency'] < 1:
+			raise CommandError("--requests and --concurrency must be positive.")
+		self.requests = options['requests']
+		self.concurrency = options['concurrency']
+		self.rng = random.Random(options['seed'])
+
+		seeded = None
+		if options['seed_books']:
+			books = options['seed_books']
+			seeded = seed_library(authors=max(books // 10, 1), books=books, users=max(books // 10, 1),
+								  seed=options['seed'], log=lambda message: self.stderr.write(f"  seeded {message}"))
+
+		self.member, _ = User.objects.get_or_create(username=BENCHMARK_MEMBER)
+		self.librarian, _ = User.objects.get_or_create(username=BENCHMARK_LIBRARIAN)
+		self.librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+		borrower_id = (models.BookInstance.objects.filter(status__exact='o', borrower__isnull=False)
+							.values_list('borrower', flat=True).first())
+		self.borrower = User.objects.filter(pk=borrower_id).first() or self.member
+		self.book_ids = list(models.Book.objects.values_list('pk', flat=True)[:1000])
+		if not self.book_ids:
+			raise CommandError("The catalog has no books, use --seed-books.")
+
+		results = {}
+		try:
+			# the client's host and the sampled instrumentation would distort the numbers
+			with override_settings(ALLOWED_HOSTS=['testserver'], CATALOG_INSTRUMENTATION_SAMPLE_RATE=0):
+				for endpoint in options['endpoints']:
+					self.stderr.write(f"  measuring {endpoint}")
+					results.update(self.measure(endpoint))
+		finally:
+			User.objects.filter(username__in=[BENCHMARK_MEMBER, BENCHMARK_LIBRARIAN]).delete()
+
+		report = {
+			'label' : options['label'] or git_commit(),
+			'date' : datetime.datetime.now().isoformat(timespec='seconds'),
+			'database' : connection.vendor,
+			'requests' : self.requests,
+			'concurrency' : self.concurrency,
+			'seeded' : seeded,
+			'catalog' : {
+				'books' : models.Book.objects.count(),
+				'copies' : models.BookInstance.objects.count(),
+				'users' : User.objects.count(),
+			},
+			'endpoints' : results,
+		}
+		output = json.dumps(report, indent=2)
+		if options['output']:
+			with open(options['output'], 'w') as stream:
+				stream.write(output + "\n")
+		self.stdout.write(output)
+		if options['baseline']:
+			with open(options['baseline']) as stream:
+				self.compare(json.load(stream), report)
+
+	##################
+	# Request makers #
+	##################
+
+	def client(self, user):
+		client = Client()
+		if user is not None:
+			client.force_login(user)
+		return client
+
+	def page_user(self, endpoint):
+		""" Who requests a read-only endpoint (None for anonymous) """
+		return {'my-borrowed' : self.borrower, 'all-borrowed' : self.librarian}.get(endpoint)
+
+	def page_urls(self, endpoint):
+		""" Endless urls of a read-only endpoint """
+		while True:
+			if endpoint == 'book-detail':
+				yield reverse(endpoint, args=[self.rng.choice(self.book_ids)])
+			else:
+				yield reverse(endpoint)
+
+	def timed(self, client, method, url, data=None):
+		start = time.perf_counter()
+		with instrumentation.recording() as current:
+			response = getattr(client, method)(url, data or {})
+		return (time.perf_counter() - start, current.queries, response.status_code)
+
+	###############
+	# Measurement #
+	###############
+
+	def run_workers(self, work, per_worker):
+		""" Run ``work(count)`` on each client thread, returns the wall time """
+		start = time.perf_counter()
+		if self.concurrency == 1:
+			work(per_worker[0])
+		else:
+			def target(count):
+				try:
+					work(count)
+				finally:
+					connection.close()
+			threads = [threading.Thread(target=target, args=(count,)) for count in per_worker]
+			for thread in threads:
+				thread.start()
+			for thread in threads:
+				thread.join()
+		return time.perf_counter() - start
+
+	def split(self, total):
+		return [total // self.concurrency + (n < total % self.concurrency) for n in range(self.concurrency)]
+
+	def measure(self, endpoint):
+		if endpoint == 'borrow-return':
+			return self.measure_borrow_return()
+
+		user = self.page_user(endpoint)
+		urls = self.page_urls(endpoint)
+		# warm up (templates, fragment cache, session)
+		self.client(user).get(next(urls))
+
+		samples = []
+		lock = threading.Lock()
+
+		def work(count):
+			client = self.client(user)
+			local = []
+			for _ in range(count):
+				with lock:
+					url = next(urls)
+				local.append(self.timed(client, 'get', url))
+			with lock:
+				samples.extend(local)
+
+		elapsed = self.run_workers(work, self.split(self.requests))
+		return {endpoint : summarize(samples, elapsed)}
+
+	def measure_borrow_return(self):
+		"""
+		Borrow an available copy and return it, each cycle on a different
+		copy. Returned copies go to maintenance, they are shelved again at the end.
+		"""
+		copies = collections.deque(models.BookInstance.objects.filter(status__exact='a')
+										.values_list('pk', 'book_id', 'imprint')[:self.requests])
+		if not copies:
+			raise CommandError("No available copies to borrow, use --seed-books.")
+		used = list(copies)
+		due_back = default_due_date().isoformat()
+		samples = {'borrow-book' : [], 'return-book' : []}
+		lock = threading.Lock()
+
+		def work(count):
+			client = self.client(self.member)
+			local = {name : [] for name in samples}
+			for _ in range(count):
+				try:
+					pk, book_id, imprint = copies.popleft()
+				except IndexError:
+					break
+				local['borrow-book'].append(self.timed(client, 'post', reverse('borrow-book', args=[pk]),
+												 {'book' : book_id, 'imprint' : imprint, 'due_back' : due_back}))
+				local['return-book'].append(self.timed(client, 'get', reverse('return-book', args=[pk])))
+			with lock:
+				for name, values in local.items():
+					samples[name].extend(values)
+
+		try:
+			elapsed = self.run_workers(work, self.split(len(used)))
+		finally:
+			for pk, book_id, _ in used:
+				if models.BookInstance.objects.filter(pk=pk, status__exact='m').update(status='a'):
+					copy_status_changed(book_id, 'm', 'a')
+		return {name : summarize(values, elapsed) for name, values in samples.items() if values}
+
+	def compare(self, baseline, report):
+		self.stderr.write(f"\nCompared with {baseline.get('label')}:")
+		self.stderr.write(f"{'endpoint':<16}{'p50 ms':>18}{'p95 ms':>18}{'queries/req':>16}")
+		for name, current in report['endpoints'].items():
+			before = baseline.get('endpoints', {}).get(name)
+			if not before:
+				continue
+			columns = [f"{before[key]:>8} ->{current[key]:>8}" for key in ('p50_ms', 'p95_ms', 'queries_per_request')]
+			# cache misses make the query count of the detail pages vary a little between runs
+			regressed = (current['queries_per_request'] > before['queries_per_request'] * 1.1
+						 or current['p95_ms'] > before['p95_ms'] * 1.2)
+			self.stderr.write(f"{name:<16}{columns[0]:>18}{columns[1]:>18}{columns[2]:>16}" + ("  REGRESSION" if regressed else ""))
@@ -0,0 +1,106 @@
+import statistics
+import time
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+
+from catalog import models, views
+from catalog.seed import seed_library
+
+
+class Command(BaseCommand):
+	help = ("Report query plans and timings of the loan related view querysets, "
+			"optionally seeding a large dataset first and comparing against the same "
+			"queries with the BookInstance composite indexes dropped.")
+
+	def add_arguments(self, parser):
+		parser.add_argument('--seed-books', type=int, default=0,
+							help="Seed this many synthetic books (3 copies each) before measuring.")
+		parser.add_argument('--repeat', type=int, default=5,
+							help="Timed runs per query, the median is reported.")
+		parser.add_argument('--compare', action='store_true',
+							help="Also measure with the composite loan indexes temporarily dropped "
+								 "(needs --seed-books or --i-know).")
+		parser.add_argument('--i-know', action='store_true',
+							help="Allow --compare to drop the indexes of a database this run did not seed.")
+		parser.add_argument('--no-plans', action='store_true',
+							help="Only print timings.")
+
+	def handle(self, *args, **options):
+		if options['compare'] and not (options['seed_books'] or options['i_know']):
+			# dropping indexes stalls every loan query of a live library
+			raise CommandError(f"--compare drops the BookInstance indexes of the {connection.alias!r} database "
+							   f"({connection.settings_dict['NAME']}): seed it with --seed-books in this run, "
+							   f"or pass --i-know.")
+		if options['seed_books']:
+			books = options['seed_books']
+			summary = seed_library(authors=max(books // 10, 1), books=books, users=max(books // 10, 1),
+								   log=lambda message: self.stdout.write(f"  seeded {message}"))
+			self.stdout.write(f"Seeded run {summary['tag']}.")
+
+		self.repeat = options['repeat']
+		self.show_plans = not options['no_plans']
+
+		with_indexes = self.measure_all("with indexes")
+		if options['compare']:
+			indexes = models.BookInstance._meta.indexes
+			with connection.schema_editor() as editor:
+				for index in indexes:
+					editor.remove_index(models.BookInstance, index)
+			try:
+				without_indexes = self.measure_all("without composite indexes")
+			finally:
+				with connection.schema_editor() as editor:
+					for index in indexes:
+						editor.add_index(models.BookInstance, index)
+
+			self.stdout.write("\nSpeed-up from indexes (median page + count time):")
+			for name, timing in with_indexes.items():
+				before = without_indexes[name]
+				ratio = before / timing if timing else float('inf')
+				self.stdout.write(f"  {name:<28} {before * 1000:9.2f} ms -> {timing * 1000:9.2f} ms  ({ratio:.1f}x)")
+
+	def view_queryset(self, view_class, user=None, **params):
+		""" The queryset the view would page for a GET with ``params`` """
+		request = RequestFactory().get("/", params)
+		request.user = user or AnonymousUser()
+		view = view_class()
+		view.setup(request)
+		return view.get_queryset()
+
+	def querysets(self):
+		borrower_id = (models.BookInstance.objects.filter(status__exact='o', borrower__isnull=False)
+							.values_list('borrower', flat=True).first())
+		borrower = User.objects.filter(pk=borrower_id).first()
+
+		querysets = {
+			'all-borrowed' : self.view_queryset(views.LibrarianListView),
+			'all-borrowed (overdue)' : self.view_queryset(views.LibrarianListView, overdue="on"),
+			'books (available)' : self.view_queryset(views.BookListView, q="available"),
+			'stats: copies available' : models.BookInstance.objects.filter(status__exact='a'),
+		}
+		if borrower:
+			querysets['my-borrowed'] = self.view_queryset(views.BorrowerListView, user=borrower)
+		return querysets
+
+	def time_queryset(self, queryset):
+		timings = []
+		for _ in range(self.repeat):
+			start = time.perf_counter()
+			list(queryset.all()[:25])
+			queryset.count()
+			timings.append(time.perf_counter() - start)
+		return statistics.median(timings)
+
+	def measure_all(self, label):
+		self.stdout.write(self.style.MIGRATE_HEADING(f"\n== {label} =="))
+		results = {}
+		for name, queryset in self.querysets().items():
+			results[name] = self.time_queryset(queryset)
+			self.stdout.write(f"{name:<28} {results[name] * 1000:9.2f} ms")
+			if self.show_plans:
+				for line in queryset.all()[:25].explain().splitlines():
+					self.stdout.write(f"    {line}")
+		return results
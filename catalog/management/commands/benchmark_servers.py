@@ -0,0 +1,262 @@
+import asyncio
+import datetime
+import io
+import json
+import random
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+from django.urls import reverse
+
+from catalog import models, threads
+from catalog.seed import seed_library
+from .benchmark_http import git_commit, percentile
+
+
+ENDPOINTS = ('index', 'books', 'book-detail', 'authors', 'genre-detail')
+
+
+def summarize(samples, elapsed):
+	timings = sorted(seconds for seconds, _ in samples)
+	return {
+		'requests' : len(samples),
+		'errors' : sum(1 for _, status in samples if status >= 400),
+		'throughput_rps' : round(len(samples) / elapsed, 1) if elapsed else None,
+		'mean_ms' : round(statistics.mean(timings) * 1000, 2),
+		'p50_ms' : round(percentile(timings, 0.50) * 1000, 2),
+		'p95_ms' : round(percentile(timings, 0.95) * 1000, 2),
+		'p99_ms' : round(percentile(timings, 0.99) * 1000, 2),
+	}
+
+
+class Command(BaseCommand):
+	help = ("Serve the read-heavy catalog pages through Django's WSGI or ASGI handler in "
+			"process, with many concurrent anonymous clients that each take --client-delay "
+			"to receive a response, and print throughput and latency percentiles as JSON. "
+			"A WSGI worker thread is held while its client reads, an ASGI request only "
+			"waits on the event loop. Run once per server and compare with --baseline: "
+			"'manage.py benchmark_servers --server wsgi --output wsgi.json', then "
+			"'CATALOG_ASYNC_VIEWS=1 manage.py benchmark_servers --server asgi --baseline wsgi.json'.")
+
+	def add_arguments(self, parser):
+		parser.add_argument('--server', choices=('wsgi', 'asgi'), default='wsgi')
+		parser.add_argument('--clients', type=int, default=50, help="Concurrent clients.")
+		parser.add_argument('--workers', type=int, default=8,
+							help="Threads serving WSGI requests, or running the blocking calls under ASGI.")
+		parser.add_argument('--client-delay', type=float, default=100,
+							help="Milliseconds each client takes to receive a response.")
+		parser.add_argument('--requests', type=int, default=200, help="Timed requests per endpoint.")
+		parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS, default=list(ENDPOINTS))
+		parser.add_argument('--seed-books', type=int, default=0,
+							help="Seed this many synthetic books (3 copies each) before measuring.")
+		parser.add_argument('--seed', type=int, default=None,
+							help="Random seed for the synthetic data and the pages requested.")
+		parser.add_argument('--label', default=None,
+							help="Name of the run in the report (defaults to the server and git commit).")
+		parser.add_argument('--output', default=None, help="Also write the JSON report to this file.")
+		parser.add_argument('--baseline', default=None,
+							help="JSON report of an earlier run to compare against.")
+
+	def handle(self, *args, **options):
+		if min(options['clients'], options['workers'], options['requests']) < 1 or options['client_delay'] < 0:
+			raise CommandError("--clients, --workers and --requests must be positive, --client-delay not negative.")
+		self.clients = options['clients']
+		self.workers = options['workers']
+		self.delay = options['client_delay'] / 1000
+		self.requests = options['requests']
+		self.rng = random.Random(options['seed'])
+		server = options['server']
+		if server == 'asgi' and not settings.CATALOG_ASYNC_VIEWS:
+			self.stderr.write("  the catalog pages are sync views, set CATALOG_ASYNC_VIEWS=1 to measure the async ones")
+		if server == 'asgi' and not threads.concurrent_queries():
+			self.stderr.write("  the async views run their queries one at a time, concurrent queries need CONN_MAX_AGE")
+
+		seeded = None
+		if options['seed_books']:
+			books = options['seed_books']
+			seeded = seed_library(authors=max(books // 10, 1), books=books, users=max(books // 10, 1),
+								  seed=options['seed'], log=lambda message: self.stderr.write(f"  seeded {message}"))
+		self.book_ids = list(models.Book.objects.values_list('pk', flat=True)[:1000])
+		self.genre_ids = list(models.Genre.objects.values_list('pk', flat=True)[:1000])
+		if not self.book_ids or not self.genre_ids:
+			raise CommandError("The catalog has no books or genres, use --seed-books.")
+		# the workers open their own connections
+		connection.close()
+
+		results = {}
+		with override_settings(ALLOWED_HOSTS=['testserver'], CATALOG_INSTRUMENTATION_SAMPLE_RATE=0):
+			for endpoint in options['endpoints']:
+				self.stderr.write(f"  measuring {endpoint}")
+				urls = [self.url(endpoint) for _ in range(self.requests + 1)]
+				if server == 'wsgi':
+					samples, elapsed = self.serve_wsgi(urls)
+				else:
+					samples, elapsed = asyncio.run(self.serve_asgi(urls))
+				results[endpoint] = summarize(samples, elapsed)
+
+		report = {
+			'label' : options['label'] or f"{server} {git_commit() or ''}".strip(),
+			'date' : datetime.datetime.now().isoformat(timespec='seconds'),
+			'server' : server,
+			'async_views' : settings.CATALOG_ASYNC_VIEWS,
+			'database' : connection.vendor,
+			'clients' : self.clients,
+			'workers' : self.workers,
+			'client_delay_ms' : options['client_delay'],
+			'requests' : self.requests,
+			'seeded' : seeded,
+			'endpoints' : results,
+		}
+		output = json.dumps(report, indent=2)
+		if options['output']:
+			with open(options['output'], 'w') as stream:
+				stream.write(output + "\n")
+		self.stdout.write(output)
+		if options['baseline']:
+			with open(options['baseline']) as stream:
+				self.compare(json.load(stream), report)
+
+	def url(self, endpoint):
+		if endpoint == 'book-detail':
+			return reverse(endpoint, args=[self.rng.choice(self.book_ids)])
+		if endpoint == 'genre-detail':
+			return reverse(endpoint, args=[self.rng.choice(self.genre_ids)])
+		return reverse(endpoint)
+
+	def shares(self, total):
+		return [total // self.clients + (n < total % self.clients) for n in range(self.clients)]
+
+	########
+	# WSGI #
+	########
+
+	def wsgi_environ(self, url):
+		path, _, query = url.partition('?')
+		return {
+			'REQUEST_METHOD' : 'GET',
+			'SCRIPT_NAME' : '',
+			'PATH_INFO' : path,
+			'QUERY_STRING' : query,
+			'SERVER_NAME' : 'testserver',
+			'SERVER_PORT' : '80',
+			'SERVER_PROTOCOL' : 'HTTP/1.1',
+			'wsgi.version' : (1, 0),
+			'wsgi.url_scheme' : 'http',
+			'wsgi.input' : io.BytesIO(),
+			'wsgi.errors' : sys.stderr,
+			'wsgi.multithread' : True,
+			'wsgi.multiprocess' : False,
+			'wsgi.run_once' : False,
+		}
+
+	def serve_wsgi(self, urls):
+		""" A threaded server: a worker handles the request and then writes it to the slow client """
+		application = WSGIHandler()
+
+		def serve(url):
+			status = []
+			response = application(self.wsgi_environ(url), lambda line, headers: status.append(int(line.split()[0])))
+			try:
+				for _ in response:
+					pass
+				time.sleep(self.delay)
+			finally:
+				# request_finished: the worker's connection is closed
+				response.close()
+			return status[0]
+
+		with ThreadPoolExecutor(self.workers) as pool:
+			pool.submit(serve, urls.pop()).result()
+			samples = []
+			lock = threading.Lock()
+
+			def client(count):
+				local = []
+				for _ in range(count):
+					with lock:
+						url = urls.pop()
+					start = time.perf_counter()
+					status = pool.submit(serve, url).result()
+					local.append((time.perf_counter() - start, status))
+				with lock:
+					samples.extend(local)
+
+			start = time.perf_counter()
+			threads = [threading.Thread(target=client, args=(count,)) for count in self.shares(len(urls))]
+			for thread in threads:
+				thread.start()
+			for thread in threads:
+				thread.join()
+			return samples, time.perf_counter() - start
+
+	########
+	# ASGI #
+	########
+
+	def asgi_scope(self, url):
+		path, _, query = url.partition('?')
+		return {
+			'type' : 'http',
+			'asgi' : {'version' : '3.0'},
+			'http_version' : '1.1',
+			'method' : 'GET',
+			'scheme' : 'http',
+			'path' : path,
+			'root_path' : '',
+			'query_string' : query.encode(),
+			'headers' : [(b'host', b'testserver')],
+			'server' : ('testserver', 80),
+		}
+
+	async def serve_asgi(self, urls):
+		""" The event loop serves every client, the slow ones only hold a suspended send """
+		asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(self.workers))
+		application = ASGIHandler()
+
+		async def serve(url):
+			status = []
+
+			async def receive():
+				return {'type' : 'http.request', 'body' : b'', 'more_body' : False}
+
+			async def send(message):
+				if message['type'] == 'http.response.start':
+					status.append(message['status'])
+				elif not message.get('more_body'):
+					await asyncio.sleep(self.delay)
+
+			await application(self.asgi_scope(url), receive, send)
+			return status[0]
+
+		await serve(urls.pop())
+		samples = []
+
+		async def client(count):
+			for _ in range(count):
+				url = urls.pop()
+				start = time.perf_counter()
+				status = await serve(url)
+				samples.append((time.perf_counter() - start, status))
+
+		start = time.perf_counter()
+		await asyncio.gather(*[client(count) for count in self.shares(len(urls))])
+		return samples, time.perf_counter() - start
+
+	def compare(self, baseline, report):
+		self.stderr.write(f"\nCompared with {baseline.get('label')}:")
+		self.stderr.write(f"{'endpoint':<16}{'throughput rps':>20}{'p50 ms':>20}{'p95 ms':>20}")
+		for name, current in report['endpoints'].items():
+			before = baseline.get('endpoints', {}).get(name)
+			if not before:
+				continue
+			columns = [f"{before[key]:>9} ->{current[key]:>9}" for key in ('throughput_rps', 'p50_ms', 'p95_ms')]
+			self.stderr.write(f"{name:<16}{columns[0]:>20}{columns[1]:>20}{columns[2]:>20}")
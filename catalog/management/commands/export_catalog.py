@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from catalog.exporter import export_lines, EXPORTS, RENDERERS, DEFAULT_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+	help = "Stream books (with copy counts) or current loans as CSV or JSON Lines."
+
+	def add_arguments(self, parser):
+		parser.add_argument('kind', choices=sorted(EXPORTS))
+		parser.add_argument('--format', choices=sorted(RENDERERS), default='csv')
+		parser.add_argument('--output', default='-',
+							help="Output file (default: stdout).")
+		parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+							help="Rows read from the database per query.")
+
+	def handle(self, *args, **options):
+		lines = export_lines(options['kind'], options['format'], options['chunk_size'])
+		if options['output'] == '-':
+			for line in lines:
+				self.stdout.write(line, ending="")
+			return
+
+		count = 0
+		with open(options['output'], 'w', encoding='utf-8', newline='') as stream:
+			for line in lines:
+				stream.write(line)
+				count += 1
+		self.stderr.write(f"Wrote {count} lines to {options['output']}.")
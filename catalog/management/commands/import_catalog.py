@@ -0,0 +1,50 @@
+import io
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog.importer import CatalogImporter, COPY_STATUSES, READERS
+
+
+class Command(BaseCommand):
+	help = ("Bulk import books, authors, genres, languages and copies from CSV or JSON Lines "
+			"(a file path, or - for stdin). See catalog/importer.py for the columns.")
+
+	def add_arguments(self, parser):
+		parser.add_argument('path', help="Input file, or - to read stdin.")
+		parser.add_argument('--format', choices=sorted(READERS),
+							help="Input format (default: from the file extension, csv for stdin).")
+		parser.add_argument('--batch-size', type=int, default=500,
+							help="Records written per transaction.")
+		parser.add_argument('--status', default='a', choices=sorted(COPY_STATUSES),
+							help="Status of created copies when the input has no status column.")
+
+	def handle(self, *args, **options):
+		path = options['path']
+		input_format = options['format']
+		if not input_format:
+			extension = os.path.splitext(path)[1].lower().lstrip(".")
+			input_format = 'jsonl' if extension in ('jsonl', 'ndjson', 'json') else 'csv'
+
+		importer = CatalogImporter(
+			batch_size = options['batch_size'],
+			default_status = options['status'],
+			log = lambda message: self.stderr.write(message),
+		)
+
+		try:
+			if path == "-":
+				stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', newline='')
+				totals = importer.run(READERS[input_format](stream))
+			else:
+				with open(path, encoding='utf-8', newline='') as stream:
+					totals = importer.run(READERS[input_format](stream))
+		except (OSError, ValueError) as error:
+			raise CommandError(f"Import failed after {importer.totals['rows']} rows: {error}")
+
+		self.stdout.write(self.style.SUCCESS(
+			f"Imported {totals['books']} books and {totals['copies']} copies "
+			f"({totals['authors']} new authors, {totals['genres']} new genres, {totals['languages']} new languages); "
+			f"skipped {totals['duplicates']} duplicates and {totals['invalid']} invalid rows."
+		))
@@ -0,0 +1,37 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog.outbox import process_outbox
+from catalog.overdue import process_overdue
+
+
+class Command(BaseCommand):
+	help = ("Record fines for overdue loans and email each borrower a reminder. "
+			"Every loan is noticed once, so it is safe to run every few minutes from cron.")
+
+	def add_arguments(self, parser):
+		parser.add_argument('--batch-size', type=int, default=200,
+							help="Loans noticed per transaction (and emails sent per mail connection).")
+		parser.add_argument('--date', help="Process as of this date (YYYY-MM-DD) instead of today.")
+		parser.add_argument('--no-send', action='store_true',
+							help="Only queue the reminders, leave sending to send_queued_mail.")
+
+	def handle(self, *args, **options):
+		today = None
+		if options['date']:
+			try:
+				today = datetime.date.fromisoformat(options['date'])
+			except ValueError:
+				raise CommandError(f"Invalid --date {options['date']!r}, expected YYYY-MM-DD.")
+
+		summary = process_overdue(today=today, batch_size=options['batch_size'])
+		self.stdout.write(
+			f"Noticed {summary['notices']} overdue loans in {summary['batches']} batches, "
+			f"fines {summary['fines']}, {summary['emails']} reminders queued."
+		)
+
+		if summary['emails'] and not options['no_send']:
+			# single worker: each claimed batch goes out over one connection
+			sent, failed = process_outbox(workers=1, batch_size=options['batch_size'])
+			self.stdout.write(f"Sent {sent}, failed {failed}.")
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from catalog.search import get_backend, rebuild_index
+
+
+class Command(BaseCommand):
+	help = "Rebuild the full-text search documents and postings for every book."
+
+	def add_arguments(self, parser):
+		parser.add_argument('--batch-size', type=int, default=500,
+							help="Number of books fetched per database round trip.")
+
+	def handle(self, *args, **options):
+		count = rebuild_index(batch_size=options['batch_size'])
+		self.stdout.write(self.style.SUCCESS(
+			f"Indexed {count} book{'s' if count != 1 else ''} ({get_backend()} backend)."
+		))
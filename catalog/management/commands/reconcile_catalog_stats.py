@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from catalog.stats import get_catalog_stats, recompute_catalog_stats
+from catalog.visits import flush_visits
+
+
+class Command(BaseCommand):
+	help = "Recompute the materialized home page counters from live counts (run periodically, e.g. from cron)."
+
+	def handle(self, *args, **options):
+		# visits are not recomputed, only the cached batch is added
+		flushed = flush_visits()
+		before = get_catalog_stats()
+		after = recompute_catalog_stats()
+
+		for field in ('num_books', 'num_instances', 'num_instances_available',
+					  'num_authors', 'num_genres', 'num_word_books'):
+			old, new = getattr(before, field), getattr(after, field)
+			drift = f" (drift {new - old:+d})" if old != new else ""
+			self.stdout.write(f"{field}: {new}{drift}")
+
+		self.stdout.write(f"num_visits: {after.num_visits} ({flushed} flushed from the cache)")
+		self.stdout.write(self.style.SUCCESS("Catalog stats reconciled."))
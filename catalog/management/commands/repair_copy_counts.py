@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from catalog.copies import recount_copies
+
+
+class Command(BaseCommand):
+	help = "Recompute every book's copies_total/available/on_loan counters from its copies (run periodically, e.g. from cron)."
+
+	def handle(self, *args, **options):
+		drifted = recount_copies()
+		self.stdout.write(f"{drifted} book{'s' if drifted != 1 else ''} had drifted counters.")
+		self.stdout.write(self.style.SUCCESS("Copy counters repaired."))
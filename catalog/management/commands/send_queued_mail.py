@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from catalog.outbox import process_outbox, MAX_ATTEMPTS
+
+
+class Command(BaseCommand):
+	help = "Send queued emails from the outbox (run from cron, or with --loop as a long running worker)."
+
+	def add_arguments(self, parser):
+		parser.add_argument('--workers', type=int, default=2,
+							help="Sender threads, each with its own mail connection.")
+		parser.add_argument('--batch-size', type=int, default=50,
+							help="Emails claimed and sent per connection.")
+		parser.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS,
+							help="Attempts before an email is marked failed.")
+		parser.add_argument('--loop', action='store_true',
+							help="Keep polling the outbox instead of exiting once it is empty.")
+		parser.add_argument('--interval', type=float, default=5,
+							help="Seconds between polls with --loop.")
+
+	def handle(self, *args, **options):
+		while True:
+			sent, failed = process_outbox(
+				workers = options['workers'],
+				batch_size = options['batch_size'],
+				max_attempts = options['max_attempts'],
+			)
+			if sent or failed or not options['loop']:
+				self.stdout.write(f"Sent {sent}, failed {failed}.")
+			if not options['loop']:
+				break
+			time.sleep(options['interval'])
@@ -0,0 +1,104 @@
+import asyncio
+import time
+
+from django.conf import settings
+
+from . import routers, instrumentation
+from .threads import run
+
+
+# Cookie telling the router a client wrote recently and must read its own writes
+PRIMARY_COOKIE = "catalog_primary"
+
+
+class SyncAndAsyncMiddleware:
+	"""
+	Base of the catalog middleware: under ASGI ``__call__`` returns the
+	coroutine of ``__acall__``, so the async views are not run through a
+	sync adapter.
+	"""
+	sync_capable = True
+	async_capable = True
+
+	def __init__(self, get_response):
+		self.get_response = get_response
+		self.is_async = asyncio.iscoroutinefunction(get_response)
+		if self.is_async:
+			# makes asyncio.iscoroutinefunction(self) true, as Django's MiddlewareMixin does
+			self._is_coroutine = asyncio.coroutines._is_coroutine
+
+	def __call__(self, request):
+		if self.is_async:
+			return self.__acall__(request)
+		return self.handle(request)
+
+
+class ReplicaRoutingMiddleware(SyncAndAsyncMiddleware):
+	"""
+	Decide per request whether catalog reads may go to the read replicas.
+
+	Only anonymous GET/HEAD requests without the sticky cookie use them; it
+	must come after ``AuthenticationMiddleware``. Requests that write set the
+	cookie for ``CATALOG_PRIMARY_STICKY_SECONDS``.
+	"""
+
+	def use_replicas(self, request):
+		return (request.method in ('GET', 'HEAD')
+				and PRIMARY_COOKIE not in request.COOKIES
+				and not request.user.is_authenticated)
+
+	def stick_to_primary(self, response):
+		if routers.wrote_to_primary():
+			response.set_cookie(
+				PRIMARY_COOKIE, "1",
+				max_age = getattr(settings, 'CATALOG_PRIMARY_STICKY_SECONDS', 10),
+				httponly = True,
+				samesite = 'Lax',
+			)
+
+	def handle(self, request):
+		tokens = routers.start_request(self.use_replicas(request))
+		try:
+			response = self.get_response(request)
+			self.stick_to_primary(response)
+		finally:
+			routers.end_request(tokens)
+		return response
+
+	async def __acall__(self, request):
+		# loads request.user in a thread, the views then read it for free
+		tokens = routers.start_request(await run(self.use_replicas, request))
+		try:
+			response = await self.get_response(request)
+			self.stick_to_primary(response)
+		finally:
+			routers.end_request(tokens)
+		return response
+
+
+class InstrumentationMiddleware(SyncAndAsyncMiddleware):
+	"""
+	Record query count, DB and template time and response size of a sample
+	(``CATALOG_INSTRUMENTATION_SAMPLE_RATE``) of the catalog view requests,
+	see ``catalog.instrumentation``. It goes first so the queries of the
+	other middleware (session, user) are counted too; under ASGI only those
+	run in ``catalog.threads`` are.
+	"""
+
+	def handle(self, request):
+		if not instrumentation.should_sample():
+			return self.get_response(request)
+		start = time.perf_counter()
+		with instrumentation.recording() as recording:
+			response = self.get_response(request)
+		instrumentation.record(request, recording, response, time.perf_counter() - start)
+		return response
+
+	async def __acall__(self, request):
+		if not instrumentation.should_sample():
+			return await self.get_response(request)
+		start = time.perf_counter()
+		with instrumentation.recording() as recording:
+			response = await self.get_response(request)
+		await run(instrumentation.record, request, recording, response, time.perf_counter() - start)
+		return response
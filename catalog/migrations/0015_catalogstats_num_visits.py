@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 21:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0014_outgoingemail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='catalogstats',
+            name='num_visits',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
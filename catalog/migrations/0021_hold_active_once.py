@@ -0,0 +1,31 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:04
+
+from django.db import migrations, models
+
+
+def cancel_duplicate_holds(apps, schema_editor):
+    # concurrent requests could queue a member twice, the oldest hold is kept
+    Hold = apps.get_model('catalog', 'Hold')
+    seen = set()
+    duplicates = []
+    for pk, book_id, member_id in (Hold.objects.filter(status__in=['w', 'r'])
+                                   .order_by('created_at', 'pk').values_list('pk', 'book_id', 'member_id')):
+        if (book_id, member_id) in seen:
+            duplicates.append(pk)
+        seen.add((book_id, member_id))
+    Hold.objects.filter(pk__in=duplicates).update(status='c')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0020_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(cancel_duplicate_holds, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='hold',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['w', 'r'])), fields=('book', 'member'), name='catalog_hold_active_once'),
+        ),
+    ]
@@ -1,6 +1,7 @@
 from django.db import models
 from django.urls import reverse
 from django.contrib.auth.models import User
+from django.utils import timezone
 from datetime import date
 import uuid
 
@@ -9,6 +10,8 @@ import uuid
 class Genre(models.Model):
 	""" Model representing the books genre """
 	name = models.CharField(max_length=200, help_text="Enter book genre (e.g. Science Fiction)")
+	# validators of the public pages (see catalog.conditional)
+	updated_at = models.DateTimeField(auto_now=True)
 
 	def get_absolute_url(self):
 		return reverse('genre-detail', args=[str(self.id)])
@@ -21,6 +24,7 @@ class Genre(models.Model):
 
 class Language(models.Model):
 	name = models.CharField(max_length=100, help_text='Enter original language of the book (e.g. English)')
+	updated_at = models.DateTimeField(auto_now=True)
 
 	def __str__(self):
 		return self.name
@@ -36,9 +40,35 @@ class Book(models.Model):
 	genre = models.ManyToManyField(Genre, help_text="Select a genre for this book")
 	language = models.ManyToManyField(Language, help_text="Select a language for this book")
 
+	# Copy counters maintained with F() updates (see catalog.copies), never
+	# written by a normal save so a stale instance cannot overwrite them
+	copies_total = models.PositiveIntegerField(default=0, editable=False)
+	copies_available = models.PositiveIntegerField(default=0, editable=False)
+	copies_on_loan = models.PositiveIntegerField(default=0, editable=False)
+	# also set by the queryset updates of the counters
+	updated_at = models.DateTimeField(auto_now=True)
+
+	COPY_COUNTERS = ('copies_total', 'copies_available', 'copies_on_loan')
+
+	class Meta:
+		indexes = [
+			# prefix searches of the admin
+			models.Index(fields=['title'], name='catalog_book_title_idx'),
+		]
+
 	def __str__(self):
 		return self.title
 
+	def save(self, *args, **kwargs):
+		if not self._state.adding:
+			update_fields = kwargs.get('update_fields')
+			if update_fields is None:
+				# the loaded fields, as Django saves a deferred instance
+				update_fields = {field.attname for field in self._meta.concrete_fields
+								 if not field.primary_key} - self.get_deferred_fields()
+			kwargs['update_fields'] = set(update_fields) - set(self.COPY_COUNTERS)
+		super().save(*args, **kwargs)
+
 	def get_absolute_url(self):
 		"""Returns the url to access a detail record for this book."""
 		return reverse('book-detail', args=[str(self.id)])
@@ -79,17 +109,39 @@ class BookInstance(models.Model):
 	)
 
 	borrower = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+	# also set by the queryset updates of catalog.loans and catalog.holds
+	updated_at = models.DateTimeField(auto_now=True)
 
 	class Meta:
 		ordering = ['due_back']
 		permissions = (('can_mark_returned', 'Set book as returned'),)
+		indexes = [
+			models.Index(fields=['status', 'due_back'], name='catalog_copy_status_due_idx'),
+			models.Index(fields=['borrower', 'status', 'due_back'], name='catalog_copy_borrower_idx'),
+			models.Index(fields=['book', 'status'], name='catalog_copy_book_status_idx'),
+		]
 
 	@property
 	def is_overdue(self):
+		# Querysets may annotate this in SQL (see BookInstance.overdue_expression)
+		if '_is_overdue' in self.__dict__:
+			return self._is_overdue
 		if self.due_back and date.today() > self.due_back:
 			return True
 		return False
 
+	@is_overdue.setter
+	def is_overdue(self, value):
+		self._is_overdue = value
+
+	@staticmethod
+	def overdue_expression():
+		""" SQL equivalent of is_overdue, e.g. qs.annotate(is_overdue=BookInstance.overdue_expression()) """
+		return models.ExpressionWrapper(
+			models.Q(due_back__lt=date.today()),
+			output_field=models.BooleanField()
+		)
+
 	def __str__(self):
 		return f"{self.id} ({self.book.title})"
 
@@ -101,9 +153,14 @@ class Author(models.Model):
 	last_name = models.CharField(max_length=100)
 	date_of_birth = models.DateField(null=True, blank=True)
 	date_of_death = models.DateField('died', null=True, blank=True)
+	updated_at = models.DateTimeField(auto_now=True)
 
 	class Meta:
 		ordering = ['first_name','last_name']
+		indexes = [
+			models.Index(fields=['first_name', 'last_name'], name='catalog_author_name_idx'),
+			models.Index(fields=['last_name'], name='catalog_author_last_name_idx'),
+		]
 
 	def __str__(self):
 		return f"{self.first_name} {self.last_name}"
@@ -122,3 +179,136 @@ class UserToken(models.Model):
 
 	def __str__(self):
 		return f"{self.user_token}"
+
+
+class CatalogStats(models.Model):
+	""" Materialized record counts for the home page (kept as a single row) """
+	num_books = models.IntegerField(default=0)
+	num_instances = models.IntegerField(default=0)
+	num_instances_available = models.IntegerField(default=0)
+	num_authors = models.IntegerField(default=0)
+	num_genres = models.IntegerField(default=0)
+	num_word_books = models.IntegerField(default=0)
+	# Home page views, flushed in batches from the cache (see catalog.visits)
+	num_visits = models.BigIntegerField(default=0)
+
+	class Meta:
+		verbose_name_plural = "catalog stats"
+
+	def __str__(self):
+		return "Catalog stats"
+
+
+class BookSearchDocument(models.Model):
+	""" Normalized searchable text of a book (FULLTEXT indexed on MySQL) """
+	book = models.OneToOneField(Book, on_delete=models.CASCADE, primary_key=True, related_name='search_document')
+	document = models.TextField()
+
+	def __str__(self):
+		return f"Search document ({self.book_id})"
+
+
+class BookSearchTerm(models.Model):
+	""" Inverted index posting: a term and its weighted frequency in a book """
+	term = models.CharField(max_length=64)
+	book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='search_terms')
+	weight = models.PositiveIntegerField(default=1)
+
+	class Meta:
+		indexes = [
+			models.Index(fields=['term', 'book'], name='catalog_search_term_book_idx'),
+		]
+
+	def __str__(self):
+		return f"{self.term} ({self.book_id})"
+
+
+class OutgoingEmail(models.Model):
+	""" Queued email, delivered by the send_queued_mail command (see catalog.outbox) """
+	STATUS = (
+		('p', 'Pending'),
+		('s', 'Sending'),
+		('d', 'Sent'),
+		('f', 'Failed'),
+	)
+
+	subject = models.CharField(max_length=255)
+	body = models.TextField()
+	from_email = models.CharField(max_length=254)
+	to = models.TextField(help_text='Comma separated recipient addresses')
+	status = models.CharField(max_length=1, choices=STATUS, default='p')
+	attempts = models.PositiveIntegerField(default=0)
+	next_attempt_at = models.DateTimeField(default=timezone.now)
+	claim_token = models.UUIDField(null=True, blank=True, db_index=True)
+	last_error = models.TextField(blank=True)
+	created_at = models.DateTimeField(auto_now_add=True)
+	sent_at = models.DateTimeField(null=True, blank=True)
+
+	class Meta:
+		ordering = ['next_attempt_at']
+		indexes = [
+			models.Index(fields=['status', 'next_attempt_at'], name='catalog_outbox_due_idx'),
+		]
+
+	@property
+	def recipients(self):
+		return [address for address in self.to.split(",") if address]
+
+	def __str__(self):
+		return f"{self.subject} -> {self.to} ({self.get_status_display()})"
+
+
+class OverdueNotice(models.Model):
+	""" Fine and reminder recorded once per overdue loan by process_overdue (see catalog.overdue) """
+	copy = models.ForeignKey(BookInstance, on_delete=models.CASCADE, related_name='overdue_notices')
+	borrower = models.ForeignKey(User, on_delete=models.CASCADE, related_name='overdue_notices')
+	# Identifies the loan together with copy and borrower: a renewal is a new loan
+	due_back = models.DateField()
+	days_overdue = models.PositiveIntegerField()
+	fine = models.DecimalField(max_digits=8, decimal_places=2)
+	emailed = models.BooleanField(default=False)
+	created_at = models.DateTimeField(auto_now_add=True)
+
+	class Meta:
+		ordering = ['-created_at']
+		constraints = [
+			models.UniqueConstraint(fields=['copy', 'borrower', 'due_back'], name='catalog_overdue_notice_once'),
+		]
+
+	def __str__(self):
+		return f"{self.borrower} owes {self.fine} for {self.copy_id} (due {self.due_back})"
+
+
+class Hold(models.Model):
+	""" A member's place in the queue for a book (see catalog.holds) """
+	STATUS = (
+		('w', 'Waiting'),
+		('r', 'Ready for pickup'),
+		('f', 'Collected'),
+		('c', 'Cancelled'),
+	)
+
+	book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='holds')
+	member = models.ForeignKey(User, on_delete=models.CASCADE, related_name='holds')
+	status = models.CharField(max_length=1, choices=STATUS, default='w')
+	# The reserved copy while ready for pickup
+	copy = models.ForeignKey(BookInstance, on_delete=models.SET_NULL, null=True, blank=True, related_name='holds')
+	created_at = models.DateTimeField(default=timezone.now)
+	ready_at = models.DateTimeField(null=True, blank=True)
+
+	class Meta:
+		ordering = ['created_at']
+		indexes = [
+			# head of a book's queue is one index seek
+			models.Index(fields=['book', 'status', 'created_at', 'id'], name='catalog_hold_queue_idx'),
+			models.Index(fields=['member', 'status'], name='catalog_hold_member_idx'),
+		]
+		constraints = [
+			# one active hold per member and book, even for concurrent requests
+			# (MySQL does not support the condition, place_hold checks first)
+			models.UniqueConstraint(fields=['book', 'member'], condition=models.Q(status__in=['w', 'r']),
+									name='catalog_hold_active_once'),
+		]
+
+	def __str__(self):
+		return f"{self.member} waits for {self.book_id} ({self.get_status_display()})"
@@ -0,0 +1,145 @@
+"""
+Database backed outbound email queue.
+
+Views call ``queue_mail`` instead of ``send_mail``: the message is stored as
+an ``OutgoingEmail`` row inside the caller's transaction, so it is only sent
+if the surrounding work commits, and the request never waits on SMTP.
+
+The ``send_queued_mail`` management command drains the queue with
+``process_outbox``: worker threads claim batches of due rows, send each batch
+over one reused connection of the configured ``EMAIL_BACKEND`` and reschedule
+failures with exponential backoff.
+"""
+import datetime
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import connection as db_connection
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import OutgoingEmail
+
+
+MAX_ATTEMPTS = getattr(settings, 'EMAIL_OUTBOX_MAX_ATTEMPTS', 5)
+RETRY_DELAY = getattr(settings, 'EMAIL_OUTBOX_RETRY_DELAY', datetime.timedelta(minutes=1))
+MAX_RETRY_DELAY = datetime.timedelta(hours=6)
+
+# A claimed row that is not marked sent/failed within this time is retried
+CLAIM_LEASE = datetime.timedelta(minutes=10)
+
+
+def queue_mail(subject, message, from_email, recipient_list):
+	""" Drop-in replacement for send_mail that queues the message """
+	return OutgoingEmail.objects.create(
+		subject = subject,
+		body = message,
+		from_email = from_email or settings.DEFAULT_FROM_EMAIL,
+		to = ",".join(recipient_list),
+	)
+
+
+def retry_delay(attempts):
+	return min(RETRY_DELAY * 2 ** max(attempts - 1, 0), MAX_RETRY_DELAY)
+
+
+def claim_batch(batch_size, max_attempts=MAX_ATTEMPTS):
+	"""
+	Mark up to ``batch_size`` due emails as sending and return them.
+
+	The claiming UPDATE re-checks that each row is still due and pushes its
+	``next_attempt_at`` past the lease, so when concurrent workers pick the
+	same candidates only one UPDATE matches each row; the claim token tells
+	every worker which rows it won. A claim whose lease ran out on its last
+	attempt (the message kept crashing its worker) is marked failed instead.
+	"""
+	now = timezone.now()
+	OutgoingEmail.objects.filter(status__exact='s', next_attempt_at__lte=now, attempts__gte=max_attempts).update(
+		status = 'f',
+		last_error = "The claim expired on the last attempt.",
+	)
+	due = OutgoingEmail.objects.filter(
+		Q(status__exact='p') | Q(status__exact='s', attempts__lt=max_attempts), next_attempt_at__lte=now,
+	)
+	ids = list(due.order_by('next_attempt_at', 'pk').values_list('pk', flat=True)[:batch_size])
+	if not ids:
+		return []
+
+	token = uuid.uuid4()
+	due.filter(pk__in=ids).update(
+		status = 's',
+		claim_token = token,
+		attempts = F('attempts') + 1,
+		next_attempt_at = now + CLAIM_LEASE,
+	)
+	return list(OutgoingEmail.objects.filter(claim_token=token))
+
+
+def reschedule(email, error, max_attempts=MAX_ATTEMPTS):
+	""" Put a failed email back in the queue with backoff, or give up """
+	give_up = email.attempts >= max_attempts
+	OutgoingEmail.objects.filter(pk=email.pk).update(
+		status = 'f' if give_up else 'p',
+		next_attempt_at = timezone.now() + retry_delay(email.attempts),
+		last_error = str(error)[:1000],
+	)
+
+
+def send_batch(emails, max_attempts=MAX_ATTEMPTS):
+	""" Send claimed emails over one connection, returns (sent, failed) counts """
+	connection = get_connection(fail_silently=False)
+	try:
+		connection.open()
+	except Exception as error:
+		for email in emails:
+			reschedule(email, error, max_attempts)
+		return 0, len(emails)
+
+	sent, failed = 0, 0
+	try:
+		for email in emails:
+			message = EmailMessage(email.subject, email.body, email.from_email, email.recipients, connection=connection)
+			try:
+				message.send()
+			except Exception as error:
+				failed += 1
+				reschedule(email, error, max_attempts)
+			else:
+				sent += 1
+				OutgoingEmail.objects.filter(pk=email.pk).update(status='d', sent_at=timezone.now(), last_error="")
+	finally:
+		connection.close()
+	return sent, failed
+
+
+def drain(batch_size, max_attempts=MAX_ATTEMPTS):
+	""" Claim and send batches until none are due """
+	sent, failed = 0, 0
+	while True:
+		emails = claim_batch(batch_size, max_attempts)
+		if not emails:
+			return sent, failed
+		batch_sent, batch_failed = send_batch(emails, max_attempts)
+		sent += batch_sent
+		failed += batch_failed
+
+
+def _drain_in_thread(batch_size, max_attempts):
+	try:
+		return drain(batch_size, max_attempts)
+	finally:
+		# worker threads get their own database connection
+		db_connection.close()
+
+
+def process_outbox(workers=1, batch_size=50, max_attempts=MAX_ATTEMPTS):
+	""" Drain the queue with ``workers`` threads, returns (sent, failed) totals """
+	if workers <= 1:
+		return drain(batch_size, max_attempts)
+
+	with ThreadPoolExecutor(max_workers=workers) as pool:
+		results = [pool.submit(_drain_in_thread, batch_size, max_attempts) for _ in range(workers)]
+		totals = [future.result() for future in results]
+	return sum(sent for sent, _ in totals), sum(failed for _, failed in totals)
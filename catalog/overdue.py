@@ -0,0 +1,121 @@
+"""
+Overdue loan processing for the ``process_overdue`` management command.
+
+Loans that are past due and have no ``OverdueNotice`` yet are found with one
+query on the (status, due_back) index and handled in batches. Each batch
+records a notice with the fine for every loan and queues one reminder per
+borrower in the outbox, in one transaction. The notice's unique
+(copy, borrower, due_back) constraint makes re-runs and concurrent runs
+harmless: a loan is only ever noticed once, and a renewed loan (new due
+date) is a new loan. A batch that loses the race for a loan to another run
+rolls back and is read again without that loan.
+"""
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef
+
+from .models import Book, BookInstance, OutgoingEmail, OverdueNotice
+
+
+FINE_PER_DAY = Decimal(getattr(settings, 'CATALOG_OVERDUE_FINE_PER_DAY', '0.50'))
+
+NOTICE_FROM_EMAIL = "lib_admin@mojo.com"
+
+# Batches redone in a row before giving up on a conflict
+MAX_BATCH_RETRIES = 3
+
+
+def overdue_loans(today):
+	""" Loans past due on ``today`` that have not been noticed yet """
+	noticed = OverdueNotice.objects.filter(
+		copy = OuterRef('pk'),
+		borrower = OuterRef('borrower'),
+		due_back = OuterRef('due_back'),
+	)
+	return BookInstance.objects.filter(
+		status__exact = 'o',
+		due_back__lt = today,
+		borrower__isnull = False,
+	).filter(~Exists(noticed))
+
+
+def reminder_email(user, lines):
+	body = "\n".join([
+		f"Dear {user.get_full_name() or user.username},",
+		"",
+		"The following books are overdue. Please return them as soon as possible:",
+		"",
+		*lines,
+	])
+	return OutgoingEmail(
+		subject = "Overdue library books",
+		body = body,
+		from_email = NOTICE_FROM_EMAIL,
+		to = user.email,
+	)
+
+
+@transaction.atomic
+def process_batch(today, batch_size):
+	""" Notice up to ``batch_size`` overdue loans, returns (notices, emails, fines) """
+	# Rows locked by a concurrent run are left to it
+	copies = list(overdue_loans(today)
+					.select_for_update(skip_locked=True)
+					.order_by('due_back', 'pk')
+					.only('book', 'borrower', 'due_back')[:batch_size])
+	if not copies:
+		return 0, 0, Decimal(0)
+
+	books = Book.objects.only('title').in_bulk({copy.book_id for copy in copies})
+	users = User.objects.only('username', 'first_name', 'last_name', 'email').in_bulk({copy.borrower_id for copy in copies})
+
+	notices = []
+	lines = defaultdict(list)
+	for copy in copies:
+		days = (today - copy.due_back).days
+		user = users[copy.borrower_id]
+		notice = OverdueNotice(
+			copy = copy,
+			borrower_id = copy.borrower_id,
+			due_back = copy.due_back,
+			days_overdue = days,
+			fine = FINE_PER_DAY * days,
+			emailed = bool(user.email),
+		)
+		notices.append(notice)
+		book = books.get(copy.book_id)
+		lines[user].append(f"- {book.title if book else copy.pk}: due {copy.due_back}, "
+						   f"{days} day{'s' if days != 1 else ''} late, fine {notice.fine}")
+
+	emails = [reminder_email(user, user_lines) for user, user_lines in lines.items() if user.email]
+	OverdueNotice.objects.bulk_create(notices)
+	OutgoingEmail.objects.bulk_create(emails)
+	return len(notices), len(emails), sum((notice.fine for notice in notices), Decimal(0))
+
+
+def process_overdue(today=None, batch_size=200):
+	""" Notice every overdue loan, returns a summary dict """
+	today = today or datetime.date.today()
+	summary = {'notices' : 0, 'emails' : 0, 'fines' : Decimal(0), 'batches' : 0}
+	retries = 0
+	while True:
+		try:
+			notices, emails, fines = process_batch(today, batch_size)
+		except IntegrityError:
+			# a concurrent run noticed one of the loans after they were read
+			retries += 1
+			if retries > MAX_BATCH_RETRIES:
+				raise
+			continue
+		retries = 0
+		if not notices:
+			return summary
+		summary['notices'] += notices
+		summary['emails'] += emails
+		summary['fines'] += fines
+		summary['batches'] += 1
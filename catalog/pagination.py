@@ -0,0 +1,303 @@
+"""
+Pagination helpers for the catalog list views.
+
+``KeysetPaginator`` pages a queryset by remembering the ordering values of
+the last (or first) row shown instead of using OFFSET, so every page costs
+the same no matter how deep it is and no COUNT(*) is needed. Cursors are
+opaque url-safe strings passed as ``?after=`` / ``?before=``.
+
+``EstimatedCountPaginator`` is a drop-in ``Paginator`` (``paginator_class``
+of list views, ``ModelAdmin.paginator``) that avoids an exact COUNT(*) over
+large tables: an unfiltered queryset is counted from the database
+statistics, a filtered one is counted exactly once and the count cached.
+Counts below ``CATALOG_ESTIMATED_COUNT_THRESHOLD`` are always exact.
+"""
+import base64
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator, Page, InvalidPage, EmptyPage, PageNotAnInteger
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from django.http import Http404
+from django.utils.functional import cached_property
+
+
+class InvalidCursor(Exception):
+	pass
+
+
+def encode_cursor(values):
+	raw = json.dumps(list(values), separators=(',', ':'), cls=DjangoJSONEncoder).encode()
+	return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor, fields):
+	""" The values of a cursor over model ``fields``, converted by each field; InvalidCursor if tampered with """
+	try:
+		raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+		values = json.loads(raw)
+	except (ValueError, TypeError):
+		raise InvalidCursor(cursor)
+	if not isinstance(values, list) or len(values) != len(fields):
+		raise InvalidCursor(cursor)
+	# the seek compares with every value, NULL compares with nothing
+	if any(value is None or isinstance(value, (list, dict)) for value in values):
+		raise InvalidCursor(cursor)
+	try:
+		return [field.to_python(value) for field, value in zip(fields, values)]
+	except (ValidationError, ValueError, TypeError):
+		raise InvalidCursor(cursor)
+
+
+class KeysetPage:
+	""" One page of a keyset paginated queryset (mirrors the parts of Page templates use) """
+
+	def __init__(self, object_list, next_cursor, previous_cursor):
+		self.object_list = object_list
+		self.next_cursor = next_cursor
+		self.previous_cursor = previous_cursor
+
+	def __iter__(self):
+		return iter(self.object_list)
+
+	def __len__(self):
+		return len(self.object_list)
+
+	def has_next(self):
+		return self.next_cursor is not None
+
+	def has_previous(self):
+		return self.previous_cursor is not None
+
+	def has_other_pages(self):
+		return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+	"""
+	Page ``queryset`` on ``ordering`` (field names, "-" for descending).
+
+	The last ordering field must be unique (normally "pk") so the ordering is
+	total and no row is skipped or repeated between pages.
+	"""
+
+	def __init__(self, queryset, ordering, per_page):
+		self.queryset = queryset.order_by(*ordering)
+		self.ordering = [(field.lstrip("-"), field.startswith("-")) for field in ordering]
+		self.per_page = int(per_page)
+
+	def cursor_for(self, obj):
+		return encode_cursor(getattr(obj, field) for field, _ in self.ordering)
+
+	def ordering_fields(self):
+		opts = self.queryset.model._meta
+		return [opts.pk if name == 'pk' else opts.get_field(name) for name, _ in self.ordering]
+
+	def _seek(self, cursor, forward):
+		""" Q selecting rows strictly after (forward) or before the cursor row """
+		values = decode_cursor(cursor, self.ordering_fields())
+		condition = Q()
+		for i, (field, descending) in enumerate(self.ordering):
+			lookup = "lt" if descending == forward else "gt"
+			clause = Q(**{f"{field}__{lookup}" : values[i]})
+			for j, (previous_field, _) in enumerate(self.ordering[:i]):
+				clause &= Q(**{previous_field : values[j]})
+			condition |= clause
+		return condition
+
+	def page_queryset(self, after=None, before=None):
+		""" The rows of the page plus one (to tell if there are more), in reverse order for ``before`` """
+		if before:
+			reverse_ordering = [f"{'' if descending else '-'}{field}" for field, descending in self.ordering]
+			return self.queryset.filter(self._seek(before, forward=False)).order_by(*reverse_ordering)[:self.per_page + 1]
+		queryset = self.queryset.filter(self._seek(after, forward=True)) if after else self.queryset
+		return queryset[:self.per_page + 1]
+
+	def page(self, after=None, before=None):
+		rows = list(self.page_queryset(after, before))
+		has_more = len(rows) > self.per_page
+		if before:
+			rows = rows[:self.per_page][::-1]
+			previous_cursor = self.cursor_for(rows[0]) if has_more else None
+			next_cursor = self.cursor_for(rows[-1]) if rows else None
+		else:
+			rows = rows[:self.per_page]
+			next_cursor = self.cursor_for(rows[-1]) if has_more else None
+			previous_cursor = self.cursor_for(rows[0]) if after and rows else None
+		return KeysetPage(rows, next_cursor, previous_cursor)
+
+
+def table_row_estimate(queryset):
+	""" Rows in the queryset's table according to the database statistics, None when unknown """
+	connection = connections[queryset.db]
+	table = queryset.model._meta.db_table
+	if connection.vendor == 'mysql':
+		sql = "SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s"
+	elif connection.vendor == 'postgresql':
+		sql = "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass"
+	else:
+		return None
+	with connection.cursor() as cursor:
+		cursor.execute(sql, [table])
+		row = cursor.fetchone()
+	# never analyzed tables report nothing (MySQL) or -1 (PostgreSQL)
+	return int(row[0]) if row and row[0] is not None and row[0] >= 0 else None
+
+
+def counts_whole_table(queryset):
+	query = queryset.query
+	return not query.where and not query.distinct and query.group_by is None and not query.is_sliced
+
+
+def count_cache_key(queryset):
+	sql, params = queryset.query.sql_with_params()
+	digest = hashlib.md5(f"{queryset.db}:{sql}:{params!r}".encode()).hexdigest()
+	return f"catalog:count:{digest}"
+
+
+class EstimatedPage(Page):
+	def has_next(self):
+		if self.number < self.paginator.num_pages:
+			return True
+		if not self.paginator.count_is_estimate:
+			return False
+		# the estimate may be short of the real count
+		start = self.number * self.paginator.per_page
+		return self.paginator.object_list[start:start + 1].exists()
+
+
+class EstimatedCountPaginator(Paginator):
+	"""
+	Paginator whose count above ``threshold`` rows comes from the table
+	statistics (unfiltered querysets) or from the cache (filtered ones, for
+	``cache_timeout`` seconds) instead of a COUNT(*) per page view.
+
+	An estimated count may be off: pages past the estimate are still served
+	(and may be empty) and the last estimated page still links to the next
+	one when more rows exist. ``count_is_estimate`` tells templates to say
+	"about".
+	"""
+
+	def __init__(self, *args, threshold=None, cache_timeout=None, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.threshold = threshold if threshold is not None else getattr(settings, 'CATALOG_ESTIMATED_COUNT_THRESHOLD', 10000)
+		self.cache_timeout = cache_timeout if cache_timeout is not None else getattr(settings, 'CATALOG_COUNT_CACHE_SECONDS', 60)
+
+	@cached_property
+	def _counted(self):
+		""" (count, is_estimate) """
+		queryset = self.object_list
+		if not hasattr(queryset, 'query'):
+			return (len(queryset), False)
+
+		if counts_whole_table(queryset):
+			estimate = table_row_estimate(queryset)
+			if estimate is not None and estimate >= self.threshold:
+				return (estimate, True)
+
+		key = count_cache_key(queryset)
+		cached = cache.get(key)
+		if cached is not None:
+			return (cached, True)
+		count = queryset.count()
+		if count >= self.threshold:
+			cache.set(key, count, self.cache_timeout)
+		return (count, False)
+
+	@cached_property
+	def count(self):
+		return self._counted[0]
+
+	@property
+	def count_is_estimate(self):
+		return self._counted[1]
+
+	def validate_number(self, number):
+		if not self.count_is_estimate:
+			return super().validate_number(number)
+		try:
+			number = int(number)
+		except (TypeError, ValueError):
+			raise PageNotAnInteger("That page number is not an integer")
+		if number < 1:
+			raise EmptyPage("That page number is less than 1")
+		return number
+
+	def page(self, number):
+		if not self.count_is_estimate:
+			return super().page(number)
+		number = self.validate_number(number)
+		bottom = (number - 1) * self.per_page
+		return self._get_page(self.object_list[bottom:bottom + self.per_page], number, self)
+
+	def _get_page(self, *args, **kwargs):
+		return EstimatedPage(*args, **kwargs)
+
+
+def paginate_request(request, queryset, ordering, per_page, paginator_class=Paginator):
+	"""
+	Page ``queryset`` for a function based view the way ``KeysetPaginationMixin``
+	does for list views: ``?after=``/``?before=`` use keyset pagination,
+	otherwise ``?page=`` (a number or "last") uses ``paginator_class``.
+
+	Returns ``(page, is_paginated)``; bad page numbers and cursors raise Http404.
+	"""
+	keyset = KeysetPaginator(queryset, ordering, per_page)
+	after = request.GET.get('after')
+	before = request.GET.get('before')
+
+	if after or before:
+		try:
+			page = keyset.page(after=after, before=before)
+		except InvalidCursor:
+			raise Http404("Invalid page cursor.")
+		return (page, page.has_other_pages())
+
+	paginator = paginator_class(keyset.queryset, keyset.per_page)
+	page_number = request.GET.get('page') or 1
+	try:
+		page = paginator.page(paginator.num_pages if page_number == 'last' else page_number)
+	except InvalidPage:
+		raise Http404("Invalid page.")
+	rows = page.object_list = list(page.object_list)
+	page.next_cursor = keyset.cursor_for(rows[-1]) if page.has_next() and rows else None
+	page.previous_cursor = keyset.cursor_for(rows[0]) if page.has_previous() and rows else None
+	return (page, page.has_other_pages())
+
+
+class KeysetPaginationMixin:
+	"""
+	ListView mixin adding keyset pagination.
+
+	Requests carrying ``?after=`` or ``?before=`` are paged with
+	``KeysetPaginator``; plain ``?page=`` requests keep the default paginator.
+	In both modes the page object exposes ``next_cursor`` and
+	``previous_cursor`` so templates can always link with cursors.
+	"""
+	keyset_ordering = ('pk',)
+
+	def get_keyset_paginator(self, queryset, page_size):
+		return KeysetPaginator(queryset, self.keyset_ordering, page_size)
+
+	def paginate_queryset(self, queryset, page_size):
+		after = self.request.GET.get('after')
+		before = self.request.GET.get('before')
+		keyset = self.get_keyset_paginator(queryset, page_size)
+
+		if not (after or before):
+			paginator, page, _, is_paginated = super().paginate_queryset(keyset.queryset, page_size)
+			rows = page.object_list = list(page.object_list)
+			page.next_cursor = keyset.cursor_for(rows[-1]) if page.has_next() and rows else None
+			page.previous_cursor = keyset.cursor_for(rows[0]) if page.has_previous() and rows else None
+			return (paginator, page, rows, is_paginated)
+
+		try:
+			page = keyset.page(after=after, before=before)
+		except InvalidCursor:
+			raise Http404("Invalid page cursor.")
+		return (keyset, page, page.object_list, page.has_other_pages())
@@ -0,0 +1,93 @@
+"""
+Read-replica routing for the catalog.
+
+``ReplicaRouter`` sends reads of the catalog (and reviews) tables to one of
+the ``CATALOG_READ_REPLICAS`` database aliases and every write to ``default``.
+Replicas are only used while a request is allowed to read from them:
+``ReplicaRoutingMiddleware`` (see ``catalog.middleware``) releases anonymous
+GET/HEAD requests, everything else (management commands, shell, tests
+without the middleware, logged in users, POSTs) stays on the primary.
+
+Once a request writes, the rest of it reads from the primary too, and the
+middleware sets a short lived cookie so the client's next requests keep
+reading from the primary until the replicas have caught up.
+
+Reads whose result outlives the request are pinned to the primary as well:
+page stamps (``catalog.conditional``) and the fragments built for the
+cache (``catalog.cache``), so the replicas serve the rest, e.g. searches.
+"""
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+# Not a plain default of False: code running outside a request must never
+# read stale data
+_pinned = ContextVar('catalog_primary_pinned', default=True)
+# None outside requests: writes are only tracked for the sticky cookie
+_wrote = ContextVar('catalog_primary_wrote', default=None)
+
+
+def read_replicas():
+	return list(getattr(settings, 'CATALOG_READ_REPLICAS', []))
+
+
+def replica_apps():
+	return getattr(settings, 'CATALOG_REPLICA_APPS', ('catalog', 'reviews'))
+
+
+def pin_to_primary():
+	_pinned.set(True)
+
+
+def primary_pinned():
+	return _pinned.get()
+
+
+def wrote_to_primary():
+	return bool(_wrote.get())
+
+
+def start_request(use_replicas):
+	""" Reset the routing state for a new request, returns tokens for ``end_request`` """
+	return (_pinned.set(not use_replicas), _wrote.set(False))
+
+
+def end_request(tokens):
+	pinned_token, wrote_token = tokens
+	_pinned.reset(pinned_token)
+	_wrote.reset(wrote_token)
+
+
+class ReplicaRouter:
+	""" Database router sending catalog reads to the replicas when allowed """
+
+	def db_for_read(self, model, **hints):
+		replicas = read_replicas()
+		if not replicas or model._meta.app_label not in replica_apps():
+			return DEFAULT_DB_ALIAS
+		# reads inside a transaction belong to it
+		if primary_pinned() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+			return DEFAULT_DB_ALIAS
+		return random.choice(replicas)
+
+	def db_for_write(self, model, **hints):
+		if model._meta.app_label in replica_apps():
+			if _wrote.get() is False:
+				_wrote.set(True)
+			pin_to_primary()
+		return DEFAULT_DB_ALIAS
+
+	def allow_relation(self, obj1, obj2, **hints):
+		databases = {DEFAULT_DB_ALIAS, *read_replicas()}
+		if obj1._state.db in databases and obj2._state.db in databases:
+			return True
+		return None
+
+	def allow_migrate(self, db, app_label, model_name=None, **hints):
+		# replicas get their schema from replication
+		if db in read_replicas():
+			return False
+		return None
@@ -0,0 +1,195 @@
+"""
+Full-text search over books (title, summary and author name).
+
+Every book has a ``BookSearchDocument`` holding its normalized text. Two
+backends query it:
+
+* ``fulltext`` - MySQL ``MATCH ... AGAINST`` in boolean mode over a FULLTEXT
+  index on the document column.
+* ``postings`` - a database backed inverted index (``BookSearchTerm``) used on
+  every other database, e.g. SQLite while testing.
+
+The backend is picked with ``settings.CATALOG_SEARCH_BACKEND`` ("auto" uses
+``fulltext`` on MySQL and ``postings`` elsewhere). Queries support plain
+terms (all must match), prefixes (``dra*``) and phrases (``"pride and"``).
+"""
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Func, Q, Sum, Value, FloatField
+
+from . import models
+
+
+TOKEN_RE = re.compile(r"\w+")
+QUERY_RE = re.compile(r'"([^"]*)"|(\S+)')
+
+MAX_TERM_LENGTH = 64
+
+# Relative weight of each field when ranking postings
+FIELD_WEIGHTS = (
+	('title', 3),
+	('author', 2),
+	('summary', 1),
+)
+
+
+def tokenize(text):
+	""" Split text into lowercase word tokens """
+	return [token[:MAX_TERM_LENGTH] for token in TOKEN_RE.findall((text or "").lower())]
+
+
+def get_backend():
+	backend = getattr(settings, 'CATALOG_SEARCH_BACKEND', 'auto')
+	if backend == 'auto':
+		backend = 'fulltext' if connection.vendor == 'mysql' else 'postings'
+	return backend
+
+
+def book_fields(book):
+	""" Searchable text of a book keyed by field name """
+	return {
+		'title' : book.title,
+		'author' : str(book.author) if book.author_id else "",
+		'summary' : book.summary,
+	}
+
+
+################
+# Index upkeep #
+################
+
+def index_books(books):
+	""" (Re)build the search documents and postings of several books at once """
+	books = list(books)
+	book_ids = [book.pk for book in books]
+	documents, postings = [], []
+	use_postings = get_backend() == 'postings'
+
+	for book in books:
+		fields = book_fields(book)
+		tokens = tokenize(" ".join(fields[name] for name, _ in FIELD_WEIGHTS))
+		# padded with spaces so phrases can be matched on word boundaries
+		documents.append(models.BookSearchDocument(book_id=book.pk, document=f" {' '.join(tokens)} "))
+
+		if use_postings:
+			weights = Counter()
+			for name, weight in FIELD_WEIGHTS:
+				for token in tokenize(fields[name]):
+					weights[token] += weight
+			postings.extend(
+				models.BookSearchTerm(term=term, book_id=book.pk, weight=weight)
+				for term, weight in weights.items()
+			)
+
+	with transaction.atomic():
+		models.BookSearchDocument.objects.filter(book_id__in=book_ids).delete()
+		models.BookSearchTerm.objects.filter(book_id__in=book_ids).delete()
+		models.BookSearchDocument.objects.bulk_create(documents)
+		models.BookSearchTerm.objects.bulk_create(postings, batch_size=1000)
+
+
+def index_book(book):
+	""" (Re)build the search document and postings of one book """
+	index_books([book])
+
+
+def rebuild_index(batch_size=500):
+	""" Reindex every book, returns the number of books indexed """
+	count = 0
+	books = models.Book.objects.select_related('author').order_by('pk')
+	batch = []
+	for book in books.iterator(chunk_size=batch_size):
+		batch.append(book)
+		if len(batch) == batch_size:
+			index_books(batch)
+			count += len(batch)
+			batch = []
+	index_books(batch)
+	return count + len(batch)
+
+
+#################
+# Query parsing #
+#################
+
+def parse_query(query):
+	"""
+	Split a query into (terms, phrases).
+
+	``terms`` is a list of (token, is_prefix) tuples, ``phrases`` a list of
+	token lists. Words of a phrase are also returned as required terms.
+	"""
+	terms, phrases = [], []
+	for phrase, word in QUERY_RE.findall(query or ""):
+		if phrase:
+			tokens = tokenize(phrase)
+			if len(tokens) > 1:
+				phrases.append(tokens)
+			terms.extend((token, False) for token in tokens)
+		else:
+			is_prefix = word.endswith("*")
+			tokens = tokenize(word)
+			for i, token in enumerate(tokens):
+				terms.append((token, is_prefix and i == len(tokens) - 1))
+	return list(dict.fromkeys(terms)), phrases
+
+
+############
+# Backends #
+############
+
+class MatchAgainst(Func):
+	""" MySQL ``MATCH (column) AGAINST (query IN BOOLEAN MODE)`` relevance """
+	output_field = FloatField()
+
+	def as_sql(self, compiler, connection):
+		column, query = self.source_expressions
+		column_sql, column_params = compiler.compile(column)
+		query_sql, query_params = compiler.compile(query)
+		sql = f"MATCH ({column_sql}) AGAINST ({query_sql} IN BOOLEAN MODE)"
+		return sql, [*column_params, *query_params]
+
+
+def boolean_mode_query(terms, phrases):
+	""" Render parsed terms/phrases as a MySQL boolean mode query """
+	clauses = [f"+{token}{'*' if is_prefix else ''}" for token, is_prefix in terms]
+	clauses += [f'+"{" ".join(tokens)}"' for tokens in phrases]
+	return " ".join(clauses)
+
+
+def search_fulltext(terms, phrases):
+	score = MatchAgainst('search_document__document', Value(boolean_mode_query(terms, phrases)))
+	return models.Book.objects.annotate(score=score).filter(score__gt=0)
+
+
+def search_postings(terms, phrases):
+	books = models.Book.objects.all()
+	matched = Q()
+	for token, is_prefix in terms:
+		clause = Q(term__startswith=token) if is_prefix else Q(term=token)
+		books = books.filter(
+			pk__in=models.BookSearchTerm.objects.filter(clause).values('book')
+		)
+		matched |= Q(**{f"search_terms__{key}" : value for key, value in clause.children})
+
+	for tokens in phrases:
+		books = books.filter(search_document__document__contains=f" {' '.join(tokens)} ")
+
+	return books.annotate(score=Sum('search_terms__weight', filter=matched))
+
+
+def search_books(query):
+	""" Books matching ``query`` ordered by relevance (best first) """
+	terms, phrases = parse_query(query)
+	if not terms:
+		return models.Book.objects.none()
+
+	if get_backend() == 'fulltext':
+		books = search_fulltext(terms, phrases)
+	else:
+		books = search_postings(terms, phrases)
+
+	return books.select_related('author').order_by('-score', 'title', 'pk')
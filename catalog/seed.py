@@ -0,0 +1,121 @@
+"""
+Synthetic library data for benchmarks.
+
+Everything is inserted with ``bulk_create`` in batches, so model signals do
+not run; the materialized home page counters and the books' copy counters
+are recomputed and the genre page fragments invalidated at the end.
+Rows created by one call share a random tag (in usernames, author names and
+ISBNs) which is how the generated primary keys are read back on databases
+that do not return them from bulk inserts (MySQL).
+"""
+import datetime
+import random
+import uuid
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+
+from . import models
+from .stats import recompute_catalog_stats
+from .copies import recount_copies
+from .utils import batched
+from . import cache
+
+
+SEED_PASSWORD = "benchmark-Pa55word"
+
+GENRES = ("Fantasy", "Science Fiction", "Romance", "History", "Poetry", "Thriller", "Biography", "Drama")
+LANGUAGES = ("English", "Hindi", "French", "Spanish", "German")
+WORDS = ("love", "war", "dragon", "river", "city", "night", "secret", "garden", "empire", "storm",
+		 "journey", "silence", "letter", "winter", "king", "island", "shadow", "machine", "song", "road")
+
+
+def bulk_insert(model, objects, batch_size):
+	for batch in batched(objects, batch_size):
+		model.objects.bulk_create(batch, batch_size=batch_size)
+
+
+def seed_library(authors=100, books=1000, copies_per_book=3, users=100, loan_ratio=0.4,
+				 batch_size=1000, seed=None, log=None):
+	"""
+	Insert a synthetic library and return a summary dict.
+
+	``loan_ratio`` of the copies are put on loan (a quarter of those overdue),
+	the rest are split between available and maintenance.
+	"""
+	rng = random.Random(seed)
+	tag = uuid.uuid4().hex[:4]
+	log = log or (lambda message: None)
+	today = datetime.date.today()
+
+	genres = [models.Genre.objects.get_or_create(name=name)[0] for name in GENRES]
+	languages = [models.Language.objects.get_or_create(name=name)[0] for name in LANGUAGES]
+
+	password = make_password(SEED_PASSWORD)
+	bulk_insert(User, (
+		User(username=f"seed{tag}_{n}", email=f"seed{tag}_{n}@example.com", password=password)
+		for n in range(users)
+	), batch_size)
+	user_ids = list(User.objects.filter(username__startswith=f"seed{tag}_").values_list('pk', flat=True))
+	bulk_insert(models.UserToken, (models.UserToken(user_id=pk) for pk in user_ids), batch_size)
+	log(f"users: {len(user_ids)}")
+
+	bulk_insert(models.Author, (
+		models.Author(first_name=f"Author{tag}", last_name=f"No {n}",
+					  date_of_birth=today - datetime.timedelta(days=rng.randint(20 * 365, 90 * 365)))
+		for n in range(authors)
+	), batch_size)
+	author_ids = list(models.Author.objects.filter(first_name=f"Author{tag}").values_list('pk', flat=True))
+	log(f"authors: {len(author_ids)}")
+
+	def book_rows():
+		for n in range(books):
+			words = rng.sample(WORDS, 8)
+			yield models.Book(
+				title = " ".join(words[:3]).title(),
+				summary = " ".join(words) + ".",
+				isbn = f"S{tag}{n:08d}",
+				author_id = rng.choice(author_ids),
+			)
+	bulk_insert(models.Book, book_rows(), batch_size)
+	book_ids = list(models.Book.objects.filter(isbn__startswith=f"S{tag}").values_list('pk', flat=True))
+	log(f"books: {len(book_ids)}")
+
+	BookGenre = models.Book.genre.through
+	BookLanguage = models.Book.language.through
+	bulk_insert(BookGenre, (
+		BookGenre(book_id=book_id, genre_id=genre.pk)
+		for book_id in book_ids for genre in rng.sample(genres, rng.randint(1, 3))
+	), batch_size)
+	bulk_insert(BookLanguage, (
+		BookLanguage(book_id=book_id, language_id=rng.choice(languages).pk)
+		for book_id in book_ids
+	), batch_size)
+
+	def copy_rows():
+		for book_id in book_ids:
+			for _ in range(copies_per_book):
+				copy = models.BookInstance(book_id=book_id, imprint=f"Imprint {rng.randint(1, 50)}")
+				if user_ids and rng.random() < loan_ratio:
+					copy.status = 'o'
+					copy.borrower_id = rng.choice(user_ids)
+					overdue = rng.random() < 0.25
+					copy.due_back = today + datetime.timedelta(days=rng.randint(-30, -1) if overdue else rng.randint(0, 28))
+				else:
+					copy.status = rng.choice('aam')
+				yield copy
+	bulk_insert(models.BookInstance, copy_rows(), batch_size)
+	log(f"copies: {len(book_ids) * copies_per_book}")
+
+	recompute_catalog_stats()
+	for batch in batched(book_ids, batch_size):
+		recount_copies(models.Book.objects.filter(pk__in=batch))
+	cache.bump('genre', *(genre.pk for genre in genres))
+
+	return {
+		'tag' : tag,
+		'users' : len(user_ids),
+		'authors' : len(author_ids),
+		'books' : len(book_ids),
+		'copies' : len(book_ids) * copies_per_book,
+	}
@@ -1,11 +1,267 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, pre_save, post_delete, pre_delete, m2m_changed
 from django.contrib.auth.models import User
+from django.db import transaction
 from django.dispatch import receiver
+from django.utils import timezone
 
-from .models import UserToken
+from .models import UserToken, Book, BookInstance, Author, Genre, Language, Hold
+from .stats import adjust_catalog_stats, summary_has_featured_word
+from .search import index_book
+from .copies import copy_moved
+from .holds import reserve_shelved_copies
+from .conditional import record_deletion
+from . import cache
 
 @receiver(post_save, sender=User)
 def create_token(sender, instance, created, **kwargs):
 	if created:
 		profile = UserToken.objects.create(user=instance)
-		profile.save()
\ No newline at end of file
+		profile.save()
+
+
+#######################################
+# Home page statistics (CatalogStats) #
+#######################################
+
+@receiver(pre_save, sender=Book)
+def remember_book_state(sender, instance, raw=False, **kwargs):
+	""" Record the stored summary match and author before this save """
+	instance._stats_had_word = False
+	instance._cache_old_author_id = None
+	if not instance._state.adding and not raw:
+		stored = Book.objects.filter(pk=instance.pk).values_list('summary', 'author_id').first()
+		if stored:
+			instance._stats_had_word = summary_has_featured_word(stored[0])
+			instance._cache_old_author_id = stored[1]
+
+
+@receiver(post_save, sender=Book)
+def count_book_saved(sender, instance, created, raw=False, **kwargs):
+	has_word = summary_has_featured_word(instance.summary)
+	had_word = getattr(instance, '_stats_had_word', False)
+	adjust_catalog_stats(
+		num_books = 1 if created else 0,
+		num_word_books = int(has_word) - int(had_word),
+	)
+
+
+@receiver(post_delete, sender=Book)
+def count_book_deleted(sender, instance, **kwargs):
+	adjust_catalog_stats(
+		num_books = -1,
+		num_word_books = -int(summary_has_featured_word(instance.summary)),
+	)
+
+
+@receiver(pre_save, sender=BookInstance)
+def remember_instance_status(sender, instance, raw=False, **kwargs):
+	""" Record the stored status and book before this save """
+	instance._stats_old_status = None
+	instance._copies_old_book_id = None
+	if not instance._state.adding and not raw:
+		stored = BookInstance.objects.filter(pk=instance.pk).values_list('status', 'book_id').first()
+		if stored:
+			instance._stats_old_status, instance._copies_old_book_id = stored
+
+
+@receiver(post_save, sender=BookInstance)
+def count_instance_saved(sender, instance, created, **kwargs):
+	was_available = getattr(instance, '_stats_old_status', None) == 'a'
+	is_available = instance.status == 'a'
+	adjust_catalog_stats(
+		num_instances = 1 if created else 0,
+		num_instances_available = int(is_available) - int(was_available),
+	)
+
+
+@receiver(post_delete, sender=BookInstance)
+def count_instance_deleted(sender, instance, **kwargs):
+	adjust_catalog_stats(
+		num_instances = -1,
+		num_instances_available = -1 if instance.status == 'a' else 0,
+	)
+
+
+@receiver(post_save, sender=Author)
+def count_author_saved(sender, instance, created, **kwargs):
+	if created:
+		adjust_catalog_stats(num_authors=1)
+
+
+@receiver(post_delete, sender=Author)
+def count_author_deleted(sender, instance, **kwargs):
+	adjust_catalog_stats(num_authors=-1)
+
+
+@receiver(post_save, sender=Genre)
+def count_genre_saved(sender, instance, created, **kwargs):
+	if created:
+		adjust_catalog_stats(num_genres=1)
+
+
+@receiver(post_delete, sender=Genre)
+def count_genre_deleted(sender, instance, **kwargs):
+	adjust_catalog_stats(num_genres=-1)
+
+
+
+###############################
+# Book copy counters (copies) #
+###############################
+
+@receiver(post_save, sender=BookInstance)
+def count_copy_saved(sender, instance, created, **kwargs):
+	copy_moved(
+		getattr(instance, '_copies_old_book_id', None),
+		getattr(instance, '_stats_old_status', None),
+		instance.book_id,
+		instance.status,
+	)
+
+
+@receiver(post_delete, sender=BookInstance)
+def count_copy_deleted(sender, instance, **kwargs):
+	copy_moved(instance.book_id, instance.status, None, None)
+
+
+
+##############
+# Hold queue #
+##############
+
+@receiver(post_save, sender=BookInstance)
+def reserve_copy_made_available(sender, instance, created, raw=False, **kwargs):
+	""" A copy put on the shelf by a save (admin, forms) goes to the book's waiting holds first """
+	if raw or instance.status != 'a' or instance.book_id is None:
+		return
+	if not created and getattr(instance, '_stats_old_status', None) == 'a' \
+			and getattr(instance, '_copies_old_book_id', None) == instance.book_id:
+		return
+	book_id = instance.book_id
+	transaction.on_commit(lambda: reserve_shelved_copies(book_id))
+
+
+
+##########################
+# Full-text search index #
+##########################
+
+@receiver(post_save, sender=Book)
+def index_book_saved(sender, instance, raw=False, **kwargs):
+	if not raw:
+		index_book(instance)
+
+
+@receiver(post_save, sender=Author)
+def index_author_books(sender, instance, created, raw=False, **kwargs):
+	""" The author name is part of each of their books' search text """
+	if not created and not raw:
+		for book in instance.book_set.all():
+			book.author = instance
+			index_book(book)
+
+
+#################################
+# Detail page fragment versions #
+#################################
+
+@receiver(post_save, sender=Book)
+def bump_book_saved(sender, instance, **kwargs):
+	cache.bump('book', instance.pk)
+	cache.bump('author', instance.author_id, getattr(instance, '_cache_old_author_id', None))
+	cache.bump('genre', *instance.genre.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Book)
+def bump_book_deleted(sender, instance, **kwargs):
+	# genres are read before the delete cascades to the through table
+	cache.bump('book', instance.pk)
+	cache.bump('author', instance.author_id)
+	cache.bump('genre', *instance.genre.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=BookInstance)
+@receiver(post_delete, sender=BookInstance)
+def bump_copy_changed(sender, instance, **kwargs):
+	cache.bump('book', instance.book_id)
+
+
+@receiver(post_save, sender=Author)
+@receiver(pre_delete, sender=Author)
+def bump_author_changed(sender, instance, **kwargs):
+	cache.bump('author', instance.pk)
+	cache.bump('book', *Book.objects.filter(author_id=instance.pk).values_list('pk', flat=True))
+	# genre pages list the author of every book
+	cache.bump('genre', *Genre.objects.filter(book__author_id=instance.pk).values_list('pk', flat=True).distinct())
+
+
+@receiver(post_save, sender=Genre)
+@receiver(pre_delete, sender=Genre)
+def bump_genre_changed(sender, instance, **kwargs):
+	cache.bump('genre', instance.pk)
+	cache.bump('book', *instance.book_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Language)
+@receiver(pre_delete, sender=Language)
+def bump_language_changed(sender, instance, **kwargs):
+	cache.bump('book', *instance.book_set.values_list('pk', flat=True))
+
+
+def touch_books(book_ids):
+	""" Genre/language links do not change the book row: move its updated_at for the page validators """
+	Book.objects.filter(pk__in=list(book_ids)).update(updated_at=timezone.now())
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def bump_book_genres_changed(sender, instance, action, reverse, pk_set, **kwargs):
+	if action not in ('pre_clear', 'post_add', 'post_remove'):
+		return
+	if reverse:
+		# genre.book_set changed: instance is a Genre
+		book_ids = list(pk_set if pk_set is not None else instance.book_set.values_list('pk', flat=True))
+		cache.bump('genre', instance.pk)
+		cache.bump('book', *book_ids)
+		touch_books(book_ids)
+	else:
+		genre_ids = pk_set if pk_set is not None else instance.genre.values_list('pk', flat=True)
+		cache.bump('book', instance.pk)
+		cache.bump('genre', *genre_ids)
+		touch_books([instance.pk])
+	if action != 'post_add':
+		# the book left a genre page, which keeps no row to date it
+		record_deletion()
+
+
+@receiver(m2m_changed, sender=Book.language.through)
+def bump_book_languages_changed(sender, instance, action, reverse, pk_set, **kwargs):
+	if action not in ('pre_clear', 'post_add', 'post_remove'):
+		return
+	if reverse:
+		book_ids = list(pk_set if pk_set is not None else instance.book_set.values_list('pk', flat=True))
+		cache.bump('book', *book_ids)
+		touch_books(book_ids)
+	else:
+		cache.bump('book', instance.pk)
+		touch_books([instance.pk])
+	if action != 'post_add':
+		record_deletion()
+
+
+#################################
+# Page validators (conditional) #
+#################################
+
+@receiver(post_delete, sender=Book)
+@receiver(post_delete, sender=BookInstance)
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Genre)
+@receiver(post_delete, sender=Language)
+@receiver(post_delete, sender=Hold)
+def catalog_row_deleted(sender, instance, **kwargs):
+	""" A deleted row leaves no updated_at behind to move the pages' Last-Modified """
+	record_deletion()
+
+
+if hasattr(Book, 'review_set'):
+	post_delete.connect(catalog_row_deleted, sender=Book.review_set.rel.related_model)
@@ -0,0 +1,64 @@
+"""
+Materialized catalog statistics for the home page.
+
+The counters live in a single ``CatalogStats`` row which is adjusted
+incrementally from model signals (see ``catalog.signals``) and rebuilt from
+scratch by the ``reconcile_catalog_stats`` management command.
+"""
+from django.db.models import F
+
+from . import models
+
+
+STATS_PK = 1
+
+# Word searched for in book summaries for the "Love Books" counter
+FEATURED_WORD = "love"
+
+
+def summary_has_featured_word(summary):
+	""" Python equivalent of ``summary__icontains=FEATURED_WORD`` """
+	return FEATURED_WORD in (summary or "").lower()
+
+
+def count_catalog_stats():
+	""" Compute every counter with live queries """
+	return {
+		'num_books' : models.Book.objects.count(),
+		'num_instances' : models.BookInstance.objects.count(),
+		'num_instances_available' : models.BookInstance.objects.filter(status__exact='a').count(),
+		'num_authors' : models.Author.objects.count(),
+		'num_genres' : models.Genre.objects.count(),
+		'num_word_books' : models.Book.objects.filter(summary__icontains=FEATURED_WORD).count(),
+	}
+
+
+def recompute_catalog_stats():
+	""" Rebuild the stats row from live counts and return it """
+	stats, _ = models.CatalogStats.objects.update_or_create(
+		pk=STATS_PK,
+		defaults=count_catalog_stats()
+	)
+	return stats
+
+
+def get_catalog_stats():
+	""" Return the stats row, building it on first use """
+	stats = models.CatalogStats.objects.filter(pk=STATS_PK).first()
+	if stats is None:
+		stats = recompute_catalog_stats()
+	return stats
+
+
+def adjust_catalog_stats(**deltas):
+	""" Apply counter deltas in one UPDATE, e.g. adjust_catalog_stats(num_books=1) """
+	deltas = {field: delta for field, delta in deltas.items() if delta}
+	if not deltas:
+		return
+
+	updated = models.CatalogStats.objects.filter(pk=STATS_PK).update(
+		**{field: F(field) + delta for field, delta in deltas.items()}
+	)
+	if not updated:
+		# No row yet, the live counts already include this change
+		recompute_catalog_stats()
@@ -1,5 +1,6 @@
 from django import template
-from django.utils.safestring import mark_safe
+from django.urls import reverse
+from django.utils.html import format_html
 
 register = template.Library()
 
@@ -7,6 +8,6 @@ register = template.Library()
 def gerne_merge(genres):
 	collection = []
 	for genre in genres:
-		link = f'<a href="{genre.get_absolute_url()}">{genre}</a>'
-		collection.append(mark_safe(link))
-	return collection\
+		link = format_html('<a href="{}">{}</a>', reverse('genre-detail', args=[genre.pk]), genre)
+		collection.append(link)
+	return collection
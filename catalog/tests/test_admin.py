@@ -0,0 +1,64 @@
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from catalog.models import Author, Book, BookInstance, Genre, Language
+
+
+class AdminChangelistTest(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		cls.admin = User.objects.create_superuser(username="admin", password="j123nkhahKA#snjsn")
+		cls.reader = User.objects.create_user(username="reader")
+		cls.austen = Author.objects.create(first_name="Jane", last_name="Austen")
+		cls.genres = [Genre.objects.create(name=name) for name in ("Romance", "Satire")]
+		cls.languages = [Language.objects.create(name=name) for name in ("English", "French")]
+
+	def setUp(self):
+		self.client.force_login(self.admin)
+
+	def add_books(self, count):
+		for _ in range(count):
+			n = Book.objects.count()
+			book = Book.objects.create(title=f"Novel {n}", summary="Manners", isbn=f"{n:013d}", author=self.austen)
+			book.genre.set(self.genres)
+			book.language.set(self.languages)
+			BookInstance.objects.create(book=book, imprint="Penguin", status="o", borrower=self.reader)
+
+	def changelist_queries(self, model):
+		with CaptureQueriesContext(connection) as queries:
+			response = self.client.get(reverse(f'admin:catalog_{model}_changelist'))
+		self.assertEqual(response.status_code, 200)
+		return len(queries)
+
+	def test_query_count_does_not_grow_with_rows(self):
+		self.add_books(2)
+		few = {model : self.changelist_queries(model) for model in ('book', 'bookinstance')}
+		self.add_books(20)
+		many = {model : self.changelist_queries(model) for model in ('book', 'bookinstance')}
+		self.assertEqual(few, many)
+
+	def test_book_changelist_lists_genres(self):
+		self.add_books(1)
+		response = self.client.get(reverse('admin:catalog_book_changelist'))
+		self.assertContains(response, "Romance, Satire")
+		self.assertContains(response, "English, French")
+
+	def test_related_field_search(self):
+		self.add_books(1)
+		other = Author.objects.create(first_name="Mark", last_name="Twain")
+		Book.objects.create(title="Tom Sawyer", summary="River", isbn="9780143107330", author=other)
+
+		def found(model, query):
+			response = self.client.get(reverse(f'admin:catalog_{model}_changelist'), {'q' : query})
+			return [str(row) for row in response.context['cl'].result_list]
+
+		self.assertEqual(found('book', "Aust"), ["Novel 0"])
+		self.assertEqual(found('book', "Mark Twain"), ["Tom Sawyer"])
+		self.assertEqual(found('book', "romance"), ["Novel 0"])
+		self.assertEqual(found('book', "Tom"), ["Tom Sawyer"])
+		self.assertEqual(len(found('bookinstance', "Novel")), 1)
+		self.assertEqual(len(found('bookinstance', "read")), 1)
+		self.assertEqual(found('bookinstance', "Tom"), [])
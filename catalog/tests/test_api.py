@@ -0,0 +1,124 @@
+from django.test import TestCase
+from django.urls import reverse
+
+from catalog.models import Author, Book, BookInstance, Genre, Language
+from catalog.pagination import encode_cursor
+
+
+class CatalogApiTest(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		cls.genres = [Genre.objects.create(name=name) for name in ("Fantasy", "Adventure")]
+		cls.english = Language.objects.create(name="English")
+		cls.tolkien = Author.objects.create(first_name="John", last_name="Tolkien")
+		cls.books = []
+		for number in range(5):
+			author = Author.objects.create(first_name=f"Writer {number}", last_name="Smith")
+			book = Book.objects.create(title=f"Book {number}", summary="Summary", isbn=f"97800000004{number:02d}", author=author)
+			book.genre.set(cls.genres)
+			book.language.add(cls.english)
+			cls.books.append(book)
+		cls.hobbit = Book.objects.create(title="The Hobbit", summary="Dragon", isbn="9780261102217", author=cls.tolkien)
+		cls.hobbit.genre.add(cls.genres[0])
+		for status in "aao":
+			BookInstance.objects.create(book=cls.hobbit, imprint="Allen", status=status)
+
+	def test_book_list_with_fields_and_embedded_relations(self):
+		url = reverse('api-list', args=['books'])
+		# stamp, page, one prefetch per relation
+		with self.assertNumQueries(5):
+			response = self.client.get(url, {'fields' : 'title,author,genre,language', 'embed' : 'author,genre'})
+		first = response.json()['results'][0]
+		self.assertEqual(first, {
+			'title' : "Book 0",
+			'author' : {'id' : self.books[0].author_id, 'first_name' : "Writer 0", 'last_name' : "Smith",
+						'date_of_birth' : None, 'date_of_death' : None},
+			'genre' : [{'id' : genre.pk, 'name' : genre.name} for genre in self.genres],
+			'language' : [self.english.pk],
+		})
+
+		# the page size does not change the number of queries
+		with self.assertNumQueries(5):
+			self.client.get(url, {'fields' : 'title,author,genre,language', 'embed' : 'author,genre', 'limit' : 2})
+
+	def test_cursor_pagination(self):
+		url = reverse('api-list', args=['books'])
+		page = self.client.get(url, {'limit' : 4, 'fields' : 'title'}).json()
+		self.assertEqual([book['title'] for book in page['results']], ["Book 0", "Book 1", "Book 2", "Book 3"])
+		self.assertIsNone(page['previous'])
+
+		second = self.client.get(page['next']).json()
+		self.assertEqual([book['title'] for book in second['results']], ["Book 4", "The Hobbit"])
+		self.assertIsNone(second['next'])
+		back = self.client.get(second['previous']).json()
+		self.assertEqual(back['results'], page['results'])
+
+	def test_filters_and_errors(self):
+		url = reverse('api-list', args=['books'])
+		books = self.client.get(url, {'author' : self.tolkien.pk, 'fields' : 'id'}).json()['results']
+		self.assertEqual(books, [{'id' : self.hobbit.pk}])
+
+		self.assertEqual(self.client.get(url, {'fields' : 'title,price'}).status_code, 400)
+		self.assertEqual(self.client.get(url, {'embed' : 'summary'}).status_code, 400)
+		self.assertEqual(self.client.get(url, {'after' : 'garbage'}).status_code, 400)
+		for values in (["Book 1", "abc"], [None, None], [[1], {}]):
+			with self.subTest(values=values):
+				self.assertEqual(self.client.get(url, {'after' : encode_cursor(values)}).status_code, 400)
+				self.assertEqual(self.client.get(url, {'before' : encode_cursor(values)}).status_code, 400)
+		copies = reverse('api-book-copies', args=[self.hobbit.pk])
+		self.assertEqual(self.client.get(copies, {'after' : encode_cursor(["not-a-uuid"])}).status_code, 400)
+		self.assertEqual(self.client.get(url, {'limit' : 1000}).status_code, 400)
+		self.assertEqual(self.client.get(reverse('api-list', args=['members'])).status_code, 404)
+		self.assertEqual(self.client.post(url).status_code, 405)
+
+	def test_detail_and_copies(self):
+		response = self.client.get(reverse('api-detail', args=['authors', self.tolkien.pk]), {'fields' : 'last_name'})
+		self.assertEqual(response.json(), {'last_name' : "Tolkien"})
+		self.assertEqual(self.client.get(reverse('api-detail', args=['books', 0])).status_code, 404)
+
+		copies = self.client.get(reverse('api-book-copies', args=[self.hobbit.pk]), {'fields' : 'status'}).json()
+		self.assertEqual((copies['copies_total'], copies['copies_available'], copies['copies_on_loan']), (3, 2, 1))
+		self.assertEqual(sorted(copy['status'] for copy in copies['results']), ["a", "a", "o"])
+
+	def test_conditional_get(self):
+		url = reverse('api-detail', args=['books', self.hobbit.pk])
+		response = self.client.get(url)
+		etag = response['ETag']
+		self.assertIn("no-cache", response['Cache-Control'])
+
+		self.assertTrue(etag.startswith('W/'))
+		self.assertIn('Last-Modified', response)
+
+		# the stamp only, not the queries of the payload
+		with self.assertNumQueries(1):
+			not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(not_modified.status_code, 304)
+		self.assertEqual(not_modified.content, b"")
+		self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+		book = Book.objects.get(pk=self.hobbit.pk)
+		book.title = "The Hobbit, or There and Back Again"
+		book.save()
+		self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+	def test_conditional_get_of_lists_and_copies(self):
+		list_url = f"{reverse('api-list', args=['books'])}?fields=title,author,genre&embed=author"
+		copies_url = reverse('api-book-copies', args=[self.hobbit.pk])
+		for url in (list_url, copies_url):
+			with self.subTest(url=url):
+				etag = self.client.get(url)['ETag']
+				with self.assertNumQueries(1):
+					self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+		# related rows shown on the page
+		etag = self.client.get(list_url)['ETag']
+		self.tolkien.last_name = "Tolkien, J.R.R."
+		self.tolkien.save()
+		self.assertContains(self.client.get(list_url, HTTP_IF_NONE_MATCH=etag), "Tolkien, J.R.R.")
+		etag = self.client.get(list_url)['ETag']
+		self.genres[1].delete()
+		self.assertEqual(self.client.get(list_url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+		etag = self.client.get(copies_url)['ETag']
+		BookInstance.objects.filter(book=self.hobbit, status='o').delete()
+		self.assertEqual(self.client.get(copies_url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
@@ -0,0 +1,167 @@
+import asyncio
+import importlib
+import json
+import threading
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connections
+from django.http import HttpResponse
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import include, path, reverse
+
+from catalog import async_views, threads, urls as catalog_urls
+from catalog.middleware import InstrumentationMiddleware
+from catalog.models import Author, Book, BookInstance, Genre, Hold, Language
+from locallibrary import urls as site_urls
+
+
+ASYNC_VIEWS = {
+	'index' : async_views.index,
+	'books' : async_views.BookListView.as_view(),
+	'book-detail' : async_views.BookDetailView.as_view(),
+	'authors' : async_views.AuthorListView.as_view(),
+	'genre-detail' : async_views.genre_details,
+}
+
+# The site's urls as routed with CATALOG_ASYNC_VIEWS
+urlpatterns = [
+	path('catalog/', include([path(str(pattern.pattern), ASYNC_VIEWS.get(pattern.name, pattern.callback), name=pattern.name)
+							  for pattern in catalog_urls.urlpatterns])),
+] + [pattern for pattern in site_urls.urlpatterns if getattr(pattern, 'urlconf_name', None) != 'catalog.urls']
+
+
+def create_catalog():
+	genre = Genre.objects.create(name="Romance")
+	language = Language.objects.create(name="English")
+	author = Author.objects.create(first_name="Jane", last_name="Austen")
+	books = []
+	for number in range(12):
+		book = Book.objects.create(title=f"Novel {number:02d}", summary="Love and manners",
+								   isbn=f"97800000005{number:02d}", author=author)
+		book.genre.add(genre)
+		book.language.add(language)
+		BookInstance.objects.create(book=book, imprint="Penguin", status="a")
+		books.append(book)
+	return genre, author, books
+
+
+@override_settings(ROOT_URLCONF=__name__, CATALOG_ASYNC_CONCURRENT_QUERIES=False)
+class AsyncViewsTest(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		cls.genre, cls.author, cls.books = create_catalog()
+		cls.member = User.objects.create_user(username="member", password="j123nkhahKA#snjsn")
+
+	def setUp(self):
+		cache.clear()
+
+	async def test_pages(self):
+		pages = [
+			(reverse('index'), "Love Books"),
+			(reverse('books'), "Novel 04"),
+			(reverse('books') + "?page=3", "Novel 11"),
+			(self.books[0].get_absolute_url(), "Love and manners"),
+			(reverse('authors'), "Austen"),
+			(self.genre.get_absolute_url(), "Novel 11"),
+		]
+		for url, text in pages:
+			with self.subTest(url=url):
+				response = await self.async_client.get(url)
+				self.assertContains(response, text)
+
+		cursor = (await self.async_client.get(reverse('books'))).context['page_obj'].next_cursor
+		# Django 3.2's async client sends extra arguments as headers, not as the query string
+		self.assertContains(await self.async_client.get(f"{reverse('books')}?after={cursor}"), "Novel 05")
+
+	async def test_missing_pages(self):
+		for url in [reverse('book-detail', args=[0]), reverse('genre-detail', args=[0]),
+					reverse('books') + "?page=9", reverse('books') + "?after=bogus"]:
+			with self.subTest(url=url):
+				self.assertEqual((await self.async_client.get(url)).status_code, 404)
+
+	async def test_same_validators_as_sync_views(self):
+		for url in [self.books[0].get_absolute_url(), reverse('books') + "?page=2",
+					reverse('authors'), self.genre.get_absolute_url()]:
+			with self.subTest(url=url):
+				response = await self.async_client.get(url)
+				self.assertIn('public', response['Cache-Control'])
+				with override_settings(ROOT_URLCONF=site_urls.__name__):
+					sync = await sync_to_async(self.client.get)(url)
+				self.assertEqual(response['ETag'], sync['ETag'])
+				not_modified = await self.async_client.get(url, **{'if-none-match' : response['ETag']})
+				self.assertEqual(not_modified.status_code, 304)
+
+	async def test_member_sees_hold(self):
+		book = self.books[0]
+		await sync_to_async(Hold.objects.create)(book=book, member=self.member)
+		await sync_to_async(self.async_client.force_login)(self.member)
+		response = await self.async_client.get(book.get_absolute_url())
+		self.assertContains(response, "You are in the queue")
+		self.assertIn('private', response['Cache-Control'])
+
+	@override_settings(CATALOG_INSTRUMENTATION_SAMPLE_RATE=1)
+	async def test_queries_of_worker_threads_are_instrumented(self):
+		with self.assertLogs('catalog.instrumentation') as logs:
+			await self.async_client.get(reverse('books'))
+		line = json.loads(logs.records[0].getMessage())
+		self.assertEqual(line['view'], 'books')
+		# count, page stamp, page
+		self.assertGreaterEqual(line['queries'], 3)
+
+
+class AsyncViewClassTest(TestCase):
+	def test_as_view_is_a_coroutine_function(self):
+		view = async_views.BookListView.as_view()
+		self.assertTrue(asyncio.iscoroutinefunction(view))
+		self.assertIs(view.view_class, async_views.BookListView)
+
+
+class AsyncMiddlewareTest(TestCase):
+	def test_async_chain_stays_async(self):
+		async def get_response(request):
+			return HttpResponse()
+
+		self.assertTrue(asyncio.iscoroutinefunction(InstrumentationMiddleware(get_response)))
+		self.assertFalse(asyncio.iscoroutinefunction(InstrumentationMiddleware(lambda request: HttpResponse())))
+
+
+@override_settings(ROOT_URLCONF=__name__, CATALOG_ASYNC_CONCURRENT_QUERIES=True)
+class ConcurrentQueriesTest(TransactionTestCase):
+	""" Queries in worker threads, each on its own persistent connection """
+
+	def setUp(self):
+		cache.clear()
+		self.genre, self.author, self.books = create_catalog()
+		for database in connections.settings.values():
+			patcher = mock.patch.dict(database, CONN_MAX_AGE=60)
+			patcher.start()
+			self.addCleanup(patcher.stop)
+
+	async def test_default_settings_run_queries_concurrently(self):
+		shipped = importlib.import_module('locallibrary.settings')
+		# the databases of the shipped settings, on the test database
+		databases = {alias : {**connections.settings[alias], 'CONN_MAX_AGE' : database.get('CONN_MAX_AGE', 0)}
+					 for alias, database in shipped.DATABASES.items()}
+		with mock.patch.dict(connections.settings, databases, clear=True), \
+				override_settings(CATALOG_ASYNC_CONCURRENT_QUERIES=shipped.CATALOG_ASYNC_CONCURRENT_QUERIES):
+			self.assertTrue(threads.concurrent_queries())
+			# both calls wait for each other: only passes if they run at once
+			barrier = threading.Barrier(2, timeout=5)
+			await asyncio.gather(threads.run(barrier.wait), threads.run(barrier.wait))
+
+	def test_only_with_persistent_connections(self):
+		self.assertTrue(threads.concurrent_queries())
+		with mock.patch.dict(connections.settings['default'], CONN_MAX_AGE=0):
+			self.assertFalse(threads.concurrent_queries())
+
+	async def test_pages_with_concurrent_queries(self):
+		responses = await asyncio.gather(*[self.async_client.get(url) for url in [
+			reverse('index'), reverse('books'), reverse('authors'),
+			self.books[0].get_absolute_url(), self.genre.get_absolute_url(),
+		]])
+		self.assertEqual([response.status_code for response in responses], [200] * 5)
+		self.assertContains(responses[1], "Novel 04")
+		self.assertContains(responses[4], "Novel 11")
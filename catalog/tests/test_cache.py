@@ -0,0 +1,89 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from catalog.models import Author, Book, BookInstance, Genre, Language
+from catalog.cache import fragment_stats
+from catalog.loans import borrow_copy
+
+
+class FragmentCacheTest(TestCase):
+	def setUp(self):
+		cache.clear()
+		self.author = Author.objects.create(first_name="Jane", last_name="Austen")
+		self.genre = Genre.objects.create(name="Romance")
+		self.language = Language.objects.create(name="English")
+		self.book = Book.objects.create(title="Emma", summary="Matchmaking", isbn="9780141439587", author=self.author)
+		self.book.genre.set([self.genre])
+		self.book.language.set([self.language])
+		self.copy = BookInstance.objects.create(book=self.book, imprint="Penguin", status="a")
+		self.member = User.objects.create_user(username="member", password="j123nkhahKA#snjsn")
+
+	def book_queries(self, url):
+		with CaptureQueriesContext(connection) as queries:
+			response = self.client.get(url)
+		self.assertEqual(response.status_code, 200)
+		return response, [q for q in queries.captured_queries if 'catalog_' in q['sql']]
+
+	def test_book_hit_skips_catalog_queries(self):
+		url = self.book.get_absolute_url()
+		_, first = self.book_queries(url)
+		response, second = self.book_queries(url)
+		self.assertGreater(len(first), 0)
+		# only the page stamp (catalog.conditional) is read
+		self.assertEqual(len(second), 1)
+		self.assertIn('"updated_at"', second[0]['sql'])
+		self.assertContains(response, "Matchmaking")
+		self.assertEqual(fragment_stats()["book-detail"], {"hits" : 1, "misses" : 1, "hit_ratio" : 0.5})
+
+	def test_book_invalidated_by_edits(self):
+		url = self.book.get_absolute_url()
+		self.client.get(url)
+
+		self.book.summary = "Edited summary"
+		self.book.save()
+		self.assertContains(self.client.get(url), "Edited summary")
+
+		borrow_copy(self.copy.pk, self.member, book_id=self.book.pk)
+		self.assertContains(self.client.get(url), "On loan")
+
+		self.genre.name = "Comedy"
+		self.genre.save()
+		self.assertContains(self.client.get(url), "Comedy")
+
+		self.book.language.add(Language.objects.create(name="French"))
+		self.assertContains(self.client.get(url), "French")
+
+		self.author.last_name = "Bronte"
+		self.author.save()
+		self.assertContains(self.client.get(url), "Jane Bronte")
+
+	def test_author_and_genre_pages_invalidated_by_book_changes(self):
+		author_url = self.author.get_absolute_url()
+		genre_url = self.genre.get_absolute_url()
+		self.client.get(author_url)
+		self.client.get(genre_url)
+
+		other = Book.objects.create(title="Persuasion", summary="Second chances", isbn="9780141439686", author=self.author)
+		other.genre.add(self.genre)
+		self.assertContains(self.client.get(author_url), "Persuasion")
+		self.assertContains(self.client.get(genre_url), "Persuasion")
+
+		self.book.genre.remove(self.genre)
+		self.assertNotContains(self.client.get(genre_url), "Emma")
+
+	def test_missing_objects_are_404(self):
+		self.assertEqual(self.client.get(reverse('book-detail', args=[999])).status_code, 404)
+		self.assertEqual(self.client.get(reverse('genre-detail', args=[999])).status_code, 404)
+
+	def test_stats_endpoint_is_staff_only(self):
+		response = self.client.get(reverse('fragment-cache-stats'))
+		self.assertEqual(response.status_code, 302)
+		User.objects.create_user(username="staff", password="2HJ1vRV0Z&3iD", is_staff=True)
+		self.client.login(username="staff", password="2HJ1vRV0Z&3iD")
+		self.client.get(self.genre.get_absolute_url())
+		response = self.client.get(reverse('fragment-cache-stats'))
+		self.assertEqual(response.json()["genre-detail"]["misses"], 1)
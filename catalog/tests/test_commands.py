@@ -0,0 +1,283 @@
+import datetime
+import io
+import json
+import os
+import tempfile
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+
+from catalog.models import Author, Book, BookInstance, Genre, Language, OutgoingEmail, OverdueNotice
+from catalog.overdue import overdue_loans
+from catalog.search import search_books
+from catalog.stats import get_catalog_stats, count_catalog_stats
+
+
+class ImportCatalogCommandTest(TestCase):
+	def write_input(self, suffix, content):
+		handle, path = tempfile.mkstemp(suffix=suffix)
+		with os.fdopen(handle, "w") as stream:
+			stream.write(content)
+		self.addCleanup(os.remove, path)
+		return path
+
+	def import_file(self, path, *args):
+		out = io.StringIO()
+		call_command("import_catalog", path, *args, stdout=out, stderr=io.StringIO())
+		return out.getvalue()
+
+	def test_import_csv(self):
+		Author.objects.create(first_name="Jane", last_name="Austen")
+		path = self.write_input(".csv", "\n".join([
+			"title,summary,isbn,author,genres,languages,copies,imprint",
+			"The Hobbit,A hobbit and a dragon,9780261102217,John Tolkien,Fantasy;Adventure,English,3,Allen",
+			"Emma,A story of love,9780141439587,Jane Austen,Romance,English;French,2,Penguin",
+			"Emma again,duplicate isbn,9780141439587,Jane Austen,Romance,English,1,Penguin",
+			",missing title,1234,Nobody,,,1,",
+			"Persuasion,Second chances,9780141439686,Jane Austen,Romance,English,1,Penguin",
+		]))
+		output = self.import_file(path, "--batch-size", "2")
+		self.assertIn("Imported 3 books and 6 copies", output)
+		self.assertIn("skipped 1 duplicates and 1 invalid rows", output)
+
+		self.assertEqual(Author.objects.filter(last_name="Austen").count(), 1)
+		emma = Book.objects.get(isbn="9780141439587")
+		self.assertEqual(emma.author.last_name, "Austen")
+		self.assertEqual(set(emma.language.values_list("name", flat=True)), {"English", "French"})
+		self.assertEqual(emma.bookinstance_set.filter(status="a").count(), 2)
+		self.assertEqual((emma.copies_total, emma.copies_available, emma.copies_on_loan), (2, 2, 0))
+		self.assertEqual(Genre.objects.count(), 3)
+		self.assertEqual(Language.objects.count(), 2)
+
+		# side tables maintained without signals
+		self.assertEqual(list(search_books("dragon")), [Book.objects.get(isbn="9780261102217")])
+		stats = get_catalog_stats()
+		for field, value in count_catalog_stats().items():
+			self.assertEqual(getattr(stats, field), value, field)
+
+	def test_import_jsonl_skips_existing_isbn(self):
+		author = Author.objects.create(first_name="Jane", last_name="Austen")
+		Book.objects.create(title="Emma", summary="summary", isbn="9780141439587", author=author)
+		path = self.write_input(".jsonl", "\n".join(json.dumps(record) for record in [
+			{"title" : "Emma", "isbn" : "9780141439587", "author" : "Jane Austen"},
+			{"title" : "Dune", "isbn" : "9780441013593", "author_first_name" : "Frank",
+			 "author_last_name" : "Herbert", "genres" : ["Science Fiction"], "copies" : 2, "status" : "m"},
+		]))
+		output = self.import_file(path)
+		self.assertIn("Imported 1 books and 2 copies", output)
+		dune = Book.objects.get(isbn="9780441013593")
+		self.assertEqual(str(dune.author), "Frank Herbert")
+		self.assertEqual(list(dune.genre.values_list("name", flat=True)), ["Science Fiction"])
+		self.assertEqual(BookInstance.objects.filter(book=dune, status="m").count(), 2)
+
+	def test_import_counts_malformed_records_as_invalid(self):
+		path = self.write_input(".jsonl", "\n".join(json.dumps(record) for record in [
+			["not", "an", "object"],
+			{"title" : "Dune", "isbn" : 9780441013593},
+			{"title" : ["Dune"], "isbn" : "9780441013594"},
+			{"title" : "Dune", "isbn" : "9780441013595", "author" : 7},
+			{"title" : "Dune", "isbn" : "9780441013596", "genres" : 5},
+			{"title" : "Dune", "isbn" : "9780441013597", "genres" : ["Science Fiction"]},
+		]))
+		output = self.import_file(path)
+		self.assertIn("Imported 1 books and 1 copies", output)
+		self.assertIn("skipped 0 duplicates and 5 invalid rows", output)
+
+	def test_import_rejects_bad_copies_and_statuses(self):
+		path = self.write_input(".jsonl", "\n".join(json.dumps(record) for record in [
+			{"title" : "Dune", "isbn" : "9780441013593", "copies" : 10 ** 9},
+			{"title" : "Dune", "isbn" : "9780441013594", "copies" : "many"},
+			{"title" : "Dune", "isbn" : "9780441013595", "copies" : -1},
+			{"title" : "Dune", "isbn" : "9780441013596", "status" : "x"},
+			# on loan copies need a borrower
+			{"title" : "Dune", "isbn" : "9780441013598", "status" : "o"},
+			{"title" : "Dune", "isbn" : "9780441013597", "copies" : 100, "status" : "m"},
+		]))
+		output = self.import_file(path)
+		self.assertIn("Imported 1 books and 100 copies", output)
+		self.assertIn("skipped 0 duplicates and 5 invalid rows", output)
+		self.assertEqual(list(Book.objects.values_list("isbn", flat=True)), ["9780441013597"])
+
+
+class ExportCatalogTest(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		author = Author.objects.create(first_name="Jane", last_name="Austen")
+		romance = Genre.objects.create(name="Romance")
+		english = Language.objects.create(name="English")
+		for number in range(5):
+			book = Book.objects.create(title=f"Book {number}", summary="summary", isbn=f"97800000003{number:02d}", author=author)
+			book.genre.set([romance])
+			book.language.set([english])
+			BookInstance.objects.create(book=book, imprint="Imprint", status="a")
+			BookInstance.objects.create(book=book, imprint="Imprint", status="o")
+
+	def export(self, *args):
+		out = io.StringIO()
+		call_command("export_catalog", *args, stdout=out)
+		return out.getvalue()
+
+	def test_books_csv(self):
+		lines = self.export("books").splitlines()
+		self.assertEqual(len(lines), 6)
+		self.assertTrue(lines[0].startswith("id,title,isbn,author,genres,languages,copies_total"))
+		self.assertIn("Book 0,9780000000300,Jane Austen,Romance,English,2,1,1,0,0", lines[1])
+
+	def test_loans_jsonl(self):
+		rows = [json.loads(line) for line in self.export("loans", "--format", "jsonl").splitlines()]
+		self.assertEqual(len(rows), 5)
+		self.assertEqual(rows[0]["imprint"], "Imprint")
+		self.assertFalse(rows[0]["is_overdue"])
+
+	def test_queries_per_chunk_are_constant(self):
+		# 5 books in chunks of 2: 3 chunks x (books + genres + languages) plus the empty final read
+		with self.assertNumQueries(3 * 3 + 1):
+			self.export("books", "--chunk-size", "2")
+
+
+class ProcessOverdueCommandTest(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		cls.today = datetime.date(2026, 3, 10)
+		author = Author.objects.create(first_name="Mary", last_name="Shelley")
+		cls.book = Book.objects.create(title="Frankenstein", summary="Monster", isbn="9780141439471", author=author)
+		cls.alice = User.objects.create_user(username="alice", email="alice@example.com", password="j123nkhahKA#snjsn")
+		cls.bob = User.objects.create_user(username="bob", password="j123nkhahKA#snjsn")
+		for days_late in (1, 4, 9):
+			BookInstance.objects.create(book=cls.book, imprint="Penguin", status="o", borrower=cls.alice,
+										due_back=cls.today - datetime.timedelta(days=days_late))
+		BookInstance.objects.create(book=cls.book, imprint="Penguin", status="o", borrower=cls.bob,
+									due_back=cls.today - datetime.timedelta(days=2))
+		# not overdue yet / not on loan
+		BookInstance.objects.create(book=cls.book, imprint="Penguin", status="o", borrower=cls.alice, due_back=cls.today)
+		BookInstance.objects.create(book=cls.book, imprint="Penguin", status="a", due_back=cls.today - datetime.timedelta(days=5))
+
+	def run_command(self, *args):
+		out = io.StringIO()
+		call_command('process_overdue', '--date', self.today.isoformat(), *args, stdout=out)
+		return out.getvalue()
+
+	def test_notices_fines_and_one_reminder_per_borrower(self):
+		output = self.run_command('--batch-size', '10')
+		self.assertIn("Noticed 4 overdue loans in 1 batches", output)
+		self.assertEqual(OverdueNotice.objects.count(), 4)
+		self.assertEqual(sum(n.fine for n in OverdueNotice.objects.all()), Decimal("8.00"))
+		self.assertFalse(OverdueNotice.objects.get(borrower=self.bob).emailed)
+
+		# bob has no email address, alice's three loans share one message
+		self.assertEqual(len(mail.outbox), 1)
+		self.assertEqual(mail.outbox[0].to, ["alice@example.com"])
+		self.assertEqual(mail.outbox[0].body.count("Frankenstein"), 3)
+
+	def test_rerun_does_not_notify_again(self):
+		self.run_command('--batch-size', '2')
+		self.assertEqual(OverdueNotice.objects.count(), 4)
+		output = self.run_command()
+		self.assertIn("Noticed 0 overdue loans", output)
+		self.assertEqual(OverdueNotice.objects.count(), 4)
+		self.assertEqual(OutgoingEmail.objects.count(), 2)
+
+	def test_renewed_loan_is_noticed_again(self):
+		self.run_command('--no-send')
+		self.assertEqual(len(mail.outbox), 0)
+		copy = BookInstance.objects.get(borrower=self.bob)
+		copy.due_back = self.today - datetime.timedelta(days=1)
+		copy.save()
+		self.run_command()
+		self.assertEqual(OverdueNotice.objects.filter(copy=copy).count(), 2)
+
+	def test_loan_noticed_by_a_concurrent_run_is_skipped(self):
+		copy = BookInstance.objects.get(borrower=self.bob)
+		OverdueNotice.objects.create(copy=copy, borrower=self.bob, due_back=copy.due_back,
+									 days_overdue=2, fine=Decimal("1.00"))
+		calls = []
+
+		def stale_lookup(today):
+			calls.append(today)
+			if len(calls) == 1:
+				# read before the concurrent run committed its notice
+				return BookInstance.objects.filter(status__exact='o', due_back__lt=today, borrower__isnull=False)
+			return overdue_loans(today)
+
+		with mock.patch('catalog.overdue.overdue_loans', stale_lookup):
+			output = self.run_command('--batch-size', '10')
+		self.assertIn("Noticed 3 overdue loans in 1 batches", output)
+		self.assertEqual(OverdueNotice.objects.count(), 4)
+		self.assertEqual(OutgoingEmail.objects.count(), 1)
+
+	def test_overdue_lookup_is_one_query(self):
+		with self.assertNumQueries(1):
+			self.assertEqual(overdue_loans(self.today).count(), 4)
+
+
+class BenchmarkHttpCommandTest(TestCase):
+	def test_report_covers_every_endpoint(self):
+		out = io.StringIO()
+		call_command('benchmark_http', '--seed-books', '20', '--requests', '4', '--seed', '7',
+					 '--label', 'test', stdout=out, stderr=io.StringIO())
+		report = json.loads(out.getvalue())
+
+		self.assertEqual(report['label'], 'test')
+		self.assertEqual(report['seeded']['books'], 20)
+		expected = {'index', 'books', 'book-detail', 'authors', 'genres', 'my-borrowed', 'all-borrowed', 'borrow-book', 'return-book'}
+		self.assertEqual(set(report['endpoints']), expected)
+		for name, result in report['endpoints'].items():
+			self.assertEqual((result['requests'], result['errors']), (4, 0), name)
+			self.assertLessEqual(result['p50_ms'], result['p95_ms'])
+			self.assertLessEqual(result['p95_ms'], result['p99_ms'])
+			self.assertGreater(result['queries_per_request'], 0)
+
+		# the flow puts its copies back on the shelf and the benchmark users are gone
+		self.assertFalse(BookInstance.objects.filter(borrower__username__startswith="benchmark-http").exists())
+		self.assertFalse(User.objects.filter(username__startswith="benchmark-http").exists())
+		self.assertEqual(
+			sum(Book.objects.values_list('copies_available', flat=True)),
+			BookInstance.objects.filter(status__exact='a').count(),
+		)
+
+
+class BenchmarkLoanQueriesCommandTest(TransactionTestCase):
+	""" --compare drops and restores indexes, which SQLite cannot do inside a test transaction """
+
+	def index_names(self):
+		with connection.cursor() as cursor:
+			constraints = connection.introspection.get_constraints(cursor, BookInstance._meta.db_table)
+		return {name for name, constraint in constraints.items() if constraint['index']}
+
+	def test_compare_refuses_an_unseeded_database(self):
+		indexes = self.index_names()
+		with self.assertRaisesMessage(CommandError, "--i-know"):
+			call_command('benchmark_loan_queries', '--compare', stdout=io.StringIO())
+		self.assertEqual(self.index_names(), indexes)
+
+	def test_compare_restores_the_indexes(self):
+		indexes = self.index_names()
+		for args in (['--seed-books', '5'], ['--i-know']):
+			out = io.StringIO()
+			call_command('benchmark_loan_queries', '--compare', '--no-plans', '--repeat', '1', *args, stdout=out)
+			self.assertIn("Speed-up from indexes", out.getvalue())
+			self.assertEqual(self.index_names(), indexes)
+
+
+class BenchmarkServersCommandTest(TransactionTestCase):
+	""" The servers' worker threads read the seeded data on their own connections """
+
+	def test_both_servers_serve_every_endpoint(self):
+		for server in ('wsgi', 'asgi'):
+			out = io.StringIO()
+			call_command('benchmark_servers', '--server', server, '--seed-books', '10' if server == 'wsgi' else '0',
+						 '--requests', '6', '--clients', '3', '--workers', '2', '--client-delay', '1', '--seed', '7',
+						 stdout=out, stderr=io.StringIO())
+			report = json.loads(out.getvalue())
+
+			self.assertEqual(report['server'], server)
+			self.assertEqual(set(report['endpoints']), {'index', 'books', 'book-detail', 'authors', 'genre-detail'})
+			for name, result in report['endpoints'].items():
+				self.assertEqual((result['requests'], result['errors']), (6, 0), (server, name))
+				self.assertLessEqual(result['p50_ms'], result['p95_ms'])
@@ -0,0 +1,107 @@
+import datetime
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from catalog.models import Author, Book, BookInstance, Genre, Language
+from catalog.loans import borrow_copy
+
+
+class ConditionalPageTest(TestCase):
+	def setUp(self):
+		cache.clear()
+		self.author = Author.objects.create(first_name="Jane", last_name="Austen")
+		self.genre = Genre.objects.create(name="Romance")
+		self.language = Language.objects.create(name="English")
+		self.book = Book.objects.create(title="Emma", summary="Matchmaking", isbn="9780141439587", author=self.author)
+		self.book.genre.set([self.genre])
+		self.book.language.set([self.language])
+		self.copy = BookInstance.objects.create(book=self.book, imprint="Penguin", status="a")
+		self.member = User.objects.create_user(username="member", password="j123nkhahKA#snjsn")
+
+	def revalidate(self, url, response):
+		return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+	def test_anonymous_pages_revalidate(self):
+		urls = [self.book.get_absolute_url(), self.author.get_absolute_url(), self.genre.get_absolute_url(),
+				reverse('books'), reverse('authors'), reverse('genres')]
+		for url in urls:
+			with self.subTest(url=url):
+				response = self.client.get(url)
+				self.assertEqual(response.status_code, 200)
+				self.assertTrue(response['ETag'].startswith('W/'))
+				self.assertIn('Last-Modified', response)
+				self.assertIn('public', response['Cache-Control'])
+				self.assertIn('Cookie', response['Vary'])
+
+				with CaptureQueriesContext(connection) as queries:
+					not_modified = self.revalidate(url, response)
+				self.assertEqual(not_modified.status_code, 304)
+				self.assertEqual(not_modified.content, b"")
+				# the page stamp only (plus the paginator count on list pages)
+				self.assertLessEqual(len(queries), 2)
+
+				since = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+				self.assertEqual(since.status_code, 304)
+
+	def test_changes_invalidate_book_page(self):
+		url = self.book.get_absolute_url()
+		response = self.client.get(url)
+
+		self.book.summary = "Edited summary"
+		self.book.save()
+		edited = self.revalidate(url, response)
+		self.assertContains(edited, "Edited summary")
+
+		borrow_copy(self.copy.pk, self.member, book_id=self.book.pk)
+		self.client.logout()
+		borrowed = self.revalidate(url, edited)
+		self.assertContains(borrowed, "On loan")
+
+		self.book.genre.add(Genre.objects.create(name="Satire"))
+		self.assertContains(self.revalidate(url, borrowed), "Satire")
+
+	def test_changes_invalidate_list_pages(self):
+		books = self.client.get(reverse('books'))
+		self.author.last_name = "Bronte"
+		self.author.save()
+		self.assertContains(self.revalidate(reverse('books'), books), "Bronte")
+
+		genres = self.client.get(reverse('genres'))
+		self.genre.delete()
+		self.assertEqual(self.revalidate(reverse('genres'), genres).status_code, 200)
+
+	def test_deletions_move_last_modified(self):
+		other = Book.objects.create(title="Persuasion", summary="Second chances", isbn="9780141439686",
+									author=self.author)
+		other.genre.set([self.genre])
+		urls = [self.genre.get_absolute_url(), reverse('books'), reverse('api-list', args=['books'])]
+		pages = {url : self.client.get(url) for url in urls}
+
+		later = timezone.now() + datetime.timedelta(seconds=5)
+		with mock.patch('django.utils.timezone.now', return_value=later):
+			other.delete()
+		for url, page in pages.items():
+			with self.subTest(url=url):
+				response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=page['Last-Modified'])
+				self.assertEqual(response.status_code, 200)
+				self.assertNotContains(response, "Persuasion")
+				self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+	def test_member_pages_are_private(self):
+		self.client.force_login(self.member)
+		response = self.client.get(self.book.get_absolute_url())
+		self.assertEqual(response.status_code, 200)
+		self.assertIn('private', response['Cache-Control'])
+		self.assertNotIn('ETag', response)
+
+	def test_missing_objects_and_bad_pages(self):
+		self.assertEqual(self.client.get(reverse('book-detail', args=[0])).status_code, 404)
+		self.assertEqual(self.client.get(reverse('books'), {'page' : 99}).status_code, 404)
+		self.assertEqual(self.client.get(reverse('books'), {'after' : 'bogus'}).status_code, 404)
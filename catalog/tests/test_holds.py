@@ -0,0 +1,220 @@
+import datetime
+import threading
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+
+from catalog.models import Author, Book, BookInstance, Hold, OutgoingEmail
+from catalog.holds import place_hold, cancel_hold, queue_position
+from catalog.loans import borrow_copy, return_copy, collect_hold
+from catalog.stats import get_catalog_stats
+
+
+def create_book(copies, isbn="8888888888"):
+	author = Author.objects.create(first_name="Frank", last_name="Herbert")
+	book = Book.objects.create(title="Dune", summary="Spice", isbn=isbn, author=author)
+	for _ in range(copies):
+		BookInstance.objects.create(book=book, imprint="Ace", status="a")
+	return book
+
+
+def counters(book):
+	book.refresh_from_db()
+	return (book.copies_total, book.copies_available, book.copies_on_loan)
+
+
+class HoldQueueTest(TestCase):
+	def setUp(self):
+		self.book = create_book(1)
+		self.copy = self.book.bookinstance_set.get()
+		self.reader = User.objects.create_user(username="reader", email="reader@example.com")
+		self.first = User.objects.create_user(username="first", email="first@example.com")
+		self.second = User.objects.create_user(username="second")
+		borrow_copy(self.copy.pk, self.reader)
+
+	def test_one_active_hold_per_member(self):
+		hold = place_hold(self.book.pk, self.first)
+		self.assertIsNotNone(hold)
+		self.assertIsNone(place_hold(self.book.pk, self.first))
+		self.assertEqual(queue_position(place_hold(self.book.pk, self.second)), 2)
+
+	def test_database_refuses_a_second_active_hold(self):
+		place_hold(self.book.pk, self.first)
+		# what a concurrent request that passed the check would insert
+		with self.assertRaises(IntegrityError), transaction.atomic():
+			Hold.objects.create(book=self.book, member=self.first)
+		Hold.objects.filter(member=self.first).update(status='c')
+		self.assertIsNotNone(place_hold(self.book.pk, self.first))
+
+	def test_return_allocates_to_oldest_waiting_hold(self):
+		first = place_hold(self.book.pk, self.first)
+		second = place_hold(self.book.pk, self.second)
+		self.assertTrue(return_copy(self.copy.pk, self.reader))
+
+		self.copy.refresh_from_db()
+		first.refresh_from_db()
+		self.assertEqual((self.copy.status, self.copy.borrower), ("r", None))
+		self.assertEqual((first.status, first.copy_id), ("r", self.copy.pk))
+		self.assertEqual(Hold.objects.get(pk=second.pk).status, "w")
+		self.assertEqual(queue_position(second), 1)
+		self.assertEqual(counters(self.book), (1, 0, 0))
+		self.assertEqual(OutgoingEmail.objects.get().to, "first@example.com")
+
+	def test_hold_on_a_shelved_copy_is_ready_at_once(self):
+		book = create_book(2, isbn="9999999999")
+		hold = place_hold(book.pk, self.first)
+		self.assertEqual(hold.status, "r")
+		self.assertEqual(BookInstance.objects.get(pk=hold.copy_id).status, "r")
+		self.assertEqual(counters(book), (2, 1, 0))
+		self.assertEqual(OutgoingEmail.objects.get().to, "first@example.com")
+
+		self.assertEqual(place_hold(book.pk, self.second).status, "r")
+		# no copy left on the shelf
+		self.assertEqual(place_hold(book.pk, self.reader).status, "w")
+		self.assertEqual(counters(book), (2, 0, 0))
+
+	def test_copy_saved_as_available_goes_to_waiting_hold(self):
+		hold = place_hold(self.book.pk, self.first)
+		repaired = BookInstance.objects.create(book=self.book, imprint="Ace", status="m")
+		with self.captureOnCommitCallbacks(execute=True):
+			repaired.status = "a"
+			repaired.save()
+
+		hold.refresh_from_db()
+		self.assertEqual((hold.status, hold.copy_id), ("r", repaired.pk))
+		self.assertEqual(BookInstance.objects.get(pk=repaired.pk).status, "r")
+		self.assertEqual(counters(self.book), (2, 0, 1))
+		self.assertEqual(OutgoingEmail.objects.get().to, "first@example.com")
+
+	def test_new_available_copy_goes_to_waiting_hold(self):
+		hold = place_hold(self.book.pk, self.first)
+		with self.captureOnCommitCallbacks(execute=True):
+			copy = BookInstance.objects.create(book=self.book, imprint="Ace", status="a")
+		hold.refresh_from_db()
+		self.assertEqual((hold.status, hold.copy_id), ("r", copy.pk))
+
+	def test_return_without_holds_goes_to_maintenance(self):
+		self.assertTrue(return_copy(self.copy.pk, self.reader))
+		self.copy.refresh_from_db()
+		self.assertEqual(self.copy.status, "m")
+
+	def test_collect_lends_reserved_copy(self):
+		hold = place_hold(self.book.pk, self.first)
+		return_copy(self.copy.pk, self.reader)
+		self.assertFalse(collect_hold(hold.pk, self.second))
+		self.assertTrue(collect_hold(hold.pk, self.first))
+		self.copy.refresh_from_db()
+		self.assertEqual((self.copy.status, self.copy.borrower), ("o", self.first))
+		self.assertEqual(Hold.objects.get(pk=hold.pk).status, "f")
+		self.assertEqual(counters(self.book), (1, 0, 1))
+		self.assertFalse(collect_hold(hold.pk, self.first))
+
+	def test_cancelled_ready_hold_passes_copy_on(self):
+		first = place_hold(self.book.pk, self.first)
+		second = place_hold(self.book.pk, self.second)
+		return_copy(self.copy.pk, self.reader)
+
+		self.assertTrue(cancel_hold(first.pk, self.first))
+		self.assertEqual(Hold.objects.get(pk=second.pk).copy_id, self.copy.pk)
+
+		available_before = get_catalog_stats().num_instances_available
+		self.assertTrue(cancel_hold(second.pk, self.second))
+		self.copy.refresh_from_db()
+		self.assertEqual(self.copy.status, "a")
+		self.assertEqual(counters(self.book), (1, 1, 0))
+		self.assertEqual(get_catalog_stats().num_instances_available, available_before + 1)
+		self.assertFalse(cancel_hold(second.pk, self.second))
+
+	def test_queue_head_uses_index(self):
+		plan = Hold.objects.filter(book=self.book, status='w').order_by('created_at', 'pk')[:1].explain()
+		self.assertIn("catalog_hold_queue_idx", plan)
+
+
+class HoldViewsTest(TestCase):
+	def setUp(self):
+		self.book = create_book(1)
+		self.member = User.objects.create_user(username="member", password="j123nkhahKA#snjsn")
+		self.client.login(username="member", password="j123nkhahKA#snjsn")
+
+	def test_place_hold_and_list_position(self):
+		other = User.objects.create_user(username="other")
+		borrow_copy(self.book.bookinstance_set.get().pk, other)
+		place_hold(self.book.pk, User.objects.create_user(username="waiting"))
+		self.assertEqual(self.client.get(reverse('place-hold', args=[self.book.pk])).status_code, 405)
+
+		response = self.client.post(reverse('place-hold', args=[self.book.pk]), follow=True)
+		self.assertContains(response, "You are in the queue")
+		self.assertContains(response, "2 members waiting")
+
+		response = self.client.get(reverse('my-holds'))
+		self.assertEqual(response.context['holds'][0].position, 2)
+		self.assertContains(response, "number 2 in the queue")
+
+	def test_place_hold_on_a_shelved_copy(self):
+		response = self.client.post(reverse('place-hold', args=[self.book.pk]), follow=True)
+		self.assertContains(response, "is reserved for you")
+		self.assertContains(response, "You have a copy ready for pickup")
+
+	def test_collect_view(self):
+		copy = self.book.bookinstance_set.get()
+		reader = User.objects.create_user(username="reader")
+		borrow_copy(copy.pk, reader)
+		hold = place_hold(self.book.pk, self.member)
+		return_copy(copy.pk, reader)
+
+		response = self.client.post(reverse('collect-hold', args=[hold.pk]))
+		self.assertRedirects(response, reverse('my-borrowed'))
+		self.assertEqual(BookInstance.objects.get(pk=copy.pk).borrower, self.member)
+
+
+class ConcurrentReturnTest(TransactionTestCase):
+	""" Many copies come back at once while a long queue waits: every copy goes to a distinct hold, oldest first """
+	copies = 8
+	waiting = 200
+
+	def setUp(self):
+		self.book = create_book(self.copies, isbn="9999999999")
+		self.readers = []
+		for n, copy in enumerate(self.book.bookinstance_set.all()):
+			reader = User.objects.create_user(username=f"reader{n}")
+			borrow_copy(copy.pk, reader)
+			self.readers.append((copy.pk, reader))
+
+		start = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+		User.objects.bulk_create(User(username=f"waiting{n:03}") for n in range(self.waiting))
+		members = User.objects.filter(username__startswith="waiting").order_by('username')
+		Hold.objects.bulk_create(
+			Hold(book=self.book, member=member, created_at=start + datetime.timedelta(seconds=n))
+			for n, member in enumerate(members)
+		)
+
+	def test_returns_allocate_oldest_holds_once(self):
+		barrier = threading.Barrier(self.copies)
+		errors = []
+
+		def give_back(copy_id, reader):
+			try:
+				barrier.wait()
+				if not return_copy(copy_id, reader):
+					errors.append(f"return of {copy_id} failed")
+			except Exception as error:
+				errors.append(error)
+			finally:
+				connection.close()
+
+		workers = [threading.Thread(target=give_back, args=reader) for reader in self.readers]
+		for worker in workers:
+			worker.start()
+		for worker in workers:
+			worker.join()
+
+		self.assertEqual(errors, [])
+		ready = list(Hold.objects.filter(status='r').order_by('created_at'))
+		oldest = list(Hold.objects.order_by('created_at')[:self.copies])
+		self.assertEqual(ready, oldest)
+		self.assertEqual(sorted(hold.copy_id for hold in ready), sorted(copy_id for copy_id, _ in self.readers))
+		self.assertEqual(Hold.objects.filter(status='w').count(), self.waiting - self.copies)
+		self.assertEqual(BookInstance.objects.filter(book=self.book, status='r').count(), self.copies)
+		self.assertEqual(counters(self.book), (self.copies, 0, 0))
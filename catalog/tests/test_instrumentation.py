@@ -0,0 +1,79 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.template import engines
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from catalog.models import Author, Book
+from catalog.instrumentation import recording, view_stats
+
+
+class RecordingTest(TestCase):
+	def test_counts_duplicate_and_similar_queries(self):
+		with recording() as current:
+			Book.objects.filter(pk=1).exists()
+			Book.objects.filter(pk=1).exists()
+			Book.objects.filter(pk=2).exists()
+			Author.objects.count()
+		self.assertEqual(current.queries, 4)
+		self.assertEqual(current.duplicate_queries, 1)
+		self.assertEqual(current.similar_queries, 1)
+		self.assertEqual(current.most_repeated()[1], 3)
+		self.assertGreater(current.db_time, 0)
+
+		Book.objects.count()
+		self.assertEqual(current.queries, 4)
+
+	def test_times_outermost_template_render(self):
+		template = engines['django'].from_string("{% for n in numbers %}{{ n }}{% endfor %}")
+		with recording() as current:
+			template.render({'numbers' : range(1000)})
+		self.assertGreater(current.template_time, 0)
+		self.assertFalse(current.rendering)
+
+
+@override_settings(CATALOG_INSTRUMENTATION_SAMPLE_RATE=1)
+class InstrumentationMiddlewareTest(TestCase):
+	def setUp(self):
+		cache.clear()
+		author = Author.objects.create(first_name="Ursula", last_name="Le Guin")
+		for n in range(3):
+			Book.objects.create(title=f"Earthsea {n}", summary="Wizards", isbn=f"100000000{n}", author=author)
+
+	def test_sampled_request_is_logged_and_counted(self):
+		with self.assertLogs('catalog.instrumentation', 'INFO') as logs:
+			response = self.client.get(reverse('authors'))
+		line = json.loads(logs.records[0].getMessage())
+		self.assertEqual(line['view'], 'authors')
+		self.assertEqual(line['status'], 200)
+		self.assertEqual(line['bytes'], len(response.content))
+		self.assertGreater(line['queries'], 0)
+		self.assertGreater(line['template_ms'], 0)
+
+		stats = view_stats()['views']['authors']
+		self.assertEqual(stats['sampled_requests'], 1)
+		self.assertEqual(stats['avg_queries'], line['queries'])
+		self.assertEqual(stats['avg_bytes'], len(response.content))
+
+	@override_settings(CATALOG_INSTRUMENTATION_SAMPLE_RATE=0)
+	def test_unsampled_requests_are_not_recorded(self):
+		self.client.get(reverse('authors'))
+		self.assertEqual(view_stats()['views'], {})
+
+	def test_only_catalog_views_are_recorded(self):
+		self.client.get(reverse('admin:login'))
+		self.assertEqual(view_stats()['views'], {})
+
+	def test_stats_endpoint_is_staff_only(self):
+		with self.assertLogs('catalog.instrumentation', 'INFO'):
+			self.client.get(reverse('authors'))
+			url = reverse('instrumentation-stats')
+			self.assertEqual(self.client.get(url).status_code, 302)
+
+			User.objects.create_user(username="staff", password="j123nkhahKA#snjsn", is_staff=True)
+			self.client.login(username="staff", password="j123nkhahKA#snjsn")
+			self.assertEqual(self.client.get(url).json()['views']['authors']['sampled_requests'], 1)
+			self.client.post(url)
+			self.assertNotIn('authors', self.client.get(url).json()['views'])
@@ -0,0 +1,124 @@
+import datetime
+import threading
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+
+from catalog.models import Author, Book, BookInstance
+from catalog.loans import borrow_copy, return_copy
+from catalog.stats import get_catalog_stats
+
+
+def create_copy(status="a"):
+	author = Author.objects.create(first_name="John", last_name="Smith")
+	book = Book.objects.create(title="Borrowed", summary="summary", isbn="6666666666", author=author)
+	return BookInstance.objects.create(book=book, imprint="Imprint", status=status)
+
+
+class BorrowReturnViewTest(TestCase):
+	def setUp(self):
+		self.member = User.objects.create_user(username="member", password="j123nkhahKA#snjsn")
+		self.other = User.objects.create_user(username="other", password="j14Aj34jkad+snjsn")
+		self.copy = create_copy()
+		self.client.login(username="member", password="j123nkhahKA#snjsn")
+
+	def borrow(self):
+		due_back = datetime.date.today() + datetime.timedelta(weeks=3)
+		return self.client.post(reverse('borrow-book', args=[self.copy.pk]), {
+			"book" : self.copy.book.pk,
+			"imprint" : self.copy.imprint,
+			"due_back" : due_back,
+		})
+
+	def test_borrow_available_copy(self):
+		response = self.borrow()
+		self.assertRedirects(response, reverse('my-borrowed'))
+		self.copy.refresh_from_db()
+		self.assertEqual(self.copy.status, "o")
+		self.assertEqual(self.copy.borrower, self.member)
+		self.assertEqual(get_catalog_stats().num_instances_available, 0)
+
+	def test_borrow_taken_copy_is_conflict(self):
+		borrow_copy(self.copy.pk, self.other)
+		response = self.borrow()
+		self.assertEqual(response.status_code, 409)
+		self.assertTemplateUsed(response, "borrow_conflict.html")
+		self.copy.refresh_from_db()
+		self.assertEqual(self.copy.borrower, self.other)
+
+	def test_return(self):
+		self.borrow()
+		response = self.client.get(reverse('return-book', args=[self.copy.pk]))
+		self.assertRedirects(response, reverse('my-borrowed'))
+		self.copy.refresh_from_db()
+		self.assertEqual(self.copy.status, "m")
+		self.assertIsNone(self.copy.borrower)
+
+	def test_cannot_return_someone_elses_copy(self):
+		borrow_copy(self.copy.pk, self.other)
+		self.client.get(reverse('return-book', args=[self.copy.pk]))
+		self.copy.refresh_from_db()
+		self.assertEqual(self.copy.borrower, self.other)
+
+	def test_overdue_copy_is_not_returned(self):
+		borrow_copy(self.copy.pk, self.member, datetime.date.today() - datetime.timedelta(days=1))
+		response = self.client.get(reverse('return-book', args=[self.copy.pk]), follow=True)
+		self.assertContains(response, "overdue loan period")
+		self.copy.refresh_from_db()
+		self.assertEqual(self.copy.status, "o")
+		self.assertFalse(return_copy(self.copy.pk, self.member))
+
+	def test_borrow_writes_only_loan_columns(self):
+		self.copy.imprint = "Changed elsewhere"
+		# the loan UPDATE plus the home page and book copy counters
+		with self.assertNumQueries(3):
+			borrow_copy(self.copy.pk, self.member, book_id=self.copy.book_id)
+		self.copy.refresh_from_db()
+		self.assertEqual(self.copy.imprint, "Imprint")
+
+
+class ConcurrentBorrowTest(TransactionTestCase):
+	""" Many members race for the same copies, every copy must be lent exactly once """
+	threads = 8
+	copies = 5
+
+	def setUp(self):
+		self.members = [User.objects.create_user(username=f"member{n}") for n in range(self.threads)]
+		author = Author.objects.create(first_name="John", last_name="Smith")
+		book = Book.objects.create(title="Popular", summary="summary", isbn="7777777777", author=author)
+		self.copy_ids = [
+			BookInstance.objects.create(book=book, imprint="Imprint", status="a").pk for _ in range(self.copies)
+		]
+
+	def test_no_double_loans(self):
+		barrier = threading.Barrier(self.threads)
+		wins = []
+		errors = []
+
+		def race(member):
+			try:
+				barrier.wait()
+				for copy_id in self.copy_ids:
+					if borrow_copy(copy_id, member):
+						wins.append((copy_id, member.pk))
+			except Exception as error:
+				errors.append(error)
+			finally:
+				connection.close()
+
+		workers = [threading.Thread(target=race, args=(member,)) for member in self.members]
+		for worker in workers:
+			worker.start()
+		for worker in workers:
+			worker.join()
+
+		self.assertEqual(errors, [])
+		self.assertEqual(sorted(copy_id for copy_id, _ in wins), sorted(self.copy_ids))
+		for copy_id, member_id in wins:
+			copy = BookInstance.objects.get(pk=copy_id)
+			self.assertEqual((copy.status, copy.borrower_id), ("o", member_id))
+		self.assertEqual(get_catalog_stats().num_instances_available, 0)
+		book = Book.objects.get(isbn="7777777777")
+		self.assertEqual((book.copies_total, book.copies_available, book.copies_on_loan), (self.copies, 0, self.copies))
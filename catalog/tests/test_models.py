@@ -1,6 +1,14 @@
+import io
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
-from catalog.models import Author
+from catalog.models import Author, Book, BookInstance, Genre, CatalogStats
+from catalog.stats import get_catalog_stats, recompute_catalog_stats
+from catalog.loans import borrow_copy, return_copy
 
 # Create your tests here.
 class AuthorModelTest(TestCase):
@@ -35,4 +43,131 @@ class AuthorModelTest(TestCase):
 		expected_name = f"{author.first_name}, {author.last_name}"
 		self.assertEqual(author.get_absolute_url(), "/catalog/author/1")
 
-	
\ No newline at end of file
+
+
+class CatalogStatsTest(TestCase):
+	def setUp(self):
+		self.author = Author.objects.create(first_name="Jane", last_name="Austen")
+		self.book = Book.objects.create(
+			title = "Pride and Prejudice",
+			summary = "A story of love and manners",
+			isbn = "9780141439518",
+			author = self.author
+		)
+		Genre.objects.create(name="Romance")
+
+	def assertStatsMatchLiveCounts(self):
+		stats = CatalogStats.objects.get()
+		live = recompute_catalog_stats()
+		for field in ('num_books', 'num_instances', 'num_instances_available',
+					  'num_authors', 'num_genres', 'num_word_books'):
+			self.assertEqual(getattr(stats, field), getattr(live, field), field)
+
+	def test_counts_follow_creates(self):
+		stats = get_catalog_stats()
+		self.assertEqual(stats.num_books, 1)
+		self.assertEqual(stats.num_authors, 1)
+		self.assertEqual(stats.num_genres, 1)
+		self.assertEqual(stats.num_word_books, 1)
+
+	def test_available_count_follows_status_changes(self):
+		copy = BookInstance.objects.create(book=self.book, imprint="Penguin", status="a")
+		self.assertEqual(get_catalog_stats().num_instances_available, 1)
+
+		copy.status = "o"
+		copy.save()
+		self.assertEqual(get_catalog_stats().num_instances_available, 0)
+		self.assertStatsMatchLiveCounts()
+
+		copy.delete()
+		self.assertEqual(get_catalog_stats().num_instances, 0)
+		self.assertStatsMatchLiveCounts()
+
+	def test_word_count_follows_summary_edits(self):
+		self.book.summary = "A story of manners"
+		self.book.save()
+		self.assertEqual(get_catalog_stats().num_word_books, 0)
+
+		self.book.summary = "LOVE conquers all"
+		self.book.save()
+		self.assertEqual(get_catalog_stats().num_word_books, 1)
+		self.assertStatsMatchLiveCounts()
+
+	def test_deletes_decrement_counts(self):
+		self.book.delete()
+		self.author.delete()
+		stats = get_catalog_stats()
+		self.assertEqual(stats.num_books, 0)
+		self.assertEqual(stats.num_word_books, 0)
+		self.assertEqual(stats.num_authors, 0)
+		self.assertStatsMatchLiveCounts()
+
+
+class CopyCountersTest(TestCase):
+	def setUp(self):
+		self.author = Author.objects.create(first_name="Jane", last_name="Austen")
+		self.book = Book.objects.create(title="Emma", summary="Matchmaking", isbn="9780141439587", author=self.author)
+		self.other = Book.objects.create(title="Persuasion", summary="Second chances", isbn="9780141439686", author=self.author)
+		self.member = User.objects.create_user(username="member")
+
+	def counters(self, book):
+		book.refresh_from_db()
+		return (book.copies_total, book.copies_available, book.copies_on_loan)
+
+	def test_saves_and_deletes(self):
+		copy = BookInstance.objects.create(book=self.book, imprint="Penguin", status="a")
+		BookInstance.objects.create(book=self.book, imprint="Penguin", status="m")
+		self.assertEqual(self.counters(self.book), (2, 1, 0))
+
+		copy.status = "o"
+		copy.save()
+		self.assertEqual(self.counters(self.book), (2, 0, 1))
+
+		copy.book = self.other
+		copy.save()
+		self.assertEqual(self.counters(self.book), (1, 0, 0))
+		self.assertEqual(self.counters(self.other), (1, 0, 1))
+
+		copy.delete()
+		self.assertEqual(self.counters(self.other), (0, 0, 0))
+
+	def test_loans(self):
+		copy = BookInstance.objects.create(book=self.book, imprint="Penguin", status="a")
+		self.assertTrue(borrow_copy(copy.pk, self.member))
+		self.assertEqual(self.counters(self.book), (1, 0, 1))
+		self.assertTrue(return_copy(copy.pk, self.member))
+		self.assertEqual(self.counters(self.book), (1, 0, 0))
+
+	def test_stale_book_save_keeps_counters(self):
+		stale = Book.objects.get(pk=self.book.pk)
+		BookInstance.objects.create(book=self.book, imprint="Penguin", status="a")
+		stale.title = "Emma (revised)"
+		stale.save()
+		self.assertEqual(self.counters(self.book), (1, 1, 0))
+		self.assertEqual(self.book.title, "Emma (revised)")
+
+		# counters named explicitly are not written either
+		stale.copies_total = 0
+		stale.save(update_fields=['title', 'copies_total'])
+		self.assertEqual(self.counters(self.book), (1, 1, 0))
+
+	def test_deferred_book_save_writes_loaded_fields(self):
+		book = Book.objects.only('title').get(pk=self.book.pk)
+		book.title = "Emma (abridged)"
+		with CaptureQueriesContext(connection) as queries:
+			book.save()
+		update = next(query['sql'] for query in queries.captured_queries if query['sql'].startswith('UPDATE "catalog_book"'))
+		self.assertIn('"title"', update)
+		self.assertNotIn('"summary"', update)
+		self.assertNotIn('"copies_total"', update)
+		self.book.refresh_from_db()
+		self.assertEqual((self.book.title, self.book.summary), ("Emma (abridged)", "Matchmaking"))
+
+	def test_repair_command(self):
+		BookInstance.objects.create(book=self.book, imprint="Penguin", status="o")
+		Book.objects.filter(pk=self.book.pk).update(copies_total=7, copies_on_loan=0)
+		out = io.StringIO()
+		call_command('repair_copy_counts', stdout=out)
+		self.assertIn("1 book had drifted counters.", out.getvalue())
+		self.assertEqual(self.counters(self.book), (1, 0, 1))
+		self.assertEqual(self.counters(self.other), (0, 0, 0))
@@ -0,0 +1,96 @@
+import datetime
+from unittest import mock
+
+from django.contrib.auth.models import Group, User
+from django.core import mail
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from catalog.models import OutgoingEmail
+from catalog.outbox import queue_mail, process_outbox
+
+
+class OutboxTest(TestCase):
+	def queue(self, number):
+		for n in range(number):
+			queue_mail(f"Subject {n}", "Body", "lib_admin@mojo.com", [f"member{n}@example.com"])
+
+	def test_queued_mail_is_not_sent_immediately(self):
+		self.queue(1)
+		self.assertEqual(len(mail.outbox), 0)
+		self.assertEqual(OutgoingEmail.objects.get().status, "p")
+
+	def test_process_sends_all_in_batches(self):
+		self.queue(7)
+		sent, failed = process_outbox(batch_size=3)
+		self.assertEqual((sent, failed), (7, 0))
+		self.assertEqual(len(mail.outbox), 7)
+		self.assertFalse(OutgoingEmail.objects.exclude(status="d").exists())
+
+		# nothing left to send
+		self.assertEqual(process_outbox(), (0, 0))
+
+	def test_one_connection_per_batch(self):
+		self.queue(6)
+		with mock.patch("catalog.outbox.get_connection", wraps=mail.get_connection) as get_connection:
+			process_outbox(batch_size=3)
+		self.assertEqual(get_connection.call_count, 2)
+
+	def test_failures_are_retried_with_backoff(self):
+		self.queue(1)
+		with mock.patch("django.core.mail.EmailMessage.send", side_effect=OSError("SMTP down")):
+			self.assertEqual(process_outbox(), (0, 1))
+
+		email = OutgoingEmail.objects.get()
+		self.assertEqual(email.status, "p")
+		self.assertEqual(email.attempts, 1)
+		self.assertEqual(email.last_error, "SMTP down")
+		self.assertGreater(email.next_attempt_at, timezone.now())
+
+		# not due yet
+		self.assertEqual(process_outbox(), (0, 0))
+
+		OutgoingEmail.objects.update(next_attempt_at=timezone.now())
+		self.assertEqual(process_outbox(), (1, 0))
+
+	def test_gives_up_after_max_attempts(self):
+		self.queue(1)
+		OutgoingEmail.objects.update(attempts=2)
+		with mock.patch("django.core.mail.EmailMessage.send", side_effect=OSError("SMTP down")):
+			process_outbox(max_attempts=3)
+		self.assertEqual(OutgoingEmail.objects.get().status, "f")
+
+	def test_stale_claims_are_retried(self):
+		self.queue(1)
+		OutgoingEmail.objects.update(status="s", next_attempt_at=timezone.now() - datetime.timedelta(seconds=1))
+		self.assertEqual(process_outbox(), (1, 0))
+
+	def test_stale_claim_of_last_attempt_fails(self):
+		self.queue(1)
+		OutgoingEmail.objects.update(status="s", attempts=3, next_attempt_at=timezone.now() - datetime.timedelta(seconds=1))
+		self.assertEqual(process_outbox(max_attempts=3), (0, 0))
+		self.assertEqual(len(mail.outbox), 0)
+		email = OutgoingEmail.objects.get()
+		self.assertEqual((email.status, email.attempts), ("f", 3))
+
+
+class SignupQueuesMailTest(TestCase):
+	def test_signup_queues_verification_mail(self):
+		Group.objects.create(name="Library Members")
+		response = self.client.post(reverse('member-signup'), {
+			"username" : "newmember",
+			"email" : "newmember@example.com",
+			"password1" : "j123nkhahKA#snjsn",
+			"password2" : "j123nkhahKA#snjsn",
+		})
+		self.assertRedirects(response, reverse('login'))
+		self.assertEqual(len(mail.outbox), 0)
+
+		user = User.objects.get(username="newmember")
+		email = OutgoingEmail.objects.get()
+		self.assertEqual(email.recipients, ["newmember@example.com"])
+		self.assertIn(str(user.usertoken.user_token), email.body)
+
+		process_outbox()
+		self.assertEqual(mail.outbox[0].to, ["newmember@example.com"])
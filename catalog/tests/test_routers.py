@@ -0,0 +1,135 @@
+from unittest import skipUnless
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from catalog import routers
+from catalog.cache import cached_fragment
+from catalog.middleware import ReplicaRoutingMiddleware, PRIMARY_COOKIE
+from catalog.models import Author, Book
+
+
+@override_settings(CATALOG_READ_REPLICAS=['replica'])
+class ReplicaRouterTest(SimpleTestCase):
+	router = routers.ReplicaRouter()
+
+	def test_outside_requests_reads_use_primary(self):
+		self.assertEqual(self.router.db_for_read(Book), 'default')
+
+	def test_released_request_reads_use_replica_until_write(self):
+		tokens = routers.start_request(use_replicas=True)
+		try:
+			self.assertEqual(self.router.db_for_read(Book), 'replica')
+			self.assertEqual(self.router.db_for_read(User), 'default')
+			self.assertEqual(self.router.db_for_write(Book), 'default')
+			self.assertTrue(routers.wrote_to_primary())
+			self.assertEqual(self.router.db_for_read(Book), 'default')
+		finally:
+			routers.end_request(tokens)
+		self.assertFalse(routers.wrote_to_primary())
+
+	@override_settings(CATALOG_READ_REPLICAS=[])
+	def test_without_replicas_everything_uses_primary(self):
+		tokens = routers.start_request(use_replicas=True)
+		try:
+			self.assertEqual(self.router.db_for_read(Book), 'default')
+		finally:
+			routers.end_request(tokens)
+
+	def test_fragments_are_built_from_primary(self):
+		request = RequestFactory().get('/catalog/book/1')
+		tokens = routers.start_request(use_replicas=True)
+		try:
+			# a lagging replica would cache the old rows under the new version
+			fragment = cached_fragment('book-detail', request, [('book', 1)], lambda: self.router.db_for_read(Book))
+			self.assertEqual(fragment, 'default')
+		finally:
+			routers.end_request(tokens)
+			cache.clear()
+
+	def test_no_migrations_on_replicas(self):
+		self.assertFalse(self.router.allow_migrate('replica', 'catalog'))
+		self.assertIsNone(self.router.allow_migrate('default', 'catalog'))
+
+
+@override_settings(CATALOG_READ_REPLICAS=['replica'])
+class ReplicaRoutingMiddlewareTest(SimpleTestCase):
+	def run_request(self, request, write=False):
+		seen = {}
+
+		def view(request):
+			seen['read'] = routers.ReplicaRouter().db_for_read(Book)
+			if write:
+				routers.ReplicaRouter().db_for_write(Book)
+			return HttpResponse()
+
+		response = ReplicaRoutingMiddleware(view)(request)
+		return seen['read'], response
+
+	def anonymous(self, request):
+		request.user = AnonymousUser()
+		return request
+
+	def test_anonymous_get_reads_replica(self):
+		read, response = self.run_request(self.anonymous(RequestFactory().get('/catalog/books/')))
+		self.assertEqual(read, 'replica')
+		self.assertNotIn(PRIMARY_COOKIE, response.cookies)
+
+	def test_post_and_logged_in_users_read_primary(self):
+		read, _ = self.run_request(self.anonymous(RequestFactory().post('/catalog/books/')))
+		self.assertEqual(read, 'default')
+
+		request = RequestFactory().get('/catalog/books/')
+		request.user = User(username="member")
+		read, _ = self.run_request(request)
+		self.assertEqual(read, 'default')
+
+	def test_write_makes_client_sticky(self):
+		_, response = self.run_request(self.anonymous(RequestFactory().post('/accounts/signup/')), write=True)
+		self.assertIn(PRIMARY_COOKIE, response.cookies)
+
+		request = self.anonymous(RequestFactory().get('/catalog/books/'))
+		request.COOKIES[PRIMARY_COOKIE] = "1"
+		read, _ = self.run_request(request)
+		self.assertEqual(read, 'default')
+
+
+@skipUnless('replica' in settings.DATABASES, "needs a 'replica' database (TEST MIRROR of default)")
+@override_settings(CATALOG_READ_REPLICAS=['replica'])
+class ReplicaRoutingEndToEndTest(TransactionTestCase):
+	databases = {'default', 'replica'}
+
+	def setUp(self):
+		author = Author.objects.create(first_name="Ursula", last_name="Le Guin")
+		Book.objects.create(title="The Dispossessed", summary="Anarres", isbn="9780060512750", author=author)
+
+	def test_anonymous_search_reads_replica(self):
+		with CaptureQueriesContext(connections['replica']) as replica_queries:
+			response = self.client.get(reverse('book-search'), {'q' : "Anarres"})
+		self.assertContains(response, "The Dispossessed")
+		self.assertTrue(any('catalog_book' in q['sql'] for q in replica_queries.captured_queries))
+
+	def test_stamps_and_fragments_read_primary(self):
+		cache.clear()
+		book = Book.objects.get()
+		self.client.get(book.get_absolute_url())
+		book.summary = "Anarres and Urras"
+		book.save()
+		with CaptureQueriesContext(connections['replica']) as replica_queries:
+			response = self.client.get(book.get_absolute_url())
+		self.assertContains(response, "Anarres and Urras")
+		self.assertFalse([q['sql'] for q in replica_queries.captured_queries if 'catalog_book' in q['sql']])
+
+	def test_transactions_read_primary(self):
+		tokens = routers.start_request(use_replicas=True)
+		try:
+			with transaction.atomic():
+				self.assertEqual(routers.ReplicaRouter().db_for_read(Book), 'default')
+		finally:
+			routers.end_request(tokens)
@@ -0,0 +1,101 @@
+from django.test import TestCase
+from django.urls import reverse
+
+from catalog.models import Author, Book, BookSearchTerm
+from catalog.search import parse_query, search_books, boolean_mode_query
+
+
+class ParseQueryTest(TestCase):
+	def test_terms_prefixes_and_phrases(self):
+		terms, phrases = parse_query('Dragon dra* "Pride and Prejudice"')
+		self.assertEqual(terms, [
+			("dragon", False), ("dra", True),
+			("pride", False), ("and", False), ("prejudice", False),
+		])
+		self.assertEqual(phrases, [["pride", "and", "prejudice"]])
+
+	def test_boolean_mode_query(self):
+		terms, phrases = parse_query('dra* "red dragon"')
+		self.assertEqual(boolean_mode_query(terms, phrases), '+dra* +red +dragon +"red dragon"')
+
+
+class SearchBooksTest(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		cls.tolkien = Author.objects.create(first_name="John", last_name="Tolkien")
+		cls.austen = Author.objects.create(first_name="Jane", last_name="Austen")
+		cls.hobbit = Book.objects.create(
+			title = "The Hobbit",
+			summary = "A hobbit meets a dragon called Smaug.",
+			isbn = "9780261102217",
+			author = cls.tolkien
+		)
+		cls.dragons = Book.objects.create(
+			title = "Dragon Tales",
+			summary = "Stories about a red dragon and a dragonfly.",
+			isbn = "9780000000001",
+			author = cls.austen
+		)
+		cls.pride = Book.objects.create(
+			title = "Pride and Prejudice",
+			summary = "Elizabeth Bennet and Mr Darcy.",
+			isbn = "9780141439518",
+			author = cls.austen
+		)
+
+	def test_ranks_title_matches_first(self):
+		self.assertEqual(list(search_books("dragon")), [self.dragons, self.hobbit])
+
+	def test_all_terms_required(self):
+		self.assertEqual(list(search_books("dragon smaug")), [self.hobbit])
+
+	def test_prefix(self):
+		self.assertEqual(set(search_books("dragonf*")), {self.dragons})
+		self.assertEqual(set(search_books("prej*")), {self.pride})
+
+	def test_phrase(self):
+		self.assertEqual(list(search_books('"red dragon"')), [self.dragons])
+		self.assertEqual(list(search_books('"dragon red"')), [])
+
+	def test_author_name_is_searchable(self):
+		self.assertEqual(list(search_books("tolkien")), [self.hobbit])
+
+	def test_index_follows_updates_and_deletes(self):
+		self.hobbit.summary = "There and back again."
+		self.hobbit.save()
+		self.assertEqual(list(search_books("smaug")), [])
+
+		self.austen.last_name = "Bronte"
+		self.austen.save()
+		self.assertEqual(set(search_books("bronte")), {self.dragons, self.pride})
+
+		self.pride.delete()
+		self.assertFalse(BookSearchTerm.objects.filter(book_id=self.pride.pk).exists())
+
+	def test_empty_query(self):
+		self.assertEqual(list(search_books("  ")), [])
+
+
+class BookSearchViewTest(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		author = Author.objects.create(first_name="Test", last_name="Author")
+		for number in range(13):
+			Book.objects.create(
+				title = f"Wizard {number}",
+				summary = "A wizard story",
+				isbn = f"97800000001{number:02d}",
+				author = author
+			)
+
+	def test_view_url_accessible_by_name(self):
+		response = self.client.get(reverse('book-search'), {"q" : "wizard"})
+		self.assertEqual(response.status_code, 200)
+		self.assertTemplateUsed(response, "book_search.html")
+
+	def test_results_are_paginated(self):
+		response = self.client.get(reverse('book-search'), {"q" : "wiz*", "page" : 2})
+		self.assertEqual(response.status_code, 200)
+		self.assertTrue(response.context["is_paginated"])
+		self.assertEqual(len(response.context["library_books"]), 3)
+		self.assertContains(response, "?q=wiz%2A&page=1")
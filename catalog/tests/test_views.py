@@ -2,18 +2,43 @@ import datetime
 import uuid
 
 
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 from django.contrib.auth.models import User
 
 # Required to grant the permission needed to set a book as returned.
 from django.contrib.auth.models import Permission 
+from unittest import mock
 
 from catalog.models import Author, BookInstance, Book, Genre, Language
+from catalog.pagination import EstimatedCountPaginator, encode_cursor
 
 
 # Create your tests here.
+class IndexViewTest(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		author = Author.objects.create(first_name="Jane", last_name="Austen")
+		Book.objects.create(title="Emma", summary="Love and matchmaking", isbn="9780141439587", author=author)
+
+	def test_counts_rendered_from_stats(self):
+		response = self.client.get(reverse('index'))
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(response.context['num_books'], 1)
+		self.assertEqual(response.context['num_authors'], 1)
+		self.assertEqual(response.context['num_word_books'], 1)
+
+	def test_stats_read_is_single_query(self):
+		with CaptureQueriesContext(connection) as queries:
+			self.client.get(reverse('index'))
+		catalog_queries = [q for q in queries.captured_queries if 'catalog_' in q['sql']]
+		self.assertEqual(len(catalog_queries), 1)
+
+
 class AuthorListViewTest(TestCase):
 	@classmethod
 	def setUpTestData(cls):
@@ -55,6 +80,278 @@ class AuthorListViewTest(TestCase):
 
 
 
+class AuthorAggregatesTest(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		cls.prolific = Author.objects.create(first_name="Terry", last_name="Pratchett")
+		cls.idle = Author.objects.create(first_name="Harper", last_name="Lee")
+		for n in range(30):
+			book = Book.objects.create(title=f"Discworld {n:02}", summary="y" * 400, isbn=f"{n:013}", author=cls.prolific)
+			for status in "aom":
+				BookInstance.objects.create(book=book, imprint="Gollancz", status=status)
+
+	def setUp(self):
+		cache.clear()
+
+	def catalog_queries(self, url):
+		with CaptureQueriesContext(connection) as queries:
+			response = self.client.get(url)
+		self.assertEqual(response.status_code, 200)
+		return response, [q for q in queries.captured_queries if 'catalog_' in q['sql']]
+
+	def test_list_aggregates_in_one_query(self):
+		response, queries = self.catalog_queries(reverse('authors'))
+		authors = {author.last_name : author for author in response.context['author_list']}
+		self.assertEqual((authors["Pratchett"].num_books, authors["Pratchett"].copies_available, authors["Pratchett"].copies_on_loan), (30, 30, 30))
+		self.assertEqual((authors["Lee"].num_books, authors["Lee"].copies_available, authors["Lee"].copies_on_loan), (0, 0, 0))
+		# COUNT for the paginator, the page stamp and the page itself
+		self.assertEqual(len(queries), 3)
+
+	def test_detail_paginates_books(self):
+		response, queries = self.catalog_queries(self.prolific.get_absolute_url())
+		self.assertContains(response, "Discworld 24")
+		self.assertNotContains(response, "Discworld 25")
+		self.assertContains(response, "y" * 300 + "&hellip;")
+		self.assertNotContains(response, "y" * 301)
+		# page stamp, author, COUNT for the paginator, one page of books
+		self.assertEqual(len(queries), 4)
+
+		response = self.client.get(self.prolific.get_absolute_url() + "?page=2")
+		self.assertContains(response, "Discworld 29")
+
+	def test_detail_rejects_tampered_cursors(self):
+		for values in (["Discworld 01", "abc"], [None, None], [[1], {}]):
+			with self.subTest(values=values):
+				response = self.client.get(self.prolific.get_absolute_url(), {"after" : encode_cursor(values)})
+				self.assertEqual(response.status_code, 404)
+
+	def test_detail_without_books(self):
+		response = self.client.get(self.idle.get_absolute_url())
+		self.assertContains(response, "No books available.")
+
+
+class BookListViewTest(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		# 12 books, each by its own author, titles sharing prefixes to exercise the (title, id) ordering
+		for number in range(12):
+			author = Author.objects.create(first_name=f"Dummy {number}", last_name="Author")
+			book = Book.objects.create(
+				title = f"Book {number % 4}",
+				summary = "summary",
+				isbn = f"97800000002{number:02d}",
+				author = author
+			)
+			BookInstance.objects.create(book=book, imprint="Imprint", status="a" if number % 2 else "m")
+
+	def test_view_uses_correct_template(self):
+		response = self.client.get(reverse('books'))
+		self.assertEqual(response.status_code, 200)
+		self.assertTemplateUsed(response, "book_list.html")
+		self.assertEqual(len(response.context["library_books"]), 5)
+
+	def count_catalog_queries(self, params):
+		with CaptureQueriesContext(connection) as queries:
+			response = self.client.get(reverse('books'), params)
+		self.assertContains(response, "Dummy")
+		return len([q for q in queries.captured_queries if 'catalog_' in q['sql']])
+
+	def test_authors_fetched_with_books(self):
+		first = self.client.get(reverse('books'))
+		# offset page: count + page stamp + page (authors joined in)
+		self.assertEqual(self.count_catalog_queries({}), 3)
+		# keyset page: page stamp + the page query
+		self.assertEqual(self.count_catalog_queries({"after" : first.context["page_obj"].next_cursor}), 2)
+
+	def walk_keyset_pages(self, query=None):
+		params = {"q" : query} if query else {}
+		response = self.client.get(reverse('books'), params)
+		seen = list(response.context["library_books"])
+		while response.context["page_obj"].next_cursor:
+			params["after"] = response.context["page_obj"].next_cursor
+			response = self.client.get(reverse('books'), params)
+			self.assertEqual(response.status_code, 200)
+			seen.extend(response.context["library_books"])
+		return seen
+
+	def test_keyset_pages_cover_every_book_once(self):
+		seen = self.walk_keyset_pages()
+		self.assertEqual(len(seen), 12)
+		self.assertEqual(seen, list(Book.objects.order_by('title', 'pk')))
+
+	def test_keyset_previous_page(self):
+		first = self.client.get(reverse('books'))
+		second = self.client.get(reverse('books'), {"after" : first.context["page_obj"].next_cursor})
+		back = self.client.get(reverse('books'), {"before" : second.context["page_obj"].previous_cursor})
+		self.assertEqual(list(back.context["library_books"]), list(first.context["library_books"]))
+		self.assertIsNone(back.context["page_obj"].previous_cursor)
+
+	def test_available_books_are_paginated(self):
+		response = self.client.get(reverse('books'), {"q" : "available"})
+		self.assertTrue(response.context["is_paginated"])
+		self.assertContains(response, "q=available&after=")
+		seen = self.walk_keyset_pages("available")
+		self.assertEqual(len(seen), 6)
+		for book in seen:
+			self.assertTrue(book.bookinstance_set.filter(status="a").exists())
+
+	def test_invalid_cursor_is_404(self):
+		response = self.client.get(reverse('books'), {"after" : "not-a-cursor"})
+		self.assertEqual(response.status_code, 404)
+
+	def test_tampered_cursors_are_404(self):
+		for values in (["Book 1", "abc"], [None, None], [[1], {}], ["Book 1"], ["Book 1", 1, 2]):
+			with self.subTest(values=values):
+				for param in ("after", "before"):
+					response = self.client.get(reverse('books'), {param : encode_cursor(values)})
+					self.assertEqual(response.status_code, 404)
+		# a cursor with the right types but no matching row is still a page
+		self.assertEqual(self.client.get(reverse('books'), {"after" : encode_cursor(["Book 9", 12345])}).status_code, 200)
+
+
+class EstimatedCountPaginatorTest(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		author = Author.objects.create(first_name="Isaac", last_name="Asimov")
+		for number in range(7):
+			Book.objects.create(title=f"Foundation {number}", summary="Empire", isbn=f"97800000003{number:02d}", author=author)
+
+	def setUp(self):
+		cache.clear()
+
+	def test_small_counts_are_exact(self):
+		paginator = EstimatedCountPaginator(Book.objects.order_by('pk'), 5, threshold=100)
+		self.assertEqual((paginator.count, paginator.count_is_estimate), (7, False))
+		self.assertFalse(paginator.page(2).has_next())
+
+	@mock.patch('catalog.pagination.table_row_estimate', return_value=4)
+	def test_unfiltered_count_comes_from_statistics(self, estimate):
+		paginator = EstimatedCountPaginator(Book.objects.order_by('pk'), 5, threshold=3)
+		with self.assertNumQueries(0):
+			self.assertEqual((paginator.count, paginator.count_is_estimate), (4, True))
+		# the estimate is short: the rows after it are still reachable
+		first = paginator.page(1)
+		self.assertTrue(first.has_next())
+		self.assertEqual(len(paginator.page(first.next_page_number())), 2)
+		self.assertFalse(paginator.page(2).has_next())
+
+	def test_filtered_count_is_cached_above_threshold(self):
+		books = Book.objects.filter(title__startswith="Foundation").order_by('pk')
+		self.assertFalse(EstimatedCountPaginator(books, 5, threshold=3).count_is_estimate)
+		with CaptureQueriesContext(connection) as queries:
+			paginator = EstimatedCountPaginator(books, 5, threshold=3)
+			self.assertEqual((paginator.count, paginator.count_is_estimate), (7, True))
+		self.assertEqual(len(queries), 0)
+
+	@override_settings(CATALOG_ESTIMATED_COUNT_THRESHOLD=3)
+	def test_list_view_skips_count_query_on_repeat(self):
+		for number in range(3):
+			Author.objects.create(first_name=f"Robot {number}", last_name="Daneel")
+		self.client.get(reverse('authors'))
+		with CaptureQueriesContext(connection) as queries:
+			response = self.client.get(reverse('authors'))
+		self.assertFalse(any('COUNT(*)' in query['sql'] and 'LIMIT' not in query['sql'] for query in queries.captured_queries))
+		self.assertEqual(len(response.context['author_list']), 4)
+		self.assertTrue(response.context['paginator'].count_is_estimate)
+
+
+class BookDetailViewTest(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		cls.author = Author.objects.create(first_name="John", last_name="Smith")
+
+	def create_book(self, isbn, extras):
+		book = Book.objects.create(title="Detail", summary="summary", isbn=isbn, author=self.author)
+		book.genre.set([Genre.objects.create(name=f"Genre {isbn} {n}") for n in range(extras)])
+		book.language.set([Language.objects.create(name=f"Language {isbn} {n}") for n in range(extras)])
+		for n in range(extras):
+			BookInstance.objects.create(book=book, imprint=f"Imprint {n}", status="aom"[n % 3])
+		# reviews come from the reviews app, reached like the view does
+		relation = Book.review_set.rel
+		for n in range(extras):
+			reviewer = User.objects.create_user(username=f"reviewer-{isbn}-{n}")
+			relation.related_model.objects.create(**{relation.field.name : book}, user=reviewer,
+												  review=f"Review {n}", review_polarity=1)
+		return book
+
+	def count_queries(self, book):
+		with CaptureQueriesContext(connection) as queries:
+			response = self.client.get(book.get_absolute_url())
+		self.assertEqual(response.status_code, 200)
+		return len(queries.captured_queries)
+
+	def test_query_count_is_constant(self):
+		small = self.create_book("1111111111", 1)
+		large = self.create_book("2222222222", 9)
+		queries = self.count_queries(small)
+		with self.assertNumQueries(queries):
+			response = self.client.get(large.get_absolute_url())
+		self.assertEqual(len(response.context["reviews"]), 9)
+		self.assertContains(response, "reviewer-2222222222-8")
+
+	def test_copy_counts_by_status(self):
+		book = self.create_book("3333333333", 5)
+		response = self.client.get(book.get_absolute_url())
+		self.assertEqual(response.context["copy_counts"], [("Maintenance", 1), ("On loan", 2), ("Available", 2)])
+		self.assertEqual(len(response.context["copies"]), 5)
+
+	def test_genre_links(self):
+		book = self.create_book("4444444444", 2)
+		response = self.client.get(book.get_absolute_url())
+		for genre in book.genre.all():
+			self.assertContains(response, f'<a href="{genre.get_absolute_url()}">{genre.name}</a>', html=True)
+
+
+class GenreViewsTest(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		cls.genre = Genre.objects.create(name="Fantasy")
+		cls.empty = Genre.objects.create(name="Anthology")
+		for n in range(30):
+			author = Author.objects.create(first_name="Author", last_name=str(n))
+			book = Book.objects.create(title=f"Book {n:02}", summary="x" * 500, isbn=f"{n:013}", author=author)
+			book.genre.add(cls.genre)
+
+	def setUp(self):
+		cache.clear()
+
+	def test_detail_is_paginated_and_truncated(self):
+		response = self.client.get(self.genre.get_absolute_url())
+		self.assertEqual(response.status_code, 200)
+		self.assertContains(response, "Book 24")
+		self.assertNotContains(response, "Book 25")
+		self.assertContains(response, "(Author 0)")
+		self.assertContains(response, "x" * 300 + "&hellip;")
+		self.assertNotContains(response, "x" * 301)
+
+		response = self.client.get(self.genre.get_absolute_url() + "?page=2")
+		self.assertContains(response, "Book 29")
+		self.assertNotContains(response, "Book 24")
+
+	def test_detail_keyset_pages(self):
+		response = self.client.get(self.genre.get_absolute_url())
+		next_cursor = response.context['fragment']['html'].split("after=")[1].split('"')[0]
+		response = self.client.get(self.genre.get_absolute_url() + "?after=" + next_cursor)
+		self.assertContains(response, "Book 25")
+		self.assertNotContains(response, "Book 24")
+		self.assertEqual(self.client.get(self.genre.get_absolute_url() + "?after=bogus").status_code, 404)
+
+	def test_detail_books_fetched_in_one_query(self):
+		with CaptureQueriesContext(connection) as queries:
+			self.client.get(self.genre.get_absolute_url())
+		book_queries = [q for q in queries.captured_queries if 'catalog_book' in q['sql'] and 'COUNT' not in q['sql']]
+		self.assertEqual(len(book_queries), 1)
+		self.assertIn('SUBSTR("catalog_book"."summary", 1, 300)', book_queries[0]['sql'])
+		self.assertNotIn('"catalog_book"."summary", "', book_queries[0]['sql'])
+
+	def test_list_counts_books_in_one_query(self):
+		with CaptureQueriesContext(connection) as queries:
+			response = self.client.get(reverse('genres'))
+		self.assertEqual([(g.name, g.num_books) for g in response.context['genre_list']], [("Anthology", 0), ("Fantasy", 30)])
+		# count, page stamp, page
+		self.assertEqual(len([q for q in queries.captured_queries if 'catalog_genre' in q['sql']]), 3)
+
+
 class BorrowerListViewTest(TestCase):
 	def setUp(self):
 		# create two users
@@ -177,6 +474,68 @@ class BorrowerListViewTest(TestCase):
 			    last_date = book.due_back
 
 
+class LibrarianListViewTest(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		cls.librarian = User.objects.create_user(username="librarian", password="2HJ1vRV0Z&3iD")
+		cls.librarian.user_permissions.add(Permission.objects.get(name='Set book as returned'))
+		members = [User.objects.create_user(username=f"member{n}", password="j123nkhahKA#snjsn") for n in range(3)]
+
+		author = Author.objects.create(first_name="John", last_name="Smith")
+		book = Book.objects.create(title="Loaned", summary="summary", isbn="5555555555", author=author)
+
+		today = datetime.date.today()
+		# 30 loans: due dates from 10 days ago to 19 days ahead, so 10 are overdue
+		for n in range(30):
+			BookInstance.objects.create(
+				book = book,
+				imprint = "Imprint",
+				status = "o",
+				borrower = members[n % 3],
+				due_back = today + datetime.timedelta(days=n - 10)
+			)
+		BookInstance.objects.create(book=book, imprint="Imprint", status="a")
+
+	def setUp(self):
+		self.client.login(username="librarian", password="2HJ1vRV0Z&3iD")
+
+	def test_paginated(self):
+		response = self.client.get(reverse('all-borrowed'))
+		self.assertEqual(response.status_code, 200)
+		self.assertTrue(response.context["is_paginated"])
+		self.assertEqual(len(response.context["librarian_records"]), 25)
+
+	def test_overdue_annotated_in_sql(self):
+		response = self.client.get(reverse('all-borrowed'))
+		for loan in response.context["librarian_records"]:
+			self.assertEqual(loan.__dict__["_is_overdue"], loan.due_back < datetime.date.today())
+
+	def test_rows_do_not_query_book_or_borrower(self):
+		with CaptureQueriesContext(connection) as queries:
+			response = self.client.get(reverse('all-borrowed'))
+		self.assertEqual(response.status_code, 200)
+		loan_queries = [q for q in queries.captured_queries if 'catalog_bookinstance' in q['sql']]
+		# count + page
+		self.assertEqual(len(loan_queries), 2)
+		self.assertEqual(len([q for q in queries.captured_queries if 'FROM "catalog_book"' in q['sql']]), 0)
+
+	def test_filters(self):
+		response = self.client.get(reverse('all-borrowed'), {"overdue" : "on"})
+		self.assertEqual(response.context['paginator'].count, 10)
+
+		response = self.client.get(reverse('all-borrowed'), {"borrower" : "member1"})
+		self.assertEqual(response.context['paginator'].count, 10)
+
+		today = datetime.date.today()
+		response = self.client.get(reverse('all-borrowed'), {"due_after" : today, "due_before" : today + datetime.timedelta(days=4)})
+		self.assertEqual(response.context['paginator'].count, 5)
+
+	def test_filters_kept_in_page_links(self):
+		response = self.client.get(reverse('all-borrowed'), {"due_after" : datetime.date.today() - datetime.timedelta(days=30)})
+		self.assertContains(response, "due_after=")
+		self.assertContains(response, "&page=2")
+
+
 class RenewBookInstancesViewTest(TestCase):
     def setUp(self):
         # Create a user
@@ -271,4 +630,34 @@ class RenewBookInstancesViewTest(TestCase):
     	response = self.client.get(reverse('renew-book-librarian', kwargs={'pk': self.test_bookinstance1.pk}))
     	self.assertEqual(response.status_code, 200)
     	date_3_weeks_in_future = datetime.date.today() + datetime.timedelta(weeks=3)
-    	self.assertEqual(response.context['form'].initial['renewal_date'], date_3_weeks_in_future)
\ No newline at end of file
+    	self.assertEqual(response.context['form'].initial['renewal_date'], date_3_weeks_in_future)
+
+
+class ExportCatalogViewTest(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		User.objects.create_user(username="member", password="j123nkhahKA#snjsn")
+		User.objects.create_user(username="staff", password="2HJ1vRV0Z&3iD", is_staff=True)
+		author = Author.objects.create(first_name="Jane", last_name="Austen")
+		Book.objects.create(title="Emma", summary="summary", isbn="9780141439587", author=author)
+
+	def test_staff_only(self):
+		response = self.client.get(reverse('catalog-export', args=["books", "csv"]))
+		self.assertEqual(response.status_code, 302)
+		self.client.login(username="member", password="j123nkhahKA#snjsn")
+		response = self.client.get(reverse('catalog-export', args=["books", "csv"]))
+		self.assertEqual(response.status_code, 302)
+
+	def test_streams_export(self):
+		self.client.login(username="staff", password="2HJ1vRV0Z&3iD")
+		response = self.client.get(reverse('catalog-export', args=["books", "jsonl"]))
+		self.assertEqual(response.status_code, 200)
+		self.assertTrue(response.streaming)
+		self.assertEqual(response["Content-Type"], "application/x-ndjson")
+		content = b"".join(response.streaming_content).decode()
+		self.assertIn('"title": "Emma"', content)
+
+	def test_unknown_export(self):
+		self.client.login(username="staff", password="2HJ1vRV0Z&3iD")
+		response = self.client.get(reverse('catalog-export', args=["users", "csv"]))
+		self.assertEqual(response.status_code, 404)
@@ -0,0 +1,46 @@
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from catalog.models import CatalogStats
+from catalog.stats import get_catalog_stats
+from catalog.visits import flush_visits, pending_visits, record_visit
+
+
+class VisitCounterTest(TestCase):
+	def setUp(self):
+		cache.clear()
+
+	def test_index_counts_visits_without_session_writes(self):
+		for expected in range(3):
+			with CaptureQueriesContext(connection) as queries:
+				response = self.client.get(reverse('index'))
+			self.assertEqual(response.context['num_visits'], expected)
+			self.assertFalse(any('django_session' in q['sql'] for q in queries.captured_queries))
+		self.assertEqual(Session.objects.count(), 0)
+		self.assertEqual(response.context['total_visits'], 3)
+
+	def test_tampered_cookie_restarts_count(self):
+		self.client.cookies['num_visits'] = "41"
+		self.assertEqual(self.client.get(reverse('index')).context['num_visits'], 0)
+
+	@override_settings(CATALOG_VISIT_FLUSH_EVERY=3, CATALOG_VISIT_FLUSH_SECONDS=3600)
+	def test_visits_flushed_in_batches(self):
+		get_catalog_stats()
+		record_visit()
+		record_visit()
+		self.assertEqual(CatalogStats.objects.get().num_visits, 0)
+		self.assertEqual(pending_visits(), 2)
+
+		record_visit()
+		self.assertEqual(CatalogStats.objects.get().num_visits, 3)
+		self.assertEqual(pending_visits(), 0)
+
+	def test_flush_creates_missing_stats_row(self):
+		record_visit()
+		CatalogStats.objects.all().delete()
+		self.assertEqual(flush_visits(), 1)
+		self.assertEqual(CatalogStats.objects.get().num_visits, 1)
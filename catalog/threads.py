@@ -0,0 +1,50 @@
+"""
+Running blocking code (ORM queries, cache calls, template rendering) from
+the async views and middleware.
+
+``run`` sends a call to a worker thread of the event loop's executor, so
+calls awaited together with ``asyncio.gather`` run concurrently, each on its
+own database connection. Worker threads outlive requests, their connections
+are closed after a call once ``CONN_MAX_AGE`` has passed (what
+``request_finished`` does for the request thread of a sync view).
+
+That needs persistent connections: with ``CONN_MAX_AGE = 0`` every call
+would connect to the database again, so the calls run one after the other
+on Django's single thread for sync code instead, as they also do with
+``CATALOG_ASYNC_CONCURRENT_QUERIES = False``: fewer database connections,
+but no concurrency, and needed where every query has to see the same
+connection (the transaction of a ``TestCase``).
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+from . import instrumentation
+
+
+def persistent_connections():
+	return all(database['CONN_MAX_AGE'] != 0 for database in connections.settings.values())
+
+
+def concurrent_queries():
+	return getattr(settings, 'CATALOG_ASYNC_CONCURRENT_QUERIES', True) and persistent_connections()
+
+
+def _in_worker(function, args, kwargs):
+	try:
+		with instrumentation.watching():
+			return function(*args, **kwargs)
+	finally:
+		close_old_connections()
+
+
+def _in_sync_thread(function, args, kwargs):
+	with instrumentation.watching():
+		return function(*args, **kwargs)
+
+
+async def run(function, *args, **kwargs):
+	""" Await ``function(*args, **kwargs)`` run in a thread """
+	if concurrent_queries():
+		return await sync_to_async(_in_worker, thread_sensitive=False)(function, args, kwargs)
+	return await sync_to_async(_in_sync_thread)(function, args, kwargs)
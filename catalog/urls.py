@@ -1,11 +1,16 @@
+from django.conf import settings
 from django.urls import path
 
-from . import views
+from . import views, async_views, api
+
+
+# Read-heavy pages served by async views under ASGI (see catalog.async_views)
+browsing = async_views if settings.CATALOG_ASYNC_VIEWS else views
 
 
 # General pages
 urlpatterns = [
-	path("", views.index, name="index"),
+	path("", browsing.index, name="index"),
 	path("accounts/signup", views.UserRegister.as_view(), name="member-signup"),
 	path("accounts/profile/<int:pk>", views.UserProfile.as_view(), name="member-profile"),
 	path("accounts/<int:uid>/verify/<uuid:token>", views.verifyMemberToken, name="member-verify"),
@@ -14,8 +19,9 @@ urlpatterns = [
 
 # Books related
 urlpatterns += [
-	path("books/", views.BookListView.as_view(), name="books"),
-	path("book/<int:pk>", views.BookDetailView.as_view(), name="book-detail"),
+	path("books/", browsing.BookListView.as_view(), name="books"),
+	path("search/", views.BookSearchView.as_view(), name="book-search"),
+	path("book/<int:pk>", browsing.BookDetailView.as_view(), name="book-detail"),
 	path("book/create/", views.BookCreate.as_view(), name="book-create"),
 	path("book/<int:pk>/update/", views.BookUpdate.as_view(), name="book-update"),
 	path("book/<int:pk>/delete/", views.BookDelete.as_view(), name="book-delete"),
@@ -23,7 +29,7 @@ urlpatterns += [
 
 # Author related
 urlpatterns += [
-	path("authors/", views.AuthorListView.as_view(), name="authors"),
+	path("authors/", browsing.AuthorListView.as_view(), name="authors"),
 	path("author/<int:pk>", views.AuthorDetailView.as_view(), name="author-detail"),
 	path("author/create/", views.AuthorCreate.as_view(), name="author-create"),
 	path("author/<int:pk>/update/", views.AuthorUpdate.as_view(), name="author-update"),
@@ -33,7 +39,7 @@ urlpatterns += [
 # Genre related
 urlpatterns += [
 	path("genres/", views.GenresListView.as_view(), name="genres"),
-	path("genres/<int:pk>", views.genre_details, name="genre-detail"),
+	path("genres/<int:pk>", browsing.genre_details, name="genre-detail"),
 ]
 
 # User related (functional) [ member and staff]
@@ -43,4 +49,18 @@ urlpatterns += [
 	path("book/<uuid:pk>/return/", views.return_book, name="return-book"),
 	path("borrowed/", views.LibrarianListView.as_view(), name="all-borrowed"),
 	path("book/<uuid:pk>/renew/", views.renew_book_librarian, name="renew-book-librarian"),
-]
\ No newline at end of file
+	path("holds/", views.HoldListView.as_view(), name="my-holds"),
+	path("book/<int:pk>/hold/", views.place_hold, name="place-hold"),
+	path("holds/<int:pk>/cancel/", views.cancel_hold, name="cancel-hold"),
+	path("holds/<int:pk>/collect/", views.collect_hold, name="collect-hold"),
+	path("export/<str:kind>.<str:output_format>", views.export_catalog, name="catalog-export"),
+	path("cache-stats/", views.fragment_cache_stats, name="fragment-cache-stats"),
+	path("instrumentation/", views.instrumentation_stats, name="instrumentation-stats"),
+]
+
+# Read-only JSON API (see catalog.api)
+urlpatterns += [
+	path("api/books/<int:pk>/copies/", api.book_copies, name="api-book-copies"),
+	path("api/<str:kind>/", api.resource_list, name="api-list"),
+	path("api/<str:kind>/<int:pk>/", api.resource_detail, name="api-detail"),
+]
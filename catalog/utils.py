@@ -0,0 +1,15 @@
+"""
+Helpers shared by the catalog's bulk jobs (seeding, import).
+"""
+
+
+def batched(iterable, size):
+	""" Lists of ``size`` items of ``iterable`` (the last one shorter) """
+	batch = []
+	for item in iterable:
+		batch.append(item)
+		if len(batch) == size:
+			yield batch
+			batch = []
+	if batch:
+		yield batch
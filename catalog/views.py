@@ -1,56 +1,66 @@
 import datetime
+from collections import Counter
 
-from django.shortcuts import render, get_object_or_404, redirect
+from django.shortcuts import render, get_object_or_404
+from django.template.loader import render_to_string
 from django import forms as dj_forms
 from django.views import generic
 from django.views.generic.edit import CreateView, UpdateView, DeleteView
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, StreamingHttpResponse, Http404, JsonResponse
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Prefetch, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Substr
 from django.urls import reverse, reverse_lazy
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin, UserPassesTestMixin
 from django.contrib.auth.decorators import login_required, permission_required
+from django.contrib.admin.views.decorators import staff_member_required
+from django.views.decorators.http import require_POST
 from django.contrib.auth.models import User, Group
 from django.core.exceptions import ValidationError
-from django.core.mail import send_mail
 from django.utils.translation import ugettext_lazy as _
 
-from . import models, forms
+from . import models, forms, loans, exporter, visits, holds, instrumentation
+from .stats import get_catalog_stats
+from .search import search_books
+from .pagination import KeysetPaginationMixin, EstimatedCountPaginator, paginate_request
+from .outbox import queue_mail
+from .cache import cached_fragment, fragment_stats
+from .conditional import ConditionalListMixin, ConditionalPageMixin, conditional_page, count, latest
 
 
 #####################
 # Home/Landing Page #
 #####################
 
-def index(request):
-	""" View function for the home page of site """
-
-	# Generate counts of some main objects
-	num_books = models.Book.objects.count()
-	num_instances = models.BookInstance.objects.count()
-	num_authors = models.Author.objects.count()
-	num_genres = models.Genre.objects.count()
+def index_context(stats, num_visits, pending_visits):
+	return {
+		'num_books' : stats.num_books,
+		'num_instances' : stats.num_instances,
+		'num_authors' : stats.num_authors,
+		'num_instances_available' : stats.num_instances_available,
+		'num_word_books' : stats.num_word_books,
+		'num_genres' : stats.num_genres,
+		'num_visits' : num_visits,
+		'total_visits' : stats.num_visits + pending_visits,
+	}
 
-	# Available books with status 'a'
-	num_instances_available = models.BookInstance.objects.filter(status__exact='a').count()
 
-	# Books that contains 'love' word
-	num_word_books = models.Book.objects.filter(summary__icontains='love').count()
+def index(request):
+	""" View function for the home page of site """
 
-	# Number of total visits
-	num_visits = request.session.get('num_visits', 0)
-	request.session['num_visits'] = num_visits + 1
+	# Record counts are materialized in one row (see catalog.stats)
+	stats = get_catalog_stats()
 
-	context = {
-		'num_books' : num_books,
-		'num_instances' : num_instances,
-		'num_authors' : num_authors,
-		'num_instances_available' : num_instances_available,
-		'num_word_books' : num_word_books,
-		'num_genres' : num_genres,
-		'num_visits' : num_visits
-	}
+	# Visits are counted in a signed cookie and a batched counter instead
+	# of a session write per hit (see catalog.visits)
+	num_visits = visits.visitor_count(request)
+	visits.record_visit()
 
-	return render(request, "index.html", context=context)
+	context = index_context(stats, num_visits, visits.pending_visits())
+	response = render(request, "index.html", context=context)
+	visits.remember_visitor_count(response, num_visits + 1)
+	return response
 
 
 #####################
@@ -72,21 +82,23 @@ class UserRegister(UserPassesTestMixin, CreateView):
 		messages.success(self.request, "Sign Up Successful! Please verify your Email before login.")
 
 		form.instance.is_active = 0
-		response =  super(UserRegister, self).form_valid(form)
-
-		user_group = Group.objects.get(name="Library Members")
-		self.object.groups.add(user_group)
-
-		member_token = self.object.usertoken.user_token
-		site_url = f"{self.request.scheme}://{self.request.get_host()}"
-		verify_link = reverse("member-verify", args=[str(member_token), str(self.object.id)])
-		send_mail(
-			subject = "New Member Signup: Email confirmation.",
-			message = f"Welcome {self.object.username}, please click the link below \
-						to confirm your email address.{site_url}{verify_link}",
-			from_email = "lib_admin@mojo.com",
-			recipient_list = [self.object.email]
-		)
+		# The verification mail is queued in the same transaction as the user
+		with transaction.atomic():
+			response =  super(UserRegister, self).form_valid(form)
+
+			user_group = Group.objects.get(name="Library Members")
+			self.object.groups.add(user_group)
+
+			member_token = self.object.usertoken.user_token
+			site_url = f"{self.request.scheme}://{self.request.get_host()}"
+			verify_link = reverse("member-verify", args=[str(self.object.id), str(member_token)])
+			queue_mail(
+				subject = "New Member Signup: Email confirmation.",
+				message = f"Welcome {self.object.username}, please click the link below \
+							to confirm your email address.{site_url}{verify_link}",
+				from_email = "lib_admin@mojo.com",
+				recipient_list = [self.object.email]
+			)
 
 		return response
 		
@@ -136,43 +148,183 @@ class UserProfile(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
 # Generic List and Detail pages #
 #################################
 
-class BookListView(generic.ListView):
+class BookListView(ConditionalListMixin, KeysetPaginationMixin, generic.ListView):
 	model = models.Book
 	context_object_name = "library_books"
 	template_name = "book_list.html"
 	# queryset = models.Book.objects.filter(title__icontains='war')
 	paginate_by = 5
+	paginator_class = EstimatedCountPaginator
+	keyset_ordering = ('title', 'pk')
+	stamp_fields = ('pk', 'updated_at', 'author__updated_at')
 
 	def get_queryset(self):
-		query = self.request.GET.get('q')
-		if query and query == "available":
-			object_list = self.model.objects.filter(bookinstance__status="a").distinct()
-			self.paginate_by = ""
-		else:
-			object_list = self.model.objects.all()
-		return object_list
+		object_list = self.model.objects.select_related('author')
+		if self.request.GET.get('q') == "available":
+			object_list = object_list.filter(copies_available__gt=0)
+		return object_list.order_by(*self.keyset_ordering)
 
 	def get_context_data(self, **kwargs):
 		context = super(BookListView, self).get_context_data(**kwargs)
-		context['book_type'] = "Latest Books"
+		available = self.request.GET.get('q') == "available"
+		context['book_type'] = "Available Books" if available else "Latest Books"
+		context['page_query'] = "q=available" if available else ""
+		return context
+
+
+class BookSearchView(generic.ListView):
+	""" Ranked full-text search over book title, summary and author """
+	model = models.Book
+	context_object_name = "library_books"
+	template_name = "book_search.html"
+	paginate_by = 10
+
+	def get_queryset(self):
+		self.query = self.request.GET.get('q', '').strip()
+		return search_books(self.query)
+
+	def get_context_data(self, **kwargs):
+		context = super(BookSearchView, self).get_context_data(**kwargs)
+		context['query'] = self.query
 		return context
 
 
-class BookDetailView(generic.DetailView):
+class BookDetailView(ConditionalPageMixin, generic.DetailView):
+	""" Book page: the shared part is a cached fragment, reviews are rendered per request """
 	model = models.Book
 	template_name = 'book_detail.html'
+	fragment_template_name = 'fragments/book_detail.html'
+
+	def get_stamp(self):
+		# Review edits are not seen: the reviews app keeps no modification time
+		book = OuterRef('pk')
+		copies = models.BookInstance.objects.filter(book=book)
+		return self.model.objects.filter(pk=self.kwargs['pk']).values(
+					'updated_at',
+					author_updated_at = F('author__updated_at'),
+					genres_updated_at = latest(models.Genre.objects.filter(book=book)),
+					genre_count = count(models.Genre.objects.filter(book=book)),
+					languages_updated_at = latest(models.Language.objects.filter(book=book)),
+					language_count = count(models.Language.objects.filter(book=book)),
+					copies_updated_at = latest(copies),
+					copy_count = count(copies),
+					holds_waiting = count(models.Hold.objects.filter(book=book, status__exact='w')),
+					review_count = count(self.get_reviews(book)),
+					last_review = latest(self.get_reviews(book), 'pk'),
+				).first()
+
+	def get_queryset(self):
+		# Fixed number of queries whatever the number of copies or genres
+		return self.model.objects.select_related(
+					'author'
+				).prefetch_related(
+					'genre',
+					'language',
+					Prefetch('bookinstance_set', queryset=models.BookInstance.objects.order_by('due_back', 'pk')),
+				)
+
+	def get_context_data(self, **kwargs):
+		context = super(BookDetailView, self).get_context_data(**kwargs)
+		copies = self.object.bookinstance_set.all()
+		counts = Counter(copy.status for copy in copies)
+		context['copies'] = copies
+		context['holds_waiting'] = self.object.holds.filter(status__exact='w').count()
+		context['copy_counts'] = [
+			(label, counts[status]) for status, label in models.BookInstance.LOAN_STATUS if counts[status]
+		]
+		return context
+
+	def get_reviews(self, pk):
+		relation = self.model.review_set.rel
+		return relation.related_model.objects.filter(**{relation.field.name : pk}).select_related('user')
+
+	def get_hold(self, pk):
+		""" The member's active hold on the book, if any """
+		return models.Hold.objects.filter(book_id=pk, member=self.request.user, status__in=holds.ACTIVE).first()
+
+	def build_fragment(self):
+		self.object = self.get_object()
+		context = self.get_context_data(object=self.object)
+		return {
+			'title' : self.object.title,
+			'html' : render_to_string(self.fragment_template_name, context),
+		}
+
+	def get(self, request, *args, **kwargs):
+		pk = self.kwargs['pk']
+		context = {
+			'book_pk' : pk,
+			'fragment' : cached_fragment('book-detail', request, [('book', pk)], self.build_fragment),
+			'reviews' : self.get_reviews(pk),
+		}
+		if request.user.is_authenticated:
+			context['hold'] = self.get_hold(pk)
+		return render(request, self.template_name, context=context)
 
 
+# Characters of the summary shown per book on author and genre pages
+SUMMARY_EXCERPT_LENGTH = 300
 
-class AuthorListView(generic.ListView):
+GENRE_BOOKS_PER_PAGE = 25
+
+
+class AuthorListView(ConditionalListMixin, generic.ListView):
 	model = models.Author
 	template_name = "author_list.html"
 	paginate_by = 10
+	paginator_class = EstimatedCountPaginator
+	stamp_fields = ('pk', 'updated_at', 'num_books', 'copies_available', 'copies_on_loan')
+
+	def get_queryset(self):
+		# One grouped query over the books' copy counters
+		return models.Author.objects.annotate(
+					num_books = Count('book'),
+					copies_available = Coalesce(Sum('book__copies_available'), 0),
+					copies_on_loan = Coalesce(Sum('book__copies_on_loan'), 0),
+				).order_by('last_name', 'first_name', 'pk')
 
 
-class AuthorDetailView(generic.DetailView):
+class AuthorDetailView(ConditionalPageMixin, generic.DetailView):
 	model = models.Author
 	template_name = "author_detail.html"
+	fragment_template_name = "fragments/author_detail.html"
+	paginate_by = 25
+
+	def get_stamp(self):
+		books = models.Book.objects.filter(author=OuterRef('pk'))
+		return self.model.objects.filter(pk=self.kwargs['pk']).values(
+					'updated_at',
+					books_updated_at = latest(books),
+					book_count = count(books),
+				).first()
+
+	def build_fragment(self):
+		self.object = self.get_object()
+		context = self.get_context_data(object=self.object)
+		return {'html' : render_to_string(self.fragment_template_name, context)}
+
+	def get_context_data(self, **kwargs):
+		context = super(AuthorDetailView, self).get_context_data(**kwargs)
+		books = (self.object.book_set
+					.only('title', 'author')
+					.annotate(summary_excerpt=Substr('summary', 1, SUMMARY_EXCERPT_LENGTH)))
+		page, is_paginated = paginate_request(self.request, books, ('title', 'pk'), self.paginate_by)
+		context.update({
+			'books' : page,
+			'page_obj' : page,
+			'is_paginated' : is_paginated,
+			'request' : self.request,
+			'summary_length' : SUMMARY_EXCERPT_LENGTH,
+		})
+		return context
+
+	def get(self, request, *args, **kwargs):
+		pk = self.kwargs['pk']
+		context = {
+			'author_pk' : pk,
+			'fragment' : cached_fragment('author-detail', request, [('author', pk)], self.build_fragment),
+		}
+		return render(request, self.template_name, context=context)
 
 
 class BorrowerListView(LoginRequiredMixin, generic.ListView):
@@ -181,6 +333,7 @@ class BorrowerListView(LoginRequiredMixin, generic.ListView):
 	template_name = 'borrower_list_view.html'
 	context_object_name = 'borrowed_books'
 	paginate_by = 10
+	paginator_class = EstimatedCountPaginator
 
 	def get_queryset(self):
 		return models.BookInstance.objects.filter(
@@ -198,37 +351,112 @@ class LibrarianListView(PermissionRequiredMixin, generic.ListView):
 	model = models.BookInstance
 	template_name = 'librarian_records.html'
 	context_object_name = 'librarian_records'
+	paginate_by = 25
 
 	def get_queryset(self):
-		return models.BookInstance.objects.filter(
+		self.filter_form = forms.LoanFilterForm(self.request.GET or None)
+		object_list = models.BookInstance.objects.filter(
 					status__exact='o'
-				).order_by(
-					'due_back'
+				).select_related(
+					'book', 'borrower'
+				).annotate(
+					is_overdue = models.BookInstance.overdue_expression()
 				)
 
+		if self.filter_form.is_valid():
+			data = self.filter_form.cleaned_data
+			if data['overdue']:
+				object_list = object_list.filter(due_back__lt=datetime.date.today())
+			if data['borrower']:
+				object_list = object_list.filter(borrower__username=data['borrower'])
+			if data['due_after']:
+				object_list = object_list.filter(due_back__gte=data['due_after'])
+			if data['due_before']:
+				object_list = object_list.filter(due_back__lte=data['due_before'])
+
+		return object_list.order_by('due_back', 'pk')
 
-class GenresListView(generic.ListView):
+	def get_context_data(self, **kwargs):
+		context = super(LibrarianListView, self).get_context_data(**kwargs)
+		query = self.request.GET.copy()
+		query.pop('page', None)
+		context['filter_form'] = self.filter_form
+		context['page_query'] = query.urlencode()
+		return context
+
+
+class GenresListView(ConditionalListMixin, generic.ListView):
 	model = models.Genre
 	template_name = 'genre_list.html'
 	paginate_by = 10
+	paginator_class = EstimatedCountPaginator
+	stamp_fields = ('pk', 'updated_at', 'num_books')
+
+	def get_queryset(self):
+		# Book counts come from one grouped query over the genre/book table
+		return models.Genre.objects.annotate(num_books=Count('book')).order_by('name', 'pk')
+
+
+def genre_stamp(request, pk):
+	books = models.Book.objects.filter(genre=OuterRef('pk'))
+	return models.Genre.objects.filter(pk=pk).values(
+				'updated_at',
+				books_updated_at = latest(books),
+				book_count = count(books),
+				authors_updated_at = latest(models.Author.objects.filter(book__genre=OuterRef('pk'))),
+			).first()
+
+
+def genre_books(pk):
+	# Only the listed columns and a database side prefix of the summary
+	# are fetched, authors come from the same query
+	return (models.Book.objects
+				.filter(genre=pk)
+				.select_related('author')
+				.only('title', 'author__first_name', 'author__last_name')
+				.annotate(summary_excerpt=Substr('summary', 1, SUMMARY_EXCERPT_LENGTH)))
+
+
+def genre_fragment(request, genre, page, is_paginated):
+	context = {
+		'book_genre' : page,
+		'page_obj' : page,
+		'is_paginated' : is_paginated,
+		'genre' : genre,
+		'request' : request,
+		'summary_length' : SUMMARY_EXCERPT_LENGTH,
+	}
+	return {
+		'title' : genre.name,
+		'html' : render_to_string("fragments/genre_detail.html", context),
+	}
 
 
+@conditional_page(genre_stamp)
 def genre_details(request, pk):
-	genre = get_object_or_404(models.Genre, id=pk)
+	def build_fragment():
+		genre = get_object_or_404(models.Genre, id=pk)
+		page, is_paginated = paginate_request(request, genre_books(pk), ('title', 'pk'), GENRE_BOOKS_PER_PAGE)
+		return genre_fragment(request, genre, page, is_paginated)
 
-	if genre:
-		books = models.Book.objects.filter(
-				genre = pk
-			)
+	context = {
+		'fragment' : cached_fragment('genre-detail', request, [('genre', pk)], build_fragment),
+	}
+	return render(request, "genre_detail.html", context=context)
 
-		context = {
-			'book_genre' : books,
-			'genre' : genre
-		}
 
-		return render(request, "genre_detail.html", context=context)
+@staff_member_required
+def fragment_cache_stats(request):
+	""" Hit/miss counters of the detail page fragment cache """
+	return JsonResponse(fragment_stats())
+
 
-	return redirect('index')
+@staff_member_required
+def instrumentation_stats(request):
+	""" Per-view averages of the sampled requests (see catalog.instrumentation), POST resets them """
+	if request.method == "POST":
+		instrumentation.reset_stats()
+	return JsonResponse(instrumentation.view_stats())
 
 
 
@@ -245,10 +473,9 @@ def renew_book_librarian(request, pk):
 		form = forms.RenewBookForm(request.POST)
 
 		if form.is_valid():
-			book_instance.due_back = form.cleaned_data['renewal_date']
-			book_instance.save()
-
-			return HttpResponseRedirect(reverse('all-borrowed'))
+			if loans.renew_copy(book_instance.pk, form.cleaned_data['renewal_date'], book_instance.book_id):
+				return HttpResponseRedirect(reverse('all-borrowed'))
+			form.add_error(None, ValidationError(_("Renewal failed - this copy is no longer on loan.")))
 
 	else:
 		proposed_renewal_date = datetime.date.today() + datetime.timedelta(weeks=3)
@@ -262,6 +489,20 @@ def renew_book_librarian(request, pk):
 	return render(request, "book_renew_librarian.html", context=context)
 
 
+@staff_member_required
+def export_catalog(request, kind, output_format):
+	""" Streams the books or loans export without building it in memory """
+	if kind not in exporter.EXPORTS or output_format not in exporter.RENDERERS:
+		raise Http404("Unknown export.")
+
+	response = StreamingHttpResponse(
+		exporter.export_lines(kind, output_format),
+		content_type = exporter.CONTENT_TYPES[output_format]
+	)
+	response['Content-Disposition'] = f'attachment; filename="{kind}.{output_format}"'
+	return response
+
+
 ##################################
 # Authors Create, Update, Delete #
 ##################################
@@ -334,9 +575,11 @@ class BookDelete(PermissionRequiredMixin, DeleteView):
 class BorrowBook(LoginRequiredMixin, UpdateView):
 	model = models.BookInstance
 	fields = ['book', 'imprint', 'due_back']
-	initial = {"due_back":datetime.date.today() + datetime.timedelta(weeks=3)}
 	success_url = reverse_lazy('my-borrowed')
 
+	def get_initial(self):
+		return {"due_back" : loans.default_due_date()}
+
 	def get_form(self, form_class=None):
 		if form_class is None:
 			form_class = self.get_form_class()
@@ -349,21 +592,81 @@ class BorrowBook(LoginRequiredMixin, UpdateView):
 		return form
 
 	def form_valid(self, form, **kwargs):
-		form.instance.borrower = self.request.user
-		form.instance.status = "o"
+		# Only the loan columns are written, and only if the copy is still available
+		if not loans.borrow_copy(self.object.pk, self.request.user, form.cleaned_data['due_back'], self.object.book_id):
+			context = {"book_instance" : self.object}
+			return render(self.request, "borrow_conflict.html", context=context, status=409)
 
-		return super().form_valid(form)
+		messages.success(self.request, f"You have borrowed ({self.object.book.title}).")
+		return HttpResponseRedirect(self.get_success_url())
 
 
 @login_required
 def return_book(request, pk):
-	book_instance = get_object_or_404(models.BookInstance, pk=pk)
-	if book_instance.is_overdue:
+	book_instance = get_object_or_404(models.BookInstance.objects.select_related('book'), pk=pk)
+	if loans.return_copy(pk, request.user, book_instance.book_id):
+		messages.success(request, f"Thank you, for returning book ({book_instance.book.title}) on time.")
+	elif book_instance.status == 'o' and book_instance.borrower_id == request.user.pk and book_instance.is_overdue:
 		messages.error(request, "Return Failed due to overdue loan period. Please pay fine of Rs. 150/- and handover the book in person.")
 	else:
-		book_instance.due_back = None
-		book_instance.status = "m"
-		book_instance.borrower = None
-		book_instance.save()
-		messages.success(request, f"Thank you, for returning book ({book_instance.book.title}) on time.")
-	return HttpResponseRedirect(reverse('my-borrowed'))
\ No newline at end of file
+		messages.error(request, f"Return Failed. ({book_instance.book.title}) is not on loan to you.")
+	return HttpResponseRedirect(reverse('my-borrowed'))
+
+
+
+#############################
+# Holds (reservation queue) #
+#############################
+
+class HoldListView(LoginRequiredMixin, generic.ListView):
+	""" The current member's active holds with their place in each queue """
+	model = models.Hold
+	template_name = 'hold_list.html'
+	context_object_name = 'holds'
+
+	def get_queryset(self):
+		waiting_ahead = models.Hold.objects.filter(
+							book=OuterRef('book'), status__exact='w', created_at__lt=OuterRef('created_at')
+						).order_by().values('book').annotate(ahead=Count('pk')).values('ahead')
+		return models.Hold.objects.filter(
+					member = self.request.user,
+					status__in = holds.ACTIVE,
+				).select_related(
+					'book'
+				).annotate(
+					position = Coalesce(Subquery(waiting_ahead), Value(0)) + 1
+				).order_by('status', 'created_at')
+
+
+@login_required
+@require_POST
+def place_hold(request, pk):
+	book = get_object_or_404(models.Book, pk=pk)
+	hold = holds.place_hold(book.pk, request.user)
+	if hold and hold.status == 'r':
+		messages.success(request, f"A copy of ({book.title}) is reserved for you.")
+	elif hold:
+		messages.success(request, f"You are in the queue for ({book.title}).")
+	else:
+		messages.error(request, f"You already hold ({book.title}).")
+	return HttpResponseRedirect(book.get_absolute_url())
+
+
+@login_required
+@require_POST
+def cancel_hold(request, pk):
+	if holds.cancel_hold(pk, request.user):
+		messages.success(request, "Your hold has been cancelled.")
+	else:
+		messages.error(request, "This hold is no longer active.")
+	return HttpResponseRedirect(reverse('my-holds'))
+
+
+@login_required
+@require_POST
+def collect_hold(request, pk):
+	if loans.collect_hold(pk, request.user):
+		messages.success(request, "The reserved copy has been lent to you.")
+		return HttpResponseRedirect(reverse('my-borrowed'))
+	messages.error(request, "This hold is not ready for pickup.")
+	return HttpResponseRedirect(reverse('my-holds'))
@@ -0,0 +1,82 @@
+"""
+Home page visit counting without a database write per request.
+
+Each visitor's own count lives in a signed cookie, so ``index`` no longer
+touches the session (which meant an UPDATE of ``django_session`` on every
+hit). The site wide total is incremented in the cache and added to
+``CatalogStats.num_visits`` in batches: at most every
+``CATALOG_VISIT_FLUSH_EVERY`` visits or ``CATALOG_VISIT_FLUSH_SECONDS``
+seconds, and whenever ``reconcile_catalog_stats`` runs. Visits still pending
+in a cache that is lost (e.g. the per process local memory cache on restart)
+are not counted.
+"""
+import time
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+
+from .stats import adjust_catalog_stats, get_catalog_stats
+
+
+VISITS_COOKIE = "num_visits"
+VISITS_COOKIE_SALT = "catalog.visits"
+VISITS_COOKIE_AGE = 60 * 60 * 24 * 365
+
+PENDING_KEY = "catalog:visits:pending"
+FLUSHED_AT_KEY = "catalog:visits:flushed-at"
+FLUSH_LOCK_KEY = "catalog:visits:flush-lock"
+
+
+def visitor_count(request):
+	""" Number of earlier home page visits of this browser """
+	try:
+		return int(request.get_signed_cookie(VISITS_COOKIE, default=0, salt=VISITS_COOKIE_SALT))
+	except (ValueError, signing.BadSignature):
+		return 0
+
+
+def remember_visitor_count(response, count):
+	response.set_signed_cookie(VISITS_COOKIE, str(count), salt=VISITS_COOKIE_SALT,
+							   max_age=VISITS_COOKIE_AGE, httponly=True, samesite='Lax')
+
+
+def pending_visits():
+	return cache.get(PENDING_KEY, 0)
+
+
+def record_visit():
+	""" Count one visit in the cache, flushing the batch when it is due """
+	try:
+		pending = cache.incr(PENDING_KEY)
+	except ValueError:
+		cache.add(PENDING_KEY, 0, None)
+		pending = cache.incr(PENDING_KEY)
+
+	flushed_at = cache.get(FLUSHED_AT_KEY)
+	if flushed_at is None:
+		cache.add(FLUSHED_AT_KEY, time.time(), None)
+		flushed_at = time.time()
+
+	if (pending >= getattr(settings, 'CATALOG_VISIT_FLUSH_EVERY', 100)
+			or time.time() - flushed_at >= getattr(settings, 'CATALOG_VISIT_FLUSH_SECONDS', 60)):
+		flush_visits()
+
+
+def flush_visits():
+	""" Move the pending visits to ``CatalogStats`` in one UPDATE, returns how many """
+	# One flusher at a time, the others keep counting
+	if not cache.add(FLUSH_LOCK_KEY, 1, 30):
+		return 0
+	try:
+		pending = cache.get(PENDING_KEY, 0)
+		if pending:
+			# visits counted meanwhile stay pending
+			cache.decr(PENDING_KEY, pending)
+			# a missing row would be rebuilt from live counts, dropping the batch
+			get_catalog_stats()
+			adjust_catalog_stats(num_visits=pending)
+		cache.set(FLUSHED_AT_KEY, time.time(), None)
+		return pending
+	finally:
+		cache.delete(FLUSH_LOCK_KEY)
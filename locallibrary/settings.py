@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 from django.contrib.messages import constants as messages
 from pathlib import Path
 import os
+import sys
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -44,16 +45,21 @@ INSTALLED_APPS = [
 
 LINK_MODEL = "catalog.Book"
 
+# Full-text search backend for books: "auto" (FULLTEXT on MySQL, postings elsewhere), "fulltext" or "postings"
+CATALOG_SEARCH_BACKEND = "auto"
+
 # To allow inactive users to authenticate (default=ModelBackend)
 AUTHENTICATION_BACKENDS = ['django.contrib.auth.backends.AllowAllUsersModelBackend']
 
 # MIDDLEWARE = [
 MIDDLEWARE = [
+    'catalog.middleware.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'catalog.middleware.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -63,7 +69,9 @@ ROOT_URLCONF = 'locallibrary.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, timing renders for catalog.instrumentation
+        'BACKEND': 'catalog.instrumentation.TimedDjangoTemplates',
+        'NAME': 'django',
         'DIRS': [os.path.join(BASE_DIR, 'templates')],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -91,9 +99,75 @@ DATABASES = {
         'PASSWORD' : '',
         'HOST'  : '127.0.0.1',
         'PORT'  : '3306',
+        # Connections are kept between requests, which the concurrent
+        # queries of the async views need (CATALOG_ASYNC_CONCURRENT_QUERIES)
+        'CONN_MAX_AGE' : 60,
     }
 }
 
+# Catalog reads of anonymous GET requests are spread over these DATABASES
+# aliases (writes always go to "default"), e.g. for a local check with two
+# SQLite files:
+#   DATABASES['replica'] = {'ENGINE': 'django.db.backends.sqlite3',
+#                           'NAME': BASE_DIR / 'replica.sqlite3',
+#                           'TEST': {'MIRROR': 'default'}}
+#   CATALOG_READ_REPLICAS = ['replica']
+CATALOG_READ_REPLICAS = []
+
+# Seconds a client keeps reading from the primary after it wrote something
+CATALOG_PRIMARY_STICKY_SECONDS = 10
+
+DATABASE_ROUTERS = ['catalog.routers.ReplicaRouter']
+
+# Sessions are read through the cache and only written to the database when
+# they change. Alternatives:
+#   'django.contrib.sessions.backends.db'             (a query per request)
+#   'django.contrib.sessions.backends.cache'          (no database, lost with the cache)
+#   'django.contrib.sessions.backends.signed_cookies' (no server state, 4kB limit)
+# Compare them with `python manage.py benchmark_home_page`.
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+# Home page visits are added to the database in batches (see catalog.visits)
+CATALOG_VISIT_FLUSH_EVERY = 100
+CATALOG_VISIT_FLUSH_SECONDS = 60
+
+# Paginated lists longer than this many rows show estimated counts from the
+# table statistics or the cache (see catalog.pagination.EstimatedCountPaginator)
+CATALOG_ESTIMATED_COUNT_THRESHOLD = 10000
+CATALOG_COUNT_CACHE_SECONDS = 60
+
+# Seconds browsers and shared caches may reuse a catalog page served to an
+# anonymous visitor before revalidating it (see catalog.conditional)
+CATALOG_PUBLIC_PAGE_MAX_AGE = 60
+
+# Route the read-heavy catalog pages to catalog.async_views. Set by
+# locallibrary/asgi.py: under WSGI every async view would need an event loop
+CATALOG_ASYNC_VIEWS = os.environ.get('CATALOG_ASYNC_VIEWS') == '1'
+
+# Let the async views run their independent queries at once in worker
+# threads, each with its own database connection (see catalog.threads).
+# Only done with persistent connections (CONN_MAX_AGE in DATABASES, set
+# above), a database without them would be connected to for every call
+CATALOG_ASYNC_CONCURRENT_QUERIES = True
+
+# Fraction of requests whose queries, DB/template time and size are recorded
+# (see catalog.instrumentation, stats at /catalog/instrumentation/ for staff).
+# Off while running the tests, the instrumentation tests turn it on
+CATALOG_INSTRUMENTATION_SAMPLE_RATE = 0 if sys.argv[1:2] == ['test'] else 0.01
+# Log the request at WARNING when one SQL statement ran this many times
+CATALOG_INSTRUMENTATION_REPEAT_WARNING = 5
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'catalog.instrumentation': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators